@@ -6,23 +6,145 @@ from flask_login import LoginManager
 # init SQLAlchemy so we can use it later in our models
 db = SQLAlchemy()
 
-def create_app():
+from . import database
+
+def create_app(test_config=None):
     app = Flask(__name__)
 
     app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY')
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db.sqlite'
+    app.config['SQLALCHEMY_DATABASE_URI'] = database.database_url()
+
+    # connection pool for server databases (DB_STATEMENT_TIMEOUT in ms, PostgreSQL only, 0 disables it)
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    app.config['DB_STATEMENT_TIMEOUT'] = int(os.environ.get('DB_STATEMENT_TIMEOUT', 30000))
+
+    # SQLite pragmas (busy timeout in ms, mmap size in bytes); WAL journal mode is always on
+    app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+    app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+
+    # SMS notifications: 'plivo' sends through the Plivo API, 'fake' records messages in memory
+    app.config['SMS_BACKEND'] = os.environ.get('SMS_BACKEND', 'plivo')
+    app.config['SMS_WORKERS'] = int(os.environ.get('SMS_WORKERS', 2))
+    app.config['SMS_QUEUE_SIZE'] = int(os.environ.get('SMS_QUEUE_SIZE', 1000))
+    app.config['SMS_MAX_RETRIES'] = int(os.environ.get('SMS_MAX_RETRIES', 3))
+    app.config['SMS_RETRY_BACKOFF'] = float(os.environ.get('SMS_RETRY_BACKOFF', 0.5))
+
+    # inbound SMS commands: worker threads, pending messages and most transactions a LAST reply and a
+    # STMT statement list
+    app.config['INBOUND_WORKERS'] = int(os.environ.get('INBOUND_WORKERS', 2))
+    app.config['INBOUND_QUEUE_SIZE'] = int(os.environ.get('INBOUND_QUEUE_SIZE', 1000))
+    app.config['INBOUND_LAST_MAX'] = int(os.environ.get('INBOUND_LAST_MAX', 10))
+    app.config['INBOUND_STATEMENT_MAX'] = int(os.environ.get('INBOUND_STATEMENT_MAX', 100))
+    # seconds a worker waits for room on a full SMS queue before giving up on a reply
+    app.config['INBOUND_REPLY_TIMEOUT'] = float(os.environ.get('INBOUND_REPLY_TIMEOUT', 10))
+    # country code of numbers stored without one (senders are matched on the full E.164 number)
+    app.config['INBOUND_COUNTRY_CODE'] = os.environ.get('INBOUND_COUNTRY_CODE', '91')
+    # Plivo auth token the /receive_sms/ webhook signature (X-Plivo-Signature-V3) is checked with;
+    # inbound SMS is refused while it is unset
+    app.config['PLIVO_AUTH_TOKEN'] = os.environ.get('PLIVO_AUTH_TOKEN')
+
+    # rows per commit for /add_transactions/bulk
+    app.config['BULK_CHUNK_SIZE'] = int(os.environ.get('BULK_CHUNK_SIZE', 1000))
+
+    # seconds an Idempotency-Key and its stored response are kept
+    app.config['IDEMPOTENCY_TTL'] = int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))
+    # seconds after which an in-progress Idempotency-Key claim is considered abandoned and can be
+    # taken over by a retry; keep it above the slowest request
+    app.config['IDEMPOTENCY_LEASE'] = int(os.environ.get('IDEMPOTENCY_LEASE', 60))
+
+    # transaction event outbox: relay batch size, minimum event age before it is read (for concurrent
+    # writers on server databases), and an optional sink relayed to from a background thread
+    app.config['OUTBOX_BATCH_SIZE'] = int(os.environ.get('OUTBOX_BATCH_SIZE', 500))
+    app.config['OUTBOX_SETTLE_SECONDS'] = float(os.environ.get('OUTBOX_SETTLE_SECONDS', 0))
+    app.config['OUTBOX_SINK'] = os.environ.get('OUTBOX_SINK')
+    app.config['OUTBOX_RELAY_INTERVAL'] = float(os.environ.get('OUTBOX_RELAY_INTERVAL', 1))
+    # shared secret consumers of /events send as 'Authorization: Bearer <token>'; unset disables the feed
+    app.config['EVENTS_TOKEN'] = os.environ.get('EVENTS_TOKEN')
+
+    # page sizes for transaction history
+    app.config['HISTORY_PAGE_SIZE'] = int(os.environ.get('HISTORY_PAGE_SIZE', 100))
+    app.config['HISTORY_MAX_PAGE_SIZE'] = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', 1000))
+
+    # transactions older than ARCHIVE_AFTER_DAYS are moved to the archive table, ARCHIVE_BATCH_SIZE rows per commit
+    app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+    app.config['ARCHIVE_BATCH_SIZE'] = int(os.environ.get('ARCHIVE_BATCH_SIZE', 5000))
+
+    # PDF statements: largest transaction_count accepted and rows rendered per table chunk
+    app.config['STATEMENT_MAX_TRANSACTIONS'] = int(os.environ.get('STATEMENT_MAX_TRANSACTIONS', 50000))
+    app.config['STATEMENT_CHUNK_SIZE'] = int(os.environ.get('STATEMENT_CHUNK_SIZE', 500))
+
+    # statement jobs: worker processes (0 runs jobs inside the request) and where PDFs are stored ('s3' or 'local')
+    app.config['STATEMENT_WORKERS'] = int(os.environ.get('STATEMENT_WORKERS', os.cpu_count() or 1))
+    app.config['STATEMENT_STORAGE'] = os.environ.get('STATEMENT_STORAGE', 's3')
+    app.config['STATEMENT_LOCAL_DIR'] = os.environ.get('STATEMENT_LOCAL_DIR', os.path.join(app.instance_path, 'statements'))
+
+    # cache of rendered statements reused for identical requests (0 entries disables it); TTL in seconds
+    app.config['STATEMENT_CACHE_SIZE'] = int(os.environ.get('STATEMENT_CACHE_SIZE', 10000))
+    app.config['STATEMENT_CACHE_TTL'] = int(os.environ.get('STATEMENT_CACHE_TTL', 7 * 24 * 3600))
+
+    # payment-due reminders: look-ahead days, batch size and in-app run interval in seconds (0 disables the thread)
+    app.config['REMINDER_DAYS'] = int(os.environ.get('REMINDER_DAYS', 3))
+    app.config['REMINDER_BATCH_SIZE'] = int(os.environ.get('REMINDER_BATCH_SIZE', 1000))
+    app.config['REMINDER_INTERVAL'] = int(os.environ.get('REMINDER_INTERVAL', 0))
+
+    # per-process cache of users and their product lists
+    app.config['CACHE_SIZE'] = int(os.environ.get('CACHE_SIZE', 1024))
+    app.config['CACHE_TTL'] = int(os.environ.get('CACHE_TTL', 60))
+
+    # /analytics results cached per process (entries are also keyed by the product version)
+    app.config['ANALYTICS_CACHE_SIZE'] = int(os.environ.get('ANALYTICS_CACHE_SIZE', 256))
+    app.config['ANALYTICS_CACHE_TTL'] = int(os.environ.get('ANALYTICS_CACHE_TTL', 300))
+
+    # password hashing: method for new hashes, concurrent hashes, callers allowed to queue and seconds they wait
+    app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+    app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64))
+    app.config['PASSWORD_HASH_WAIT'] = float(os.environ.get('PASSWORD_HASH_WAIT', 5))
+
+    # logging of the package's modules: level and 'text' or 'json' lines
+    app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+    app.config['LOG_FORMAT'] = os.environ.get('LOG_FORMAT', 'text')
+
+    # Prometheus /metrics endpoint, and cProfile runs for requests with X-Profile: <PROFILING_TOKEN>
+    # or for a PROFILING_SAMPLE_RATE fraction of all requests
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+    app.config['PROFILING_TOKEN'] = os.environ.get('PROFILING_TOKEN')
+    app.config['PROFILING_SAMPLE_RATE'] = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+    app.config['PROFILING_DIR'] = os.environ.get('PROFILING_DIR', os.path.join(app.instance_path, 'profiles'))
+
+    # overrides for tests and local runs, e.g. {'SMS_CLIENT_FACTORY': lambda: FakeClient()}
+    if test_config:
+        app.config.update(test_config)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', database.engine_options(app.config))
+
+    from . import logs
+    logs.init_app(app)
 
     db.init_app(app)
+    with app.app_context():
+        database.init_app(app)
     login_manager = LoginManager()
     login_manager.login_view = 'auth.login'
     login_manager.init_app(app)
 
-    from .models import User
+    from . import cache
+    cache.init_app(app)
+
+    from . import passwords
+    passwords.init_app(app)
 
     @login_manager.user_loader
     def load_user(user_id):
-        # since the user_id is just the primary key of our user table, use it in the query for the user
-        return User.query.get(int(user_id))
+        # since the user_id is just the primary key of our user table, use it to look up the (cached) user
+        return cache.get_user(int(user_id))
+
+    # request latency, SQL and profiling instrumentation and the /metrics endpoint
+    from . import metrics
+    metrics.init_app(app)
 
     # blueprint for auth routes in our app
     from .auth import auth as auth_blueprint
@@ -33,8 +155,45 @@ def create_app():
     app.register_blueprint(main_blueprint)
 
 
-    from . import models
-    with app.app_context():
-        db.create_all()
+    # background SMS dispatcher used by the request handlers
+    from . import notifications
+    notifications.init_app(app)
+
+    # inbound SMS command workers
+    from . import inbound
+    inbound.init_app(app)
+
+    # statement job worker pool and its recovery command
+    from . import jobs
+    jobs.init_app(app)
+
+    # statement cache eviction command
+    from . import statement_cache
+    statement_cache.init_app(app)
+
+    # payment-due reminder command and optional scheduler thread
+    from . import reminders
+    reminders.init_app(app)
+
+    # idempotency record purge command
+    from . import idempotency
+    idempotency.init_app(app)
+
+    # transaction archival command
+    from . import archive
+    archive.init_app(app)
+
+    # analytics result cache
+    from . import analytics
+    analytics.init_app(app)
+
+    # outbox relay command and optional relay thread
+    from . import outbox
+    outbox.init_app(app)
+
+    # balance snapshot rebuild command
+    from . import balances
+    balances.init_app(app)
 
-    return app
\ No newline at end of file
+    # the schema is created by 'flask migrate' (database.migrate), not on every start
+    return app
@@ -0,0 +1,176 @@
+import functools
+from datetime import datetime, timedelta, time as dt_time
+
+from flask import current_app
+from sqlalchemy import func
+
+from . import db
+from .models import Product, BalanceSnapshot
+from .balances import balance_as_of
+from .history import TIERS
+from .cache import TTLCache
+from .serializers import transaction_query, transaction_dicts
+from .money import MINOR_UNITS, to_major
+
+
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    """
+    Imports NumPy on first use, so it isn't loaded at startup.
+
+    Returns:
+        module: numpy, or None if it isn't installed (average balances then fall back to a pure Python pass).
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _month(column):
+    """
+    SQL expression formatting a date column as 'YYYY-MM' in the current database's dialect.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return func.to_char(column, 'YYYY-MM')
+    if dialect in ('mysql', 'mariadb'):
+        return func.date_format(column, '%Y-%m')
+    return func.strftime('%Y-%m', column)
+
+
+def monthly_totals(product_id, start, end):
+    """
+    Sums a product's credits, debits and transaction counts per month with a GROUP BY over the daily
+    balance snapshots, which already hold the per-day totals.
+
+    Returns:
+        list: Dictionaries with month ('YYYY-MM'), total_credit and total_debit (in rupees) and transaction_count,
+            in month order.
+    """
+    month = _month(BalanceSnapshot.snapshot_date)
+    rows = db.session.query(month.label('month'), func.sum(BalanceSnapshot.total_credit),
+                            func.sum(BalanceSnapshot.total_debit), func.sum(BalanceSnapshot.transaction_count)) \
+        .filter(BalanceSnapshot.product_id == product_id, BalanceSnapshot.snapshot_date >= start,
+                BalanceSnapshot.snapshot_date <= end) \
+        .group_by(month).order_by(month).all()
+    return [{'month': row[0], 'total_credit': to_major(row[1]), 'total_debit': to_major(row[2]),
+             'transaction_count': int(row[3])} for row in rows]
+
+
+def _daily_closings_numpy(opening, offsets, closings, days):
+    np = _numpy()
+    offsets = np.asarray(offsets, dtype=np.int64)
+    closings = np.asarray(closings, dtype=np.int64)
+    # index of the last snapshot at or before each day (-1 before the first one)
+    latest = np.searchsorted(offsets, np.arange(days), side='right') - 1
+    values = np.where(latest >= 0, closings[np.maximum(latest, 0)], opening)
+    return float(values.mean()), int(values.min()), int(values.max())
+
+
+def _daily_closings_python(opening, offsets, closings, days):
+    total, low, high = 0, float('inf'), float('-inf')
+    balance, i = opening, 0
+    for day in range(days):
+        while i < len(offsets) and offsets[i] <= day:
+            balance = closings[i]
+            i += 1
+        total += balance
+        low, high = min(low, balance), max(high, balance)
+    return total / days, low, high
+
+
+def balance_stats(product_id, start, end):
+    """
+    Computes the average, lowest and highest end-of-day balance of a product between two dates.
+
+    The closing balances of the days with transactions are read from the daily snapshots in one
+    query; days without transactions carry the previous closing balance forward, starting from the
+    balance at the end of the day before start. Balances are summed in paise; NumPy is used when it
+    is installed.
+
+    Returns:
+        dict: average_daily_balance, min_daily_balance and max_daily_balance (in rupees) and days, or None if the
+            range is empty.
+    """
+    days = (end - start).days + 1
+    if days < 1:
+        return None
+    opening = balance_as_of(product_id, start - timedelta(days=1))
+    rows = db.session.query(BalanceSnapshot.snapshot_date, BalanceSnapshot.closing_balance) \
+        .filter(BalanceSnapshot.product_id == product_id, BalanceSnapshot.snapshot_date >= start,
+                BalanceSnapshot.snapshot_date <= end) \
+        .order_by(BalanceSnapshot.snapshot_date).all()
+    offsets = [(row.snapshot_date - start).days for row in rows]
+    closings = [row.closing_balance for row in rows]
+
+    if not rows:
+        average = low = high = opening
+    else:
+        compute = _daily_closings_numpy if _numpy() is not None else _daily_closings_python
+        average, low, high = compute(opening, offsets, closings, days)
+    return {'average_daily_balance': round(average / MINOR_UNITS, 2), 'min_daily_balance': to_major(low),
+            'max_daily_balance': to_major(high), 'days': days}
+
+
+def largest_transactions(product_id, start, end, limit=10):
+    """
+    Returns a product's largest transactions (by amount credited or debited) between two dates,
+    sorted and limited by the database in the hot and archive tables, then merged.
+    """
+    rows = []
+    for model in TIERS:
+        rows += transaction_query(model) \
+            .filter(model.product_id == product_id,
+                    model.transaction_date >= datetime.combine(start, dt_time.min),
+                    model.transaction_date <= datetime.combine(end, dt_time.max)) \
+            .order_by((model.amount_credit + model.amount_debit).desc(), model.transaction_id) \
+            .limit(limit).all()
+    rows.sort(key=lambda row: (-(row.amount_credit + row.amount_debit), row.transaction_id))
+    return transaction_dicts(rows[:limit], with_time=True)
+
+
+def product_analytics(product_id, start, end, top=10):
+    """
+    Builds the spending analytics of a product over a date range, cached per (product, range).
+
+    Cache entries are keyed by Product.version, which every posting increments, so a new posting
+    makes the next request recompute the figures (in every process) while repeated requests in
+    between are served from memory.
+
+    Args:
+        product_id (str): Product to analyse.
+        start (date): First day of the range.
+        end (date): Last day of the range; days after today are ignored.
+        top (int): Number of largest transactions to return.
+
+    Returns:
+        dict: Monthly totals, balance statistics and largest transactions, or None if the product doesn't exist.
+    """
+    version = db.session.query(Product.version).filter_by(product_id=product_id).scalar()
+    if version is None:
+        return None
+    end = min(end, datetime.now().date())
+
+    cache = current_app.extensions['analytics_cache']
+    key = (product_id, start, end, top, version)
+    result = cache.get(key)
+    if result is None:
+        result = {
+            'product_id': product_id,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'monthly': monthly_totals(product_id, start, end),
+            'balance': balance_stats(product_id, start, end),
+            'largest_transactions': largest_transactions(product_id, start, end, top),
+        }
+        cache.set(key, result)
+    return result
+
+
+def init_app(app):
+    """
+    Creates the application's analytics result cache.
+    """
+    app.extensions['analytics_cache'] = TTLCache(app.config['ANALYTICS_CACHE_SIZE'], app.config['ANALYTICS_CACHE_TTL'])
@@ -0,0 +1,59 @@
+import logging
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import delete, insert, select
+
+from . import db
+from .models import Transactions, TransactionsArchive
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = ('transaction_id', 'product_id', 'amount_credit', 'amount_debit', 'transaction_date', 'balance')
+
+
+def archive_transactions(cutoff, batch_size=5000):
+    """
+    Moves the transactions dated before cutoff from Transactions to TransactionsArchive.
+
+    Rows are moved oldest first, batch_size at a time, each batch copied and deleted in its own
+    database transaction, so postings only wait on one small batch and an interrupted run can simply
+    be started again. History reads see each transaction in exactly one of the tables.
+
+    Args:
+        cutoff (datetime): Transactions strictly older than this are archived.
+        batch_size (int): Rows moved per commit.
+
+    Returns:
+        int: Number of transactions archived.
+    """
+    moved = 0
+    while True:
+        ids = [transaction_id for transaction_id, in db.session.query(Transactions.transaction_id)
+               .filter(Transactions.transaction_date < cutoff)
+               .order_by(Transactions.transaction_date, Transactions.transaction_id)
+               .limit(batch_size)]
+        if not ids:
+            return moved
+        source = select(*(getattr(Transactions, column) for column in _COLUMNS)) \
+            .where(Transactions.transaction_id.in_(ids))
+        db.session.execute(insert(TransactionsArchive).from_select(_COLUMNS, source))
+        db.session.execute(delete(Transactions).where(Transactions.transaction_id.in_(ids)))
+        db.session.commit()
+        moved += len(ids)
+        logger.info('Archived %d transactions (%d so far)', len(ids), moved)
+
+
+def init_app(app):
+    """
+    Registers the 'archive-transactions' command.
+    """
+    @app.cli.command('archive-transactions')
+    @click.option('--days', default=None, type=int, help='Archive transactions older than this many days.')
+    @click.option('--batch-size', default=None, type=int, help='Rows moved per commit.')
+    def archive_transactions_command(days, batch_size):
+        """Move old transactions to the archive table."""
+        days = app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+        cutoff = datetime.combine(datetime.now().date() - timedelta(days=days), datetime.min.time())
+        moved = archive_transactions(cutoff, batch_size or app.config['ARCHIVE_BATCH_SIZE'])
+        click.echo(f"{moved} transactions older than {cutoff.date().isoformat()} archived")
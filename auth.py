@@ -1,11 +1,15 @@
+import logging
+
 from flask import Blueprint, render_template, redirect, url_for, request, flash
 from . import db
-from werkzeug.security import generate_password_hash, check_password_hash
 from .models import User
+from .cache import invalidate_user
+from .passwords import hash_password, verify_password, needs_rehash, HasherBusy
 from flask_login import login_user, login_required, logout_user
 
 # Create a Blueprint for authentication-related routes
 auth = Blueprint('auth', __name__)
+logger = logging.getLogger(__name__)
 
 # Route for user login page
 @auth.route('/login')
@@ -24,10 +28,24 @@ def login_post():
     user = User.query.filter_by(email=email).first()
 
     # Check if the user exists and the password matches
-    if not user or not check_password_hash(user.password, password):
+    try:
+        valid = user is not None and verify_password(user.password, password)
+    except HasherBusy:
+        flash('Too many login attempts right now, please try again shortly.')
+        return render_template('login.html'), 503
+    if not valid:
         flash('Please check your login details and try again.')
         return redirect(url_for('auth.login'))  # Reload the page if login fails
 
+    # Upgrade hashes made with an older method or cost now that we know the password
+    if needs_rehash(user.password):
+        try:
+            user.password = hash_password(password)
+            db.session.commit()
+            invalidate_user(user.id)
+        except HasherBusy:
+            pass  # keep the old hash; it is upgraded on a later login
+
     # Login the user and redirect to the main page
     login_user(user, remember=remember)
     return redirect(url_for('main.index'))
@@ -46,7 +64,7 @@ def signup_post():
     password = request.form.get('password')
     contact = request.form.get('contact')
     dob=request.form.get('dob')
-    print(dob, type(dob))
+    logger.debug('Signup request for %s', email)
 
     # Check if the email already exists in the database
     user = User.query.filter_by(email=email).first()
@@ -56,9 +74,15 @@ def signup_post():
         return redirect(url_for('auth.signup'))  # Redirect to signup page if email exists
 
     # Create a new user with hashed password and add to the database
-    new_user = User(email=email, name=name, password=generate_password_hash(password, method='sha256'), contact_number=contact, dob=dob)
+    try:
+        pwhash = hash_password(password)
+    except HasherBusy:
+        flash('Too many signups right now, please try again shortly.')
+        return render_template('signup.html'), 503
+    new_user = User(email=email, name=name, password=pwhash, contact_number=contact, dob=dob)
     db.session.add(new_user)
     db.session.commit()
+    invalidate_user(new_user.id)
 
     return redirect(url_for('auth.login'))  # Redirect to login page after successful signup
 
@@ -0,0 +1,172 @@
+from datetime import datetime, time as dt_time
+
+import click
+from sqlalchemy import func, select, union_all
+
+from . import db
+from .models import Product, Transactions, TransactionsArchive, BalanceSnapshot
+
+
+def balance_change(product_type, amount_credit, amount_debit):
+    """
+    Change of a product's balance caused by a posting, following the ledger rules: credits add to a
+    savings account balance and subtract from a credit card due.
+
+    Returns:
+        int: Signed change in paise (0 for other product types, whose balance the ledger doesn't move).
+    """
+    if product_type == 'SB':
+        return amount_credit - amount_debit
+    if product_type == 'CC':
+        return amount_debit - amount_credit
+    return 0
+
+
+def record_postings(postings):
+    """
+    Folds committed-to-be postings into the daily snapshots, in the current database transaction.
+
+    Args:
+        postings (iterable): Dictionaries with product_id, transaction_date, amount_credit, amount_debit
+            and balance, in posting order.
+    """
+    days = {}
+    for posting in postings:
+        key = (posting['product_id'], posting['transaction_date'].date())
+        day = days.setdefault(key, {'closing_balance': 0, 'total_credit': 0, 'total_debit': 0, 'transaction_count': 0})
+        day['closing_balance'] = posting['balance']
+        day['total_credit'] += posting['amount_credit']
+        day['total_debit'] += posting['amount_debit']
+        day['transaction_count'] += 1
+    if not days:
+        return
+
+    # One query for the existing snapshots (a superset of the keys is fine)
+    existing = {(snapshot.product_id, snapshot.snapshot_date): snapshot for snapshot in BalanceSnapshot.query.filter(
+        BalanceSnapshot.product_id.in_({product_id for product_id, _ in days}),
+        BalanceSnapshot.snapshot_date.in_({day for _, day in days}))}
+
+    for (product_id, day), totals in days.items():
+        snapshot = existing.get((product_id, day))
+        if snapshot is None:
+            db.session.add(BalanceSnapshot(product_id=product_id, snapshot_date=day, **totals))
+        else:
+            snapshot.closing_balance = totals['closing_balance']
+            snapshot.total_credit += totals['total_credit']
+            snapshot.total_debit += totals['total_debit']
+            snapshot.transaction_count += totals['transaction_count']
+
+
+def balance_as_of(product_id, as_of):
+    """
+    Computes a product's balance at a point in time from the nearest earlier daily snapshot plus the
+    transactions posted since, without reading the rest of the history.
+
+    Args:
+        product_id (str): Product whose balance is computed.
+        as_of (datetime): Point in time; a date means the end of that day.
+
+    Returns:
+        int: Balance in paise (current_due for credit cards), or None if the product doesn't exist.
+    """
+    product = db.session.get(Product, product_id)
+    if product is None:
+        return None
+    if not isinstance(as_of, datetime):
+        as_of = datetime.combine(as_of, dt_time.max)
+
+    snapshot = BalanceSnapshot.query.filter(BalanceSnapshot.product_id == product_id,
+                                            BalanceSnapshot.snapshot_date < as_of.date()) \
+        .order_by(BalanceSnapshot.snapshot_date.desc()).first()
+    if snapshot is not None:
+        balance = snapshot.closing_balance
+    else:
+        # Nothing posted before that day: start from the opening balance, worked back from the first snapshot
+        first = BalanceSnapshot.query.filter_by(product_id=product_id) \
+            .order_by(BalanceSnapshot.snapshot_date).first()
+        if first is None:
+            return product.current_balance if product.product_type == 'SB' else product.current_due
+        balance = first.closing_balance - balance_change(product.product_type, first.total_credit, first.total_debit)
+
+    # Transactions of the as_of day up to as_of, in whichever table they are
+    total_credit = total_debit = 0
+    for model in (Transactions, TransactionsArchive):
+        credit, debit = db.session.query(
+            func.coalesce(func.sum(model.amount_credit), 0), func.coalesce(func.sum(model.amount_debit), 0)) \
+            .filter(model.product_id == product_id,
+                    model.transaction_date >= datetime.combine(as_of.date(), dt_time.min),
+                    model.transaction_date <= as_of).one()
+        total_credit += credit
+        total_debit += debit
+    return balance + balance_change(product.product_type, total_credit, total_debit)
+
+
+def daily_balances(product_id, start, end):
+    """
+    Returns the daily snapshots of a product between two dates, both included.
+
+    Returns:
+        list: BalanceSnapshot rows in date order; days without transactions have no row.
+    """
+    return BalanceSnapshot.query.filter(BalanceSnapshot.product_id == product_id,
+                                        BalanceSnapshot.snapshot_date >= start,
+                                        BalanceSnapshot.snapshot_date <= end) \
+        .order_by(BalanceSnapshot.snapshot_date).all()
+
+
+def rebuild_snapshots(product_id=None, batch_size=10000):
+    """
+    Recomputes the snapshots from the transactions, hot and archived, e.g. for transactions posted
+    before snapshots existed.
+
+    Args:
+        product_id (str): Product to rebuild, or None for all products.
+        batch_size (int): Rows streamed from the database, and snapshots inserted, at a time.
+
+    Returns:
+        int: Number of snapshots written.
+    """
+    delete = BalanceSnapshot.query
+    tiers = [select(model.product_id, model.transaction_date, model.transaction_id, model.amount_credit,
+                    model.amount_debit, model.balance) for model in (Transactions, TransactionsArchive)]
+    if product_id is not None:
+        delete = delete.filter_by(product_id=product_id)
+        tiers = [tier.where(tier.selected_columns.product_id == product_id) for tier in tiers]
+    delete.delete(synchronize_session=False)
+    history = union_all(*tiers).subquery()
+    query = db.session.query(history.c.product_id, history.c.transaction_date, history.c.amount_credit,
+                             history.c.amount_debit, history.c.balance)
+
+    written = 0
+    pending = []
+    current = None
+    for row in query.order_by(history.c.product_id, history.c.transaction_date,
+                              history.c.transaction_id).yield_per(batch_size):
+        key = (row.product_id, row.transaction_date.date())
+        if current is None or (current['product_id'], current['snapshot_date']) != key:
+            current = {'product_id': key[0], 'snapshot_date': key[1], 'closing_balance': 0,
+                       'total_credit': 0, 'total_debit': 0, 'transaction_count': 0}
+            pending.append(current)
+        current['closing_balance'] = row.balance
+        current['total_credit'] += row.amount_credit
+        current['total_debit'] += row.amount_debit
+        current['transaction_count'] += 1
+        # keep the snapshot being built; flush the finished ones
+        if len(pending) > batch_size:
+            db.session.bulk_insert_mappings(BalanceSnapshot, pending[:-1])
+            written += len(pending) - 1
+            pending = pending[-1:]
+    db.session.bulk_insert_mappings(BalanceSnapshot, pending)
+    db.session.commit()
+    return written + len(pending)
+
+
+def init_app(app):
+    """
+    Registers the 'rebuild-snapshots' command.
+    """
+    @app.cli.command('rebuild-snapshots')
+    @click.option('--product-id', default=None, help='Only rebuild this product.')
+    def rebuild_snapshots_command(product_id):
+        """Recompute daily balance snapshots from the transactions."""
+        click.echo(f"{rebuild_snapshots(product_id)} snapshots written")
@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+
+from . import db
+from .models import User, Product
+
+# Read-only view of a product, as cached for the product lists
+ProductSummary = namedtuple('ProductSummary', ['product_id', 'product_type', 'date_of_opening', 'current_balance',
+                                               'current_due', 'payment_due_date'])
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire ttl seconds after being stored.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class IdentityCache:
+    """
+    Per-process caches of users (by ID) and of each user's products, with invalidation hooks.
+
+    Each web worker has its own copy, so changes made by another process show up after at most
+    ttl seconds; changes made in this process are invalidated explicitly.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.users = TTLCache(maxsize, ttl)
+        self.products = TTLCache(maxsize, ttl)
+        # product_id -> user_id of the products in the cached lists
+        self.owners = TTLCache(maxsize * 16, ttl)
+
+    def invalidate_user(self, user_id):
+        self.users.pop(user_id)
+
+    def invalidate_products(self, user_id):
+        self.products.pop(user_id)
+
+    def invalidate_product_ids(self, product_ids):
+        for product_id in product_ids:
+            user_id = self.owners.get(product_id)
+            if user_id is not None:
+                self.owners.pop(product_id)
+                self.products.pop(user_id)
+
+
+def get_cache():
+    return current_app.extensions['identity_cache']
+
+
+def get_user(user_id):
+    """
+    Returns a User attached to the current session, without a query if it is cached.
+
+    Args:
+        user_id (int): User ID.
+
+    Returns:
+        User: The user, or None if it doesn't exist.
+    """
+    cache = get_cache()
+    values = cache.users.get(user_id)
+    if values is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        cache.users.set(user_id, {column.key: getattr(user, column.key) for column in User.__table__.columns})
+        return user
+
+    # Rebuild the instance from its cached columns and attach it to the session as if it had been loaded
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def get_user_products(user_id, product_type=None):
+    """
+    Returns the products of a user, cached per user.
+
+    Args:
+        user_id (int): User ID.
+        product_type (str): Only return products of this type.
+
+    Returns:
+        list: ProductSummary tuples.
+    """
+    cache = get_cache()
+    products = cache.products.get(user_id)
+    if products is None:
+        products = [ProductSummary(*row) for row in db.session.query(
+            Product.product_id, Product.product_type, Product.date_of_opening, Product.current_balance,
+            Product.current_due, Product.payment_due_date).filter(Product.user_id == user_id)]
+        cache.products.set(user_id, products)
+        for product in products:
+            cache.owners.set(product.product_id, user_id)
+    if product_type is not None:
+        return [product for product in products if product.product_type == product_type]
+    return products
+
+
+def get_user_product(user_id, product_id):
+    """
+    Returns one of a user's products from the cached list, or None if the user doesn't own it.
+    """
+    return next((product for product in get_user_products(user_id) if product.product_id == product_id), None)
+
+
+def invalidate_user(user_id):
+    get_cache().invalidate_user(user_id)
+
+
+def invalidate_products(user_id):
+    get_cache().invalidate_products(user_id)
+
+
+def mark_products_changed(product_ids):
+    """
+    Records products whose balances change in the current database transaction; their owners'
+    cached product lists are dropped once it commits.
+    """
+    db.session.info.setdefault('changed_products', set()).update(product_ids)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_products(session):
+    changed = session.info.pop('changed_products', None)
+    if changed and has_app_context():
+        get_cache().invalidate_product_ids(changed)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_changed_products(session):
+    session.info.pop('changed_products', None)
+
+
+def init_app(app):
+    """
+    Creates the app's identity cache, holding CACHE_SIZE users and product lists for CACHE_TTL seconds.
+    """
+    app.extensions['identity_cache'] = IdentityCache(app.config['CACHE_SIZE'], app.config['CACHE_TTL'])
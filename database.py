@@ -0,0 +1,188 @@
+import os
+from datetime import datetime
+
+import click
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import make_url
+
+from . import db
+
+
+def database_url():
+    """
+    Returns the database URL from DATABASE_URL, defaulting to the local SQLite file.
+    """
+    url = os.environ.get('DATABASE_URL', 'sqlite:///db.sqlite')
+    # hosted Postgres providers still hand out the scheme SQLAlchemy dropped
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(config):
+    """
+    Builds SQLALCHEMY_ENGINE_OPTIONS for the configured database.
+
+    Server databases get a sized connection pool (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT),
+    recycled after DB_POOL_RECYCLE seconds and pinged before use, plus a per-statement timeout of
+    DB_STATEMENT_TIMEOUT milliseconds on PostgreSQL. SQLite keeps SQLAlchemy's default pool and gets
+    its busy timeout as the driver's lock timeout; its pragmas are set by init_app.
+
+    Args:
+        config (flask.Config): Application configuration.
+
+    Returns:
+        dict: Keyword arguments for create_engine.
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite':
+        return {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT'] / 1000}}
+
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+    if url.get_backend_name() == 'postgresql' and config['DB_STATEMENT_TIMEOUT']:
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT']}"}
+    return options
+
+
+def _sqlite_pragmas(config):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL lets readers run alongside the single writer; NORMAL is durable in WAL mode except on power loss
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}")
+        cursor.execute(f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}")
+        cursor.close()
+    return set_pragmas
+
+
+def init_app(app):
+    """
+    Applies the SQLite pragmas to every new connection of the app's engine and registers the
+    'migrate' command. Must run inside an application context, before the first connection is made.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        event.listen(db.engine, 'connect', _sqlite_pragmas(app.config))
+
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Create or update the database schema."""
+        migrate()
+        click.echo(f"Schema of {db.engine.url.render_as_string(hide_password=True)} is up to date")
+
+
+def migrate():
+    """
+    Brings the database schema up to date with the models: creates missing tables, adds missing
+    columns and creates missing indexes, then applies the DATA_MIGRATIONS not yet recorded in
+    SchemaMigration. Safe to run repeatedly; run it once per deploy, before the application
+    processes start, rather than from every worker.
+    """
+    from .models import SchemaMigration
+
+    existing_tables = set(inspect(db.engine).get_table_names())
+    db.create_all()
+    add_missing_columns()
+    # create_all() skips the indexes of tables that already exist
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+    applied = {name for name, in db.session.query(SchemaMigration.name)}
+    for name, migration in DATA_MIGRATIONS:
+        if name not in applied:
+            # tables created by this run are already in the current format
+            migration(existing_tables)
+            db.session.add(SchemaMigration(name=name, applied_at=datetime.now()))
+            db.session.commit()
+
+
+def _money_to_minor_units(existing_tables):
+    """
+    Converts the Money columns of tables created before amounts were kept in paise: the rupee
+    values (FLOAT, or INTEGER for the oldest product balances) are rounded to whole paise into a
+    new BIGINT column that replaces the old one.
+    """
+    from .money import Money, MINOR_UNITS
+
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            for column in table.columns:
+                if not isinstance(column.type, Money):
+                    continue
+                new = f'{column.name}_minor'
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                # SQLite can only add a NOT NULL column with a default
+                not_null = "" if column.nullable else " NOT NULL DEFAULT 0"
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {new} {column_type}{not_null}'))
+                connection.execute(text(f'UPDATE {table.name} SET {new} = ROUND({column.name} * {MINOR_UNITS})'))
+                connection.execute(text(f'ALTER TABLE {table.name} DROP COLUMN {column.name}'))
+                connection.execute(text(f'ALTER TABLE {table.name} RENAME COLUMN {new} TO {column.name}'))
+
+
+def _backfill_balance_snapshots(existing_tables):
+    """
+    Builds the daily balance snapshots of transactions posted before snapshots were maintained, which
+    balance-as-of queries and analytics would otherwise miss.
+    """
+    from .models import Transactions
+    from .balances import rebuild_snapshots
+
+    if Transactions.__table__.name in existing_tables:
+        rebuild_snapshots()
+
+
+def _widen_password_column(existing_tables):
+    """
+    Widens User.password, created as VARCHAR(100) before scrypt hashes (about 160 characters) were
+    stored in it, to the model's length. SQLite doesn't enforce VARCHAR lengths and is left alone.
+    """
+    from .models import User
+
+    table = User.__table__
+    dialect = db.engine.dialect
+    if table.name not in existing_tables or dialect.name == 'sqlite':
+        return
+    preparer = dialect.identifier_preparer
+    column = table.c.password
+    column_type = column.type.compile(dialect=dialect)
+    if dialect.name in ('mysql', 'mariadb'):
+        statement = f'ALTER TABLE {preparer.format_table(table)} MODIFY {preparer.format_column(column)} {column_type}'
+    else:
+        statement = f'ALTER TABLE {preparer.format_table(table)} ALTER COLUMN {preparer.format_column(column)} TYPE {column_type}'
+    with db.engine.begin() as connection:
+        connection.execute(text(statement))
+
+
+# Data migrations run once, in order, by migrate(): (name, function(tables that existed before the run))
+DATA_MIGRATIONS = (
+    ('money_minor_units', _money_to_minor_units),
+    ('balance_snapshots_backfill', _backfill_balance_snapshots),
+    ('user_password_length', _widen_password_column),
+)
+
+
+def add_missing_columns():
+    """
+    Adds model columns missing from existing tables, which create_all() leaves alone.
+    Only columns that are nullable or have a server default can be added this way.
+    """
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not (column.nullable or column.server_default is not None):
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ""
+                not_null = "" if column.nullable else " NOT NULL"
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{not_null}{default}'))
@@ -0,0 +1,105 @@
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+from .models import Transactions, TransactionsArchive
+from .serializers import transaction_query
+
+
+def encode_cursor(transaction):
+    """
+    Builds the pagination cursor pointing just after a transaction.
+
+    Args:
+        transaction: Last transaction (or transaction row) of a page.
+
+    Returns:
+        str: Cursor of the form '<ISO transaction date>|<transaction id>'.
+    """
+    return f"{transaction.transaction_date.isoformat()}|{transaction.transaction_id}"
+
+
+def decode_cursor(cursor):
+    """
+    Parses a cursor built by encode_cursor.
+
+    Returns:
+        tuple: (transaction date, transaction id).
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    transaction_date, sep, transaction_id = cursor.partition('|')
+    if not sep or not transaction_id:
+        raise ValueError("Invalid cursor")
+    return datetime.fromisoformat(transaction_date), transaction_id
+
+
+# Transaction tables, newest first: every archived transaction is older than the ones still in Transactions
+TIERS = (Transactions, TransactionsArchive)
+
+
+def iter_newest(product_id, count, before=None, chunk_size=None):
+    """
+    Streams a product's latest transactions, newest first, across the hot and archive tables.
+
+    The hot table is read first and the archive only for the rows still missing, so requests
+    served by recent history never touch the archive.
+
+    Args:
+        product_id (str): Product whose history is read.
+        count (int): Maximum number of transactions.
+        before (str): Only read transactions older than this cursor (see encode_cursor).
+        chunk_size (int): Stream rows from a server-side cursor this many at a time instead of
+            loading each table's rows at once.
+
+    Yields:
+        Rows with the serializers.TRANSACTION_COLUMNS.
+
+    Raises:
+        ValueError: If before is not a valid cursor.
+    """
+    before_date, before_id = decode_cursor(before) if before else (None, None)
+    seen = set()
+    for model in TIERS:
+        remaining = count - len(seen)
+        if remaining <= 0:
+            return
+        query = transaction_query(model).filter(model.product_id == product_id)
+        if before:
+            query = query.filter(or_(
+                model.transaction_date < before_date,
+                and_(model.transaction_date == before_date, model.transaction_id < before_id)))
+        query = query.order_by(model.transaction_date.desc(), model.transaction_id.desc()).limit(remaining)
+        if chunk_size:
+            query = query.yield_per(chunk_size)
+        for row in query:
+            # a row archived while it was being read could show up in both tables
+            if row.transaction_id not in seen:
+                seen.add(row.transaction_id)
+                yield row
+
+
+def transactions_page(product_id, limit, before=None):
+    """
+    Returns one page of a product's transactions, newest first, using keyset pagination.
+
+    Pages are read with a range scan of the (product_id, transaction_date, transaction_id) index
+    instead of OFFSET, so later pages cost the same as the first one. Pages reaching past the hot
+    table continue into the archive.
+
+    Args:
+        product_id (str): Product whose history is read.
+        limit (int): Maximum number of transactions in the page.
+        before (str): Cursor returned with the previous page, or None for the newest transactions.
+
+    Returns:
+        tuple: (list of rows with the serializers.TRANSACTION_COLUMNS, cursor for the next page or None if this is the last page).
+
+    Raises:
+        ValueError: If before is not a valid cursor.
+    """
+    # Fetch one extra row to know whether there is a next page
+    rows = list(iter_newest(product_id, limit + 1, before))
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
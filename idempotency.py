@@ -0,0 +1,152 @@
+import functools
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, request, jsonify, make_response, Response
+from flask_login import current_user
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import IdempotencyRecord
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# Statuses that ask the client to try again (timeout, lost concurrent update, lock, rate limit); like
+# 5xx responses they are not stored, so a retry with the same key runs the view again
+RETRYABLE_STATUSES = frozenset({408, 409, 423, 425, 429})
+
+
+def _scope():
+    if current_user.is_authenticated:
+        return f"{request.endpoint}|{current_user.get_id()}"
+    return request.endpoint
+
+
+def _cutoff():
+    return datetime.now() - timedelta(seconds=current_app.config['IDEMPOTENCY_TTL'])
+
+
+def _lease_cutoff():
+    return datetime.now() - timedelta(seconds=current_app.config['IDEMPOTENCY_LEASE'])
+
+
+def _claim(scope, key, request_hash):
+    """
+    Inserts the in-progress record for a key.
+
+    Returns:
+        IdempotencyRecord: None if the key was claimed, otherwise the live record already holding it.
+    """
+    while True:
+        db.session.add(IdempotencyRecord(scope=scope, key=key, request_hash=request_hash, created_at=datetime.now()))
+        try:
+            db.session.commit()
+            return None
+        except IntegrityError:
+            db.session.rollback()
+        record = db.session.get(IdempotencyRecord, (scope, key))
+        if record is None:
+            # released in the meantime
+            continue
+        if record.status_code is None and record.created_at < _lease_cutoff():
+            # The request holding the key died before storing its response: take the claim over. Only
+            # the request that deletes this exact claim goes on, concurrent retries find the new one.
+            logger.warning("Taking over stale idempotency claim %s for %s", key, scope)
+            IdempotencyRecord.query.filter_by(scope=scope, key=key, status_code=None, created_at=record.created_at) \
+                .delete(synchronize_session=False)
+        elif record.created_at >= _cutoff():
+            return record
+        else:
+            # The record expired in the meantime: drop it and claim the key again
+            IdempotencyRecord.query.filter_by(scope=scope, key=key).filter(IdempotencyRecord.created_at < _cutoff()) \
+                .delete(synchronize_session=False)
+        db.session.commit()
+
+
+def _replay(record, request_hash):
+    if record.request_hash != request_hash:
+        return jsonify({"error": f"{HEADER} was already used with a different request"}), 422
+    if record.status_code is None:
+        return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409
+    response = Response(record.response_body, status=record.status_code, mimetype=record.mimetype)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Makes a JSON posting endpoint honor the Idempotency-Key header.
+
+    The first request with a key claims it with an in-progress record, runs the view and stores its
+    response; retries with the same key and body get the stored response back (with an
+    Idempotent-Replayed header) without running the view again. A retry arriving while the first
+    request is still running gets a 409, and a key reused with a different body a 422. 5xx responses
+    and other retryable ones (RETRYABLE_STATUSES, e.g. the 409 of a lost concurrent update) are not
+    stored, so the request can be retried. Requests without the header are not affected.
+
+    A claim still in progress after IDEMPOTENCY_LEASE seconds is treated as abandoned (the process
+    died before storing the response) and the next retry takes it over and runs the view again.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({"error": f"{HEADER} is longer than {MAX_KEY_LENGTH} characters"}), 400
+
+        scope = _scope()
+        request_hash = hashlib.sha256(request.get_data()).hexdigest()
+        record = _claim(scope, key, request_hash)
+        if record is not None:
+            return _replay(record, request_hash)
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            _release(scope, key)
+            raise
+
+        if response.status_code >= 500 or response.status_code in RETRYABLE_STATUSES:
+            _release(scope, key)
+        else:
+            IdempotencyRecord.query.filter_by(scope=scope, key=key).update(
+                {'status_code': response.status_code, 'response_body': response.get_data(as_text=True),
+                 'mimetype': response.mimetype}, synchronize_session=False)
+            db.session.commit()
+        return response
+    return wrapper
+
+
+def _release(scope, key):
+    IdempotencyRecord.query.filter_by(scope=scope, key=key).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def purge_expired():
+    """
+    Deletes the records older than IDEMPOTENCY_TTL seconds.
+
+    Returns:
+        int: Number of records deleted.
+    """
+    deleted = IdempotencyRecord.query.filter(IdempotencyRecord.created_at < _cutoff()) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def init_app(app):
+    """
+    Registers the 'purge-idempotency-keys' command.
+    """
+    @app.cli.command('purge-idempotency-keys')
+    def purge_idempotency_keys_command():
+        """Delete idempotency records older than IDEMPOTENCY_TTL."""
+        click.echo(f"{purge_expired()} idempotency records deleted")
@@ -0,0 +1,366 @@
+import atexit
+import logging
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import User, InboundMessage
+from .cache import get_user_products
+from .history import transactions_page
+from .jobs import submit_statement_job
+from .notifications import enqueue_sms
+from .money import format_amount
+
+logger = logging.getLogger(__name__)
+
+# Sentinel put on the queue to ask a worker thread to exit
+_STOP = object()
+
+HELP_TEXT = "Send BAL for balances, LAST <n> <product> for recent transactions or STMT <product> <n> for a statement."
+
+
+def check_signature(method, url, params, nonce, signature):
+    """
+    Checks the Plivo V3 signature of a /receive_sms/ request against PLIVO_AUTH_TOKEN.
+
+    Args:
+        method (str): HTTP method of the request.
+        url (str): Full URL the request was made to, as configured in Plivo.
+        params (dict): Form parameters of a POST request (GET parameters are part of the URL).
+        nonce (str): Value of the X-Plivo-Signature-V3-Nonce header, or None.
+        signature (str): Value of the X-Plivo-Signature-V3 header, or None.
+
+    Returns:
+        tuple: (status code, error message) to refuse the request with, or None if it is allowed.
+    """
+    auth_token = current_app.config['PLIVO_AUTH_TOKEN']
+    if not auth_token:
+        return 403, "Inbound SMS is disabled"
+    if not nonce or not signature:
+        return 401, "Missing Plivo signature"
+    # imported here like the rest of plivo, so startup doesn't load it
+    from plivo.utils.signature_v3 import validate_v3_signature
+
+    try:
+        valid = validate_v3_signature(method, url, nonce, auth_token, signature,
+                                      params if method == 'POST' else None)
+    except Exception:
+        logger.info('Malformed Plivo signature on inbound SMS', exc_info=True)
+        valid = False
+    return None if valid else (401, "Invalid Plivo signature")
+
+
+def number_candidates(number, country_code):
+    """
+    Returns the spellings a phone number may be stored under in User.contact_number.
+
+    Plivo sends numbers in E.164 without the '+', while users sign up with or without the '+' and
+    the country code, so the lookup tries each spelling of the same E.164 number against the
+    contact_number index. A number stored without a country code stands for one in country_code, so
+    it only matches senders from that country.
+
+    Args:
+        number (str): Phone number as received.
+        country_code (str): Country code of 10-digit numbers stored (or received) without one.
+
+    Returns:
+        set: Candidate values for an IN lookup.
+    """
+    digits = ''.join(ch for ch in number if ch.isdigit())
+    if not digits:
+        return {number}
+    full = country_code + digits if len(digits) == 10 else digits
+    candidates = {number, full, '+' + full}
+    local = full[len(country_code):]
+    if full.startswith(country_code) and len(local) == 10:
+        candidates.update((local, '0' + local))
+    return candidates
+
+
+def find_user_id(number):
+    """
+    Looks up the user registered with a phone number.
+
+    Returns:
+        int: User id, or None if the number is unknown.
+    """
+    row = db.session.query(User.id).filter(User.contact_number.in_(number_candidates(number, current_app.config['INBOUND_COUNTRY_CODE']))) \
+        .order_by(User.id).first()
+    return row.id if row else None
+
+
+def _amount(value):
+    return f"Rs. {format_amount(value)}"
+
+
+def _balance_line(product):
+    if product.product_type == 'CC':
+        return f"{product.product_id}: outstanding {_amount(product.current_due)}"
+    return f"{product.product_id}: balance {_amount(product.current_balance)}"
+
+
+def _select_product(products, product_id):
+    """
+    Picks the product a command refers to: the one named (case-insensitively), otherwise the savings
+    account, otherwise the first product.
+    """
+    if product_id:
+        return next((p for p in products if p.product_id.upper() == product_id.upper()), None)
+    return next((p for p in products if p.product_type == 'SB'), products[0] if products else None)
+
+
+def _split_args(args):
+    """
+    Splits command arguments into (count, product_id), accepting them in any order.
+    """
+    count = product_id = None
+    for arg in args:
+        if arg.isdigit() and count is None:
+            count = int(arg)
+        elif product_id is None:
+            product_id = arg
+    return count, product_id
+
+
+def _balance_reply(user_id, args):
+    products = get_user_products(user_id)
+    if args:
+        product = _select_product(products, args[0])
+        if product is None:
+            return f"Unknown product {args[0]}."
+        products = [product]
+    if not products:
+        return "You have no products."
+    return "\n".join(_balance_line(product) for product in products)
+
+
+def _last_reply(user_id, args):
+    count, product_id = _split_args(args)
+    count = min(max(count or 5, 1), current_app.config['INBOUND_LAST_MAX'])
+    product = _select_product(get_user_products(user_id), product_id)
+    if product is None:
+        return f"Unknown product {product_id}." if product_id else "You have no products."
+    rows, _ = transactions_page(product.product_id, count)
+    if not rows:
+        return f"No transactions on {product.product_id}."
+    lines = [f"Last {len(rows)} on {product.product_id}:"]
+    for row in rows:
+        if row.amount_credit:
+            entry = f"CR {_amount(row.amount_credit)}"
+        else:
+            entry = f"DR {_amount(row.amount_debit)}"
+        lines.append(f"{row.transaction_date:%d-%m} {entry} bal {_amount(row.balance)}")
+    return "\n".join(lines)
+
+
+def _statement_reply(user_id, args):
+    count, product_id = _split_args(args)
+    count = min(max(count or 10, 1), current_app.config['INBOUND_STATEMENT_MAX'])
+    product = _select_product(get_user_products(user_id), product_id)
+    if product is None:
+        return f"Unknown product {product_id}." if product_id else "You have no products."
+    submit_statement_job(user_id, product.product_id, count)
+    return f"Your statement for {product.product_id} is being prepared. The link will follow by SMS."
+
+
+COMMANDS = {
+    'BAL': _balance_reply,
+    'LAST': _last_reply,
+    'STMT': _statement_reply,
+}
+
+
+def build_reply(user_id, text):
+    """
+    Runs an SMS command for a user.
+
+    Args:
+        user_id (int): Sender.
+        text (str): Message text, e.g. 'BAL', 'LAST 5' or 'STMT SB1 20'.
+
+    Returns:
+        str: Reply text.
+    """
+    parts = (text or '').split()
+    handler = COMMANDS.get(parts[0].upper()) if parts else None
+    if handler is None:
+        return HELP_TEXT
+    return handler(user_id, parts[1:])
+
+
+def handle_message(message):
+    """
+    Processes one inbound SMS: runs its command, queues the reply and records the message.
+
+    The InboundMessage row is only committed once the reply is queued, so a message whose command
+    or reply failed is not recorded and a redelivery is processed again, while one whose UUID was
+    already recorded (a webhook retry) is skipped. Messages from unknown numbers get no reply.
+
+    Args:
+        message (dict): 'message_uuid', 'from_number', 'to_number' and 'text' of the SMS.
+
+    Returns:
+        str: Reply queued for the sender, or None if there was none.
+
+    Raises:
+        RuntimeError: If the reply couldn't be queued.
+    """
+    if db.session.get(InboundMessage, message['message_uuid']) is not None:
+        logger.info('Inbound SMS %s already processed', message['message_uuid'])
+        return None
+
+    from_number = message['from_number']
+    record = InboundMessage(message_uuid=message['message_uuid'], from_number=from_number,
+                            to_number=message['to_number'], text=message['text'],
+                            user_id=find_user_id(from_number), received_at=datetime.now())
+    if record.user_id is None:
+        logger.info('Inbound SMS %s from unregistered number %s', record.message_uuid, from_number)
+    else:
+        record.reply = build_reply(record.user_id, record.text)
+        if not enqueue_sms(from_number, record.reply, src_ph=record.to_number, block=True,
+                           timeout=current_app.config['INBOUND_REPLY_TIMEOUT']):
+            raise RuntimeError(f"Reply to inbound SMS {record.message_uuid} could not be queued")
+
+    db.session.add(record)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # another worker processed a redelivery of the same message meanwhile
+        db.session.rollback()
+        logger.info('Inbound SMS %s already processed', record.message_uuid)
+    return record.reply
+
+
+class InboundProcessor:
+    """
+    Processes inbound SMS commands on worker threads so the webhook can be acknowledged immediately.
+
+    The webhook only queues the message; the workers look up the sender, run the command and queue
+    the reply on the SMS dispatcher. Message UUIDs seen recently are remembered in memory so webhook
+    retries are dropped without touching the database; the InboundMessage table catches the rest.
+    """
+
+    def __init__(self, app, workers=2, maxsize=1000, recent_size=10000):
+        """
+        Args:
+            app (flask.Flask): Application whose context the workers run in.
+            workers (int): Number of worker threads.
+            maxsize (int): Maximum number of pending messages.
+            recent_size (int): Number of message UUIDs remembered for duplicate detection.
+        """
+        self.app = app
+        self.workers = workers
+        self.recent_size = recent_size
+        self._recent = OrderedDict()
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the worker threads. Calling it more than once has no effect.
+        """
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'inbound-sms-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        """
+        Stops the worker threads after the messages already queued have been processed.
+
+        Args:
+            timeout (float): Seconds to wait for each worker to exit.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+    def submit(self, from_number, to_number, text, message_uuid=None):
+        """
+        Queues an inbound SMS without blocking.
+
+        Args:
+            from_number (str): Sender's phone number.
+            to_number (str): Number the message was sent to.
+            text (str): Message text.
+            message_uuid (str): Plivo MessageUUID; a random one is used if missing.
+
+        Returns:
+            bool: True if the message was queued or is a duplicate, False if the queue is full.
+        """
+        message_uuid = message_uuid or str(uuid.uuid4())
+        message = {'message_uuid': message_uuid, 'from_number': from_number, 'to_number': to_number, 'text': text}
+        with self._lock:
+            if message_uuid in self._recent:
+                return True
+            try:
+                self._queue.put_nowait(message)
+            except queue.Full:
+                return False
+            self._recent[message_uuid] = None
+            if len(self._recent) > self.recent_size:
+                self._recent.popitem(last=False)
+        return True
+
+    def join(self):
+        """
+        Blocks until every queued message has been processed.
+        """
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            try:
+                if message is _STOP:
+                    return
+                with self.app.app_context():
+                    handle_message(message)
+            except Exception:
+                logger.exception('Inbound SMS %s failed', message['message_uuid'])
+                # let a redelivery of the message through again
+                with self._lock:
+                    self._recent.pop(message['message_uuid'], None)
+            finally:
+                self._queue.task_done()
+
+
+def init_app(app):
+    """
+    Creates the application's inbound SMS processor from its configuration and starts it.
+
+    Args:
+        app (flask.Flask): Application to attach the processor to.
+
+    Returns:
+        InboundProcessor: The started processor.
+    """
+    processor = InboundProcessor(app, workers=app.config['INBOUND_WORKERS'],
+                                 maxsize=app.config['INBOUND_QUEUE_SIZE'])
+    processor.start()
+    atexit.register(processor.stop)
+    app.extensions['inbound'] = processor
+    return processor
+
+
+def get_processor():
+    """
+    Returns the inbound SMS processor of the current application.
+
+    Returns:
+        InboundProcessor: Processor created by init_app.
+    """
+    return current_app.extensions['inbound']
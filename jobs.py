@@ -0,0 +1,206 @@
+import atexit
+import functools
+import logging
+import multiprocessing
+import os
+import pickle
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import click
+from flask import Flask, current_app
+from sqlalchemy import update
+
+from . import db
+from .models import User, Product, StatementJob
+from .notifications import enqueue_sms
+from .statements import render_statement
+from .storage import upload_statement
+from .statement_cache import cache_key, lookup, store, object_key
+
+logger = logging.getLogger(__name__)
+
+# Application created in each worker process by _init_worker
+_worker_app = None
+
+
+def _set_status(job, status, **fields):
+    job.status = status
+    job.updated_at = datetime.now()
+    for name, value in fields.items():
+        setattr(job, name, value)
+    db.session.commit()
+
+
+def _claim(job_id):
+    """
+    Moves a job from 'queued' to 'running' in one conditional UPDATE, so when the pool and the
+    recovery command race for the same job only one of them gets it.
+
+    Returns:
+        bool: True if this caller claimed the job.
+    """
+    claimed = db.session.execute(
+        update(StatementJob).where(StatementJob.job_id == job_id, StatementJob.status == 'queued')
+        .values(status='running', updated_at=datetime.now())
+        .execution_options(synchronize_session=False)).rowcount == 1
+    db.session.commit()
+    return claimed
+
+
+def run_statement_job(job_id, notify=enqueue_sms):
+    """
+    Renders, uploads and texts one statement, recording progress on its StatementJob row.
+    Must run inside an application context.
+
+    Args:
+        job_id (str): Job to run.
+        notify (callable): Called with (dst_ph, msg, src_ph) to send the statement link.
+
+    Returns:
+        str: Final status of the job, or None if the job doesn't exist or isn't queued.
+    """
+    if not _claim(job_id):
+        return None
+    job = db.session.get(StatementJob, job_id)
+
+    try:
+        user = db.session.get(User, job.user_id)
+        product = db.session.get(Product, job.product_id)
+        # Identical requests reuse the stored PDF with a freshly signed URL instead of rendering again
+        use_cache = current_app.config['STATEMENT_CACHE_SIZE'] > 0
+        key = cache_key(job.product_id, job.transaction_count, user) if use_cache else None
+        url = lookup(key) if use_cache else None
+        if url is None:
+            with render_statement(job.product_id, job.transaction_count, user.dob, user.name, product.product_type,
+                                  chunk_size=current_app.config['STATEMENT_CHUNK_SIZE']) as pdf:
+                url, success = upload_statement(object_key(key) if use_cache else job.job_id + ".pdf", pdf)
+            if not success:
+                _set_status(job, 'failed', error=url)
+                return job.status
+            if use_cache:
+                store(key, job.product_id)
+
+        message = f"Dear Customer, please find your statement for {product.product_type} {product.product_id}: {url}"
+        notify(user.contact_number, message, os.environ.get("PLIVO_NUM"))
+        _set_status(job, 'done', url=url)
+    except Exception as e:
+        logger.exception('Statement job %s failed', job_id)
+        db.session.rollback()
+        _set_status(job, 'failed', error=str(e))
+    return job.status
+
+
+def _init_worker(config):
+    """
+    Sets up a worker process with only what statement jobs use: logging and the database (storage
+    reads its settings from the config). None of the web process's background threads are started.
+    """
+    global _worker_app
+    from . import database, logs
+
+    app = Flask(__name__)
+    app.config.update(config)
+    logs.init_app(app)
+    db.init_app(app)
+    with app.app_context():
+        database.init_app(app)
+    _worker_app = app
+
+
+def _run_in_worker(job_id):
+    # the SMS is handed back to the web process, whose dispatcher sends it
+    messages = []
+    with _worker_app.app_context():
+        status = run_statement_job(job_id, notify=lambda *message: messages.append(message))
+    return status, messages
+
+
+def _job_done(app, future):
+    if future.exception() is not None:
+        logger.error('Statement worker crashed: %r', future.exception())
+        return
+    _, messages = future.result()
+    with app.app_context():
+        for dst_ph, msg, src_ph in messages:
+            enqueue_sms(dst_ph, msg, src_ph=src_ph)
+
+
+def _worker_config(app):
+    """
+    Picklable part of the app configuration, passed to create_app in the worker processes.
+    """
+    config = {}
+    for name, value in app.config.items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+        config[name] = value
+    # workers run jobs themselves instead of starting pools of their own, and never run the web
+    # process's background work (reminders, outbox relay, inbound SMS, SMS dispatch)
+    config.update(STATEMENT_WORKERS=0, REMINDER_INTERVAL=0, OUTBOX_SINK=None, INBOUND_WORKERS=0, SMS_WORKERS=0)
+    return config
+
+
+def _get_executor(app):
+    executor = app.extensions.get('statement_jobs')
+    if executor is None:
+        # spawn rather than fork: the web process already runs threads (e.g. the SMS dispatcher)
+        executor = ProcessPoolExecutor(max_workers=app.config['STATEMENT_WORKERS'],
+                                       mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker, initargs=(_worker_config(app),))
+        atexit.register(executor.shutdown)
+        app.extensions['statement_jobs'] = executor
+    return executor
+
+
+def dispatch(job_id):
+    """
+    Hands a queued job to the worker process pool, or runs it in the current process when
+    STATEMENT_WORKERS is 0.
+
+    Args:
+        job_id (str): Committed job in 'queued' status.
+    """
+    app = current_app._get_current_object()
+    if app.config['STATEMENT_WORKERS'] == 0:
+        run_statement_job(job_id)
+        return
+    future = _get_executor(app).submit(_run_in_worker, job_id)
+    future.add_done_callback(functools.partial(_job_done, app))
+
+
+def submit_statement_job(user_id, product_id, transaction_count):
+    """
+    Records a statement request and dispatches it to the worker pool.
+
+    Args:
+        user_id (int): Requesting user.
+        product_id (str): Product of the statement.
+        transaction_count (int): Number of latest transactions to include.
+
+    Returns:
+        StatementJob: The new job.
+    """
+    now = datetime.now()
+    job = StatementJob(job_id=str(uuid.uuid4()), user_id=user_id, product_id=product_id,
+                       transaction_count=transaction_count, status='queued', created_at=now, updated_at=now)
+    db.session.add(job)
+    db.session.commit()
+    dispatch(job.job_id)
+    return job
+
+
+def init_app(app):
+    """
+    Registers the 'run-statement-jobs' command, which runs every job still queued (e.g. after a restart).
+    """
+    @app.cli.command('run-statement-jobs')
+    def run_statement_jobs_command():
+        """Run all queued statement jobs in this process."""
+        job_ids = [job_id for job_id, in db.session.query(StatementJob.job_id)
+                   .filter_by(status='queued').order_by(StatementJob.created_at)]
+        for job_id in job_ids:
+            click.echo(f"{job_id}: {run_statement_job(job_id)}")
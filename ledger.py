@@ -0,0 +1,364 @@
+from datetime import datetime
+import uuid
+
+from sqlalchemy import case, or_, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db
+from .models import User, Product, Transactions
+from .notifications import enqueue_sms
+from .balances import balance_change, record_postings
+from .cache import mark_products_changed
+from .outbox import record_transaction_events
+from .money import MAX_AMOUNT, to_minor, to_major, format_amount
+
+
+class LedgerError(Exception):
+    """
+    Base class for posting errors. status_code is the HTTP status the routes respond with.
+    """
+    status_code = 400
+
+
+class ProductNotFound(LedgerError):
+    status_code = 404
+
+
+class InvalidTransaction(LedgerError):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    pass
+
+
+class ConcurrentUpdate(LedgerError):
+    status_code = 409
+
+
+def _is_valid_posting(amount_credit, amount_debit):
+    # Validate that either credit or debit is greater than 0, not both; amounts are integer paise
+    if type(amount_credit) is not int or type(amount_debit) is not int:
+        return False
+    if amount_credit > MAX_AMOUNT or amount_debit > MAX_AMOUNT:
+        return False
+    return not ((amount_credit > 0 and amount_debit > 0) or (amount_credit == 0 and amount_debit == 0)
+                or amount_credit < 0 or amount_debit < 0)
+
+
+def _product_exists(product_id):
+    return db.session.query(Product.product_id).filter_by(product_id=product_id).first() is not None
+
+
+def apply_posting(product_id, amount_credit, amount_debit, require_funds=False, max_retries=5):
+    """
+    Atomically applies a credit and/or debit to a product's counters and bumps its version.
+
+    This is the only place product balances change. On databases supporting UPDATE ... RETURNING the
+    change is a single statement (current_balance = current_balance + :change), so concurrent postings
+    to the same product never lose updates and don't need a lock held across the request. Elsewhere
+    it falls back to a compare-and-swap on Product.version, retried up to max_retries times.
+
+    Credits add to a savings account balance and subtract from a credit card due; debits do the
+    opposite. Other product types only get their version bumped.
+
+    Args:
+        product_id (str): Product to update.
+        amount_credit (int): Amount credited, in paise.
+        amount_debit (int): Amount debited, in paise.
+        require_funds (bool): Refuse to take a savings account below zero.
+        max_retries (int): Compare-and-swap attempts before giving up.
+
+    Returns:
+        Row: product_type, current_balance, current_due and version after the update.
+
+    Raises:
+        ProductNotFound: If the product doesn't exist.
+        InsufficientFunds: If require_funds is set and the balance is too low.
+        ConcurrentUpdate: If the compare-and-swap kept losing to other writers.
+    """
+    mark_products_changed([product_id])
+    if db.session.get_bind().dialect.update_returning:
+        stmt = update(Product).where(Product.product_id == product_id)
+        if require_funds:
+            stmt = stmt.where(or_(Product.product_type != 'SB',
+                                  Product.current_balance + (amount_credit - amount_debit) >= 0))
+        stmt = stmt.values(
+            current_balance=Product.current_balance + case((Product.product_type == 'SB', amount_credit - amount_debit), else_=0),
+            current_due=Product.current_due + case((Product.product_type == 'CC', amount_debit - amount_credit), else_=0),
+            version=Product.version + 1
+        ).returning(Product.product_type, Product.current_balance, Product.current_due, Product.version) \
+            .execution_options(synchronize_session=False)
+        row = db.session.execute(stmt).first()
+        if row is None:
+            if require_funds and _product_exists(product_id):
+                raise InsufficientFunds("Balance not sufficient to process payment.")
+            raise ProductNotFound("Product not found")
+        return row
+
+    for _ in range(max_retries):
+        current = db.session.query(Product.product_type, Product.current_balance, Product.current_due, Product.version) \
+            .filter_by(product_id=product_id).first()
+        if current is None:
+            raise ProductNotFound("Product not found")
+        change = balance_change(current.product_type, amount_credit, amount_debit)
+        current_balance = current.current_balance + (change if current.product_type == 'SB' else 0)
+        current_due = current.current_due + (change if current.product_type == 'CC' else 0)
+        if require_funds and current.product_type == 'SB' and current_balance < 0:
+            raise InsufficientFunds("Balance not sufficient to process payment.")
+        result = db.session.execute(
+            update(Product).where(Product.product_id == product_id, Product.version == current.version)
+            .values(current_balance=current_balance, current_due=current_due, version=current.version + 1)
+            .execution_options(synchronize_session=False))
+        if result.rowcount == 1:
+            return db.session.query(Product.product_type, Product.current_balance, Product.current_due, Product.version) \
+                .filter_by(product_id=product_id).one()
+    raise ConcurrentUpdate("Product was updated concurrently, please retry.")
+
+
+def _balance_of(row):
+    return row.current_balance if row.product_type == 'SB' else row.current_due
+
+
+def _record(product_id, amount_credit, amount_debit, balance):
+    """
+    Adds the transaction row of a posting to the session, folds it into the daily snapshot and
+    records its outbox event.
+
+    Returns:
+        Transactions: The new transaction.
+    """
+    transaction = Transactions(
+        transaction_id=str(uuid.uuid4()),
+        product_id=product_id,
+        amount_credit=amount_credit,
+        amount_debit=amount_debit,
+        transaction_date=datetime.now(),
+        balance=balance
+    )
+    db.session.add(transaction)
+    posting = {'transaction_id': transaction.transaction_id, 'product_id': product_id,
+               'transaction_date': transaction.transaction_date, 'amount_credit': amount_credit,
+               'amount_debit': amount_debit, 'balance': balance}
+    record_postings([posting])
+    record_transaction_events([posting])
+    return transaction
+
+
+def post_transaction(product_id, amount_credit=0, amount_debit=0, require_funds=False):
+    """
+    Posts a credit or a debit to a product in the current database transaction, without committing.
+
+    Args:
+        product_id (str): Product to post to.
+        amount_credit (int): Amount credited in paise; must be 0 if amount_debit is set.
+        amount_debit (int): Amount debited in paise; must be 0 if amount_credit is set.
+        require_funds (bool): Refuse to take a savings account below zero.
+
+    Returns:
+        Transactions: The new transaction.
+
+    Raises:
+        InvalidTransaction: If not exactly one of the amounts is positive.
+        ProductNotFound: If the product doesn't exist.
+        InsufficientFunds: If require_funds is set and the balance is too low.
+    """
+    if not _is_valid_posting(amount_credit, amount_debit):
+        raise InvalidTransaction("Invalid transaction.")
+
+    row = apply_posting(product_id, amount_credit, amount_debit, require_funds=require_funds)
+    return _record(product_id, amount_credit, amount_debit, _balance_of(row))
+
+
+def transfer(from_product_id, to_product_id, amount, user_id=None):
+    """
+    Moves money between two products: debits the source and credits the destination in a single
+    database transaction, so either both legs are committed or neither is.
+
+    Args:
+        from_product_id (str): Product to debit (e.g. the savings account).
+        to_product_id (str): Product to credit (e.g. the credit card).
+        amount (int): Amount to transfer, in paise.
+        user_id (int): If given, the source product must belong to this user.
+
+    Returns:
+        tuple: (debit transaction, credit transaction), already committed.
+
+    Raises:
+        InvalidTransaction: For non-positive amounts, identical products or a source owned by someone else.
+        ProductNotFound: If either product doesn't exist.
+        InsufficientFunds: If a savings account source has less than amount.
+        SQLAlchemyError: If the commit fails; the session is rolled back.
+    """
+    if type(amount) is not int or amount <= 0:
+        raise InvalidTransaction("Invalid transaction.")
+    if from_product_id == to_product_id:
+        raise InvalidTransaction("Cannot transfer to the same product.")
+
+    try:
+        owner = db.session.query(Product.user_id).filter_by(product_id=from_product_id).first()
+        if owner is None:
+            raise ProductNotFound("Product not found")
+        if user_id is not None and owner.user_id != user_id:
+            raise InvalidTransaction("Source product does not belong to the user.")
+
+        # Update the rows in a fixed order so concurrent transfers can't deadlock each other
+        legs = {from_product_id: (0, amount, True), to_product_id: (amount, 0, False)}
+        posted = {}
+        for product_id in sorted(legs):
+            amount_credit, amount_debit, require_funds = legs[product_id]
+            posted[product_id] = post_transaction(product_id, amount_credit, amount_debit, require_funds=require_funds)
+        db.session.commit()
+    except (LedgerError, SQLAlchemyError):
+        db.session.rollback()
+        raise
+    return posted[from_product_id], posted[to_product_id]
+
+
+def _transaction_message(product_type, product_id, amount_credit, amount_debit, balance):
+    type_transaction = "debited" if amount_debit > 0 else "credited"
+    amount_transaction = amount_debit if amount_debit > 0 else amount_credit
+    type_balance = "outstanding" if product_type == "CC" else "balance"
+    return f"Dear customer, your {product_type} {product_id} has been {type_transaction} by {format_amount(amount_transaction)} and your current {type_balance} is {format_amount(balance)}"
+
+
+def notify_transaction(transaction):
+    """
+    Queues the customer SMS for a committed transaction.
+
+    Args:
+        transaction (Transactions): Committed transaction.
+
+    Returns:
+        bool: True if the SMS was queued.
+    """
+    product = transaction.product
+    message = _transaction_message(product.product_type, product.product_id, transaction.amount_credit,
+                                   transaction.amount_debit, transaction.balance)
+    return enqueue_sms(product.user.contact_number, message)
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _load_accounts(product_ids):
+    """
+    Loads the products' types and their owners' contact numbers in a single query.
+
+    Returns:
+        dict: product_id -> account details used by post_transactions_bulk.
+    """
+    rows = db.session.query(Product.product_id, Product.product_type, User.contact_number) \
+        .join(User, User.id == Product.user_id) \
+        .filter(Product.product_id.in_(product_ids)).all()
+    return {row.product_id: {'product_type': row.product_type, 'contact_number': row.contact_number}
+            for row in rows}
+
+
+def post_transactions_bulk(rows, chunk_size=1000, notify=False):
+    """
+    Posts many transactions with batched inserts, committing once per chunk of rows.
+
+    Each product is looked up once per batch. Within a chunk, the rows of a product are applied to it
+    with a single apply_posting call for their net amount, and the running balance of every row is
+    worked out from the result in input order. A failed chunk is rolled back on its own; earlier
+    chunks stay committed.
+
+    Args:
+        rows (iterable): Dictionaries with product_id, amount_credit and amount_debit (in rupees), as
+            accepted by /add_transaction. Items that are not dictionaries, or whose product_id is not a
+            string, are reported as errors.
+        chunk_size (int): Number of rows per commit.
+        notify (bool): Queue the customer SMS for every posted transaction.
+
+    Yields:
+        dict: One result per input row, in input order, with index and status ('posted' or 'error'),
+            plus transaction_id and new_balance (in rupees) or error.
+    """
+    accounts = {}
+    index = 0
+    for chunk in _chunks(rows, chunk_size):
+        # Look up every product of this chunk that hasn't been seen yet in one query
+        new_ids = {row.get('product_id') for row in chunk
+                   if isinstance(row, dict) and isinstance(row.get('product_id'), str)} - accounts.keys()
+        if new_ids:
+            accounts.update(_load_accounts(new_ids))
+
+        results, valid, totals = [], [], {}
+        for row in chunk:
+            result = {'index': index}
+            index += 1
+            results.append(result)
+            if not isinstance(row, dict):
+                result.update(status='error', error="Invalid JSON data")
+                continue
+            try:
+                amount_credit = to_minor(row.get('amount_credit', 0))
+                amount_debit = to_minor(row.get('amount_debit', 0))
+            except ValueError:
+                amount_credit = amount_debit = None
+            if not _is_valid_posting(amount_credit, amount_debit):
+                result.update(status='error', error="Invalid transaction.")
+                continue
+            if not isinstance(row.get('product_id'), str):
+                result.update(status='error', error="Invalid product_id")
+                continue
+            if row['product_id'] not in accounts:
+                result.update(status='error', error="Product not found")
+                continue
+            valid.append((result, row['product_id'], amount_credit, amount_debit))
+            total = totals.setdefault(row['product_id'], [0, 0])
+            total[0] += amount_credit
+            total[1] += amount_debit
+
+        try:
+            # Apply each product's net change in one atomic update, in a fixed order, and derive the
+            # balance before this chunk from the result
+            balances = {}
+            for product_id in sorted(totals):
+                amount_credit, amount_debit = totals[product_id]
+                updated = apply_posting(product_id, amount_credit, amount_debit)
+                balances[product_id] = _balance_of(updated) - balance_change(updated.product_type, amount_credit, amount_debit)
+
+            mappings = []
+            for result, product_id, amount_credit, amount_debit in valid:
+                balances[product_id] += balance_change(accounts[product_id]['product_type'], amount_credit, amount_debit)
+                mapping = {
+                    'transaction_id': str(uuid.uuid4()),
+                    'product_id': product_id,
+                    'amount_credit': amount_credit,
+                    'amount_debit': amount_debit,
+                    'transaction_date': datetime.now(),
+                    'balance': balances[product_id],
+                }
+                mappings.append(mapping)
+                result.update(status='posted', transaction_id=mapping['transaction_id'],
+                              new_balance=to_major(mapping['balance']))
+
+            db.session.bulk_insert_mappings(Transactions, mappings)
+            record_postings(mappings)
+            record_transaction_events(mappings)
+            db.session.commit()
+        except (LedgerError, SQLAlchemyError) as e:
+            db.session.rollback()
+            mappings = []
+            for result, *_ in valid:
+                result.update(status='error', error="Database error", details=str(e))
+                result.pop('transaction_id', None)
+                result.pop('new_balance', None)
+
+        if notify:
+            for mapping in mappings:
+                account = accounts[mapping['product_id']]
+                enqueue_sms(account['contact_number'], _transaction_message(
+                    account['product_type'], mapping['product_id'], mapping['amount_credit'],
+                    mapping['amount_debit'], mapping['balance']))
+
+        yield from results
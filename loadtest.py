@@ -0,0 +1,383 @@
+"""
+Load generator and benchmark for the banking app.
+
+Seeds users with a savings account and a credit card through the app factory, then runs a mixed
+workload (postings, history reads, credit card payments, statement requests) from a pool of
+virtual users and reports throughput and latency percentiles/histograms per workload.
+
+By default the app runs in-process (Flask test clients against a temporary SQLite database) with
+SMS_BACKEND=fake and STATEMENT_STORAGE=local, so no Plivo or S3 call leaves the machine. With
+--target the requests go over HTTP to a running server instead; start that server with the same
+stubs and point this script at the same database (DATABASE_URL) so it can seed it.
+
+Run from the directory containing the package:
+
+    python -m plivo_hackathon.loadtest --users 50 --concurrency 16 --requests 5000
+    python -m plivo_hackathon.loadtest --mix post=1 --duration 30 --json results.json
+"""
+import argparse
+import bisect
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from . import create_app, database, db
+from .models import User, Product
+from .ledger import post_transactions_bulk
+from .passwords import hash_password
+from .money import to_minor
+
+PASSWORD = 'loadtest'
+
+DEFAULT_MIX = 'post=60,history=30,pay=8,statement=2'
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf'))
+
+
+def user_email(index):
+    return f'loadtest-{index}@example.com'
+
+
+def account_ids(index):
+    """
+    Returns the (savings account, credit card) product IDs of a seeded user; product IDs are 6 characters.
+    """
+    return f'S{index:05d}', f'C{index:05d}'
+
+
+def seed(app, users, transactions_per_product=0, rng=None):
+    """
+    Creates the load-test users and their products, skipping the ones that already exist.
+
+    Args:
+        app (flask.Flask): Application whose database is seeded.
+        users (int): Number of users.
+        transactions_per_product (int): Transactions posted to each new product, so history reads
+            and statements have data.
+        rng (random.Random): Source of the seeded amounts.
+
+    Returns:
+        int: Number of users created.
+    """
+    rng = rng or random.Random(0)
+    with app.app_context():
+        existing = {email for email, in db.session.query(User.email).filter(User.email.like('loadtest-%'))}
+        missing = [i for i in range(users) if user_email(i) not in existing]
+        if not missing:
+            return 0
+
+        # One hash for everyone: hashing is deliberately slow and not what is being measured here
+        password = hash_password(PASSWORD)
+        db.session.bulk_insert_mappings(User, [
+            {'email': user_email(i), 'name': f'Load Test {i}', 'password': password,
+             'contact_number': f'+9190000{i:05d}', 'dob': '01/01/1990'} for i in missing])
+        user_ids = dict(db.session.query(User.email, User.id).filter(User.email.in_([user_email(i) for i in missing])))
+
+        today = date.today()
+        products = []
+        for i in missing:
+            savings, card = account_ids(i)
+            products.append({'product_id': savings, 'user_id': user_ids[user_email(i)], 'product_type': 'SB',
+                             'date_of_opening': today, 'current_balance': to_minor(1000000), 'current_due': 0})
+            products.append({'product_id': card, 'user_id': user_ids[user_email(i)], 'product_type': 'CC',
+                             'date_of_opening': today, 'current_balance': 0, 'current_due': 0,
+                             'payment_due_date': today})
+        db.session.bulk_insert_mappings(Product, products)
+        db.session.commit()
+
+        rows = ({'product_id': product['product_id'], 'amount_credit': round(rng.uniform(100, 10000), 2),
+                 'amount_debit': 0} if product['product_type'] == 'SB' else
+                {'product_id': product['product_id'], 'amount_credit': 0,
+                 'amount_debit': round(rng.uniform(100, 10000), 2)}
+                for _ in range(transactions_per_product) for product in products)
+        for _ in post_transactions_bulk(rows, chunk_size=app.config['BULK_CHUNK_SIZE']):
+            pass
+    return len(missing)
+
+
+class InProcessClient:
+    """
+    Virtual user backed by a Flask test client.
+    """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login(self, user_id, email):
+        # Sign in through the session directly, as password checks are not part of the workload
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+
+    def get(self, path, params=None):
+        return self.client.get(path, query_string=params).status_code
+
+    def post_json(self, path, body, headers=None):
+        return self.client.post(path, json=body, headers=headers).status_code
+
+
+class HttpClient:
+    """
+    Virtual user backed by a requests session against a running server.
+    """
+
+    def __init__(self, base_url, timeout=30):
+        import requests
+
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def login(self, user_id, email):
+        self.session.post(self.base_url + '/login', data={'email': email, 'password': PASSWORD},
+                          timeout=self.timeout)
+
+    def get(self, path, params=None):
+        return self.session.get(self.base_url + path, params=params, timeout=self.timeout).status_code
+
+    def post_json(self, path, body, headers=None):
+        return self.session.post(self.base_url + path, json=body, headers=headers, timeout=self.timeout).status_code
+
+
+def do_post(client, user, rng):
+    savings, card = user['products']
+    if rng.random() < 0.5:
+        body = {'product_id': savings, 'amount_credit': round(rng.uniform(1, 5000), 2), 'amount_debit': 0}
+    else:
+        body = {'product_id': card, 'amount_credit': 0, 'amount_debit': round(rng.uniform(1, 5000), 2)}
+    return client.post_json('/add_transaction', body, headers={'Idempotency-Key': str(uuid.uuid4())}) == 201
+
+
+def do_history(client, user, rng):
+    return client.get('/transactions_get', {'product_id': rng.choice(user['products']), 'limit': 20}) == 200
+
+
+def do_pay(client, user, rng):
+    savings, card = user['products']
+    body = {'from_product_id': savings, 'to_product_id': card, 'amount': round(rng.uniform(1, 500), 2)}
+    return client.post_json('/transfer', body) == 201
+
+
+def do_statement(client, user, rng):
+    body = {'selected_product': rng.choice(user['products']), 'transaction_count': 20}
+    return client.post_json('/createAndSendPDF', body) == 202
+
+
+WORKLOADS = {
+    'post': do_post,
+    'history': do_history,
+    'pay': do_pay,
+    'statement': do_statement,
+}
+
+
+def parse_mix(text):
+    """
+    Parses a workload mix such as 'post=60,history=30'.
+
+    Returns:
+        dict: Weight per workload name.
+
+    Raises:
+        ValueError: If a name is unknown or a weight is not a positive number.
+    """
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in WORKLOADS:
+            raise ValueError(f"Unknown workload {name!r}; choose from {', '.join(WORKLOADS)}")
+        mix[name] = float(weight or 1)
+        if mix[name] <= 0:
+            raise ValueError(f"Weight of {name!r} must be positive")
+    return mix
+
+
+class LatencyRecorder:
+    """
+    Thread-safe per-workload latency samples and error counts.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, ok):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, elapsed):
+        """
+        Returns:
+            dict: Per workload (and 'all'), count, errors, requests per second, mean/p50/p90/p99/max
+                latency in milliseconds and histogram bucket counts.
+        """
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self.samples.items()}
+            errors = dict(self.errors)
+        samples['all'] = sorted(value for values in samples.values() for value in values)
+        errors['all'] = sum(errors.values())
+
+        report = {}
+        for name, values in samples.items():
+            if not values:
+                continue
+            histogram = [0] * len(BUCKETS_MS)
+            for value in values:
+                histogram[bisect.bisect_left(BUCKETS_MS, value * 1000)] += 1
+            report[name] = {
+                'count': len(values),
+                'errors': errors.get(name, 0),
+                'rps': round(len(values) / elapsed, 1) if elapsed else 0,
+                'mean_ms': round(sum(values) / len(values) * 1000, 2),
+                'p50_ms': _percentile_ms(values, 50),
+                'p90_ms': _percentile_ms(values, 90),
+                'p99_ms': _percentile_ms(values, 99),
+                'max_ms': round(values[-1] * 1000, 2),
+                'histogram': histogram,
+            }
+        return report
+
+
+def _percentile_ms(sorted_values, percent):
+    index = min(len(sorted_values) - 1, max(0, round(percent / 100 * len(sorted_values)) - 1))
+    return round(sorted_values[index] * 1000, 2)
+
+
+def run(client_factory, users, mix, concurrency, requests=None, duration=None, seed_value=0):
+    """
+    Runs the workload mix from concurrency virtual users until requests have been sent or duration
+    seconds have passed.
+
+    Args:
+        client_factory (callable): Returns a new InProcessClient or HttpClient.
+        users (list): Dictionaries with id, email and products (savings, credit card) of seeded users.
+        mix (dict): Weight per workload name.
+        concurrency (int): Number of virtual users (threads).
+        requests (int): Total number of requests to send.
+        duration (float): Seconds to run for, used when requests is None.
+        seed_value (int): Seed of the per-thread random generators, for reproducible request sequences.
+
+    Returns:
+        dict: Elapsed seconds and the recorder summary.
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    recorder = LatencyRecorder()
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def take():
+        if requests is None:
+            return time.perf_counter() < deadline
+        with lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def virtual_user(index):
+        rng = random.Random(seed_value + index)
+        user = users[index % len(users)]
+        client = client_factory()
+        client.login(user['id'], user['email'])
+        while take():
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                ok = WORKLOADS[name](client, user, rng)
+            except Exception:
+                ok = False
+            recorder.record(name, time.perf_counter() - start, ok)
+
+    start = time.perf_counter()
+    deadline = start + (duration or 0)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(virtual_user, i) for i in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+    return {'elapsed': round(elapsed, 3), 'workloads': recorder.summary(elapsed)}
+
+
+def format_report(result):
+    """
+    Formats a run result as a text table followed by a histogram per workload.
+    """
+    lines = [f"elapsed {result['elapsed']}s",
+             f"{'workload':<10} {'count':>7} {'errors':>6} {'req/s':>8} {'mean':>8} {'p50':>8} "
+             f"{'p90':>8} {'p99':>8} {'max':>8}  (ms)"]
+    for name, stats in result['workloads'].items():
+        lines.append(f"{name:<10} {stats['count']:>7} {stats['errors']:>6} {stats['rps']:>8} {stats['mean_ms']:>8} "
+                     f"{stats['p50_ms']:>8} {stats['p90_ms']:>8} {stats['p99_ms']:>8} {stats['max_ms']:>8}")
+    for name, stats in result['workloads'].items():
+        lines.append(f"\n{name} latency histogram")
+        peak = max(stats['histogram']) or 1
+        for bound, count in zip(BUCKETS_MS, stats['histogram']):
+            label = f"<= {bound:g} ms" if bound != float('inf') else f"> {BUCKETS_MS[-2]:g} ms"
+            lines.append(f"  {label:>12} {count:>7} {'#' * round(40 * count / peak)}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--target', help='Base URL of a running server; runs in-process when omitted.')
+    parser.add_argument('--database-url', help='Database to seed (and serve, in-process); '
+                                               'defaults to DATABASE_URL, or a temporary SQLite file in-process.')
+    parser.add_argument('--users', type=int, default=20, help='Users to seed and spread the virtual users over.')
+    parser.add_argument('--history', type=int, default=50, help='Transactions seeded per new product.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Virtual users (threads).')
+    parser.add_argument('--requests', type=int, default=2000, help='Total requests (ignored with --duration).')
+    parser.add_argument('--duration', type=float, help='Run for this many seconds instead of a request count.')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Workload weights (default {DEFAULT_MIX}).')
+    parser.add_argument('--statement-workers', type=int, default=0,
+                        help='STATEMENT_WORKERS of the in-process app (0 renders statements in the request).')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    parser.add_argument('--json', dest='json_path', help='Also write the results to this JSON file.')
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    database_url = args.database_url or os.environ.get('DATABASE_URL')
+    if database_url is None and args.target is None:
+        database_url = 'sqlite:///' + os.path.join(workdir, 'loadtest.db')
+
+    config = {'SMS_BACKEND': 'fake', 'STATEMENT_STORAGE': 'local', 'STATEMENT_LOCAL_DIR': os.path.join(workdir, 'statements'),
+              'STATEMENT_WORKERS': args.statement_workers, 'SECRET_KEY': 'loadtest'}
+    if database_url:
+        config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app = create_app(config)
+    with app.app_context():
+        database.migrate()
+
+    created = seed(app, args.users, args.history, random.Random(args.seed))
+    with app.app_context():
+        ids = dict(db.session.query(User.email, User.id).filter(User.email.in_([user_email(i) for i in range(args.users)])))
+    users = [{'id': ids[user_email(i)], 'email': user_email(i), 'products': account_ids(i)} for i in range(args.users)]
+    print(f"seeded {created} new users ({args.users} in use), {'target ' + args.target if args.target else 'in-process'}")
+
+    if args.target:
+        client_factory = lambda: HttpClient(args.target)
+    else:
+        client_factory = lambda: InProcessClient(app)
+    result = run(client_factory, users, mix, args.concurrency,
+                 requests=None if args.duration else args.requests, duration=args.duration, seed_value=args.seed)
+    result['config'] = {key: value for key, value in vars(args).items() if key != 'json_path'}
+
+    print(format_report(result))
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else was passed through extra= and is logged as a field
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line, including the fields passed with extra=.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RESERVED})
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def init_app(app):
+    """
+    Sends the package's log records to stderr at LOG_LEVEL, as text or, with LOG_FORMAT=json, as
+    JSON lines. Records below the level are dropped before they are formatted.
+    """
+    package_logger = logging.getLogger(__package__)
+    package_logger.setLevel(app.config['LOG_LEVEL'].upper())
+    if any(getattr(handler, '_app_handler', False) for handler in package_logger.handlers):
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler._app_handler = True
+    if app.config['LOG_FORMAT'] == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    package_logger.addHandler(handler)
+    package_logger.propagate = False
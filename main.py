@@ -1,26 +1,29 @@
-import os
-from datetime import datetime
+import json
+import logging
+from datetime import datetime, timedelta
 import uuid
-import requests
 
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 
 from . import db
-from .models import User, Product, Transactions
-from .plivo_utils import send_sms, get_client
+from .models import Product, StatementJob
+from .cache import get_user_products, get_user_product, invalidate_products
+from .history import transactions_page
+from .serializers import product_dicts, transaction_dicts, stream_json_object
+from .balances import balance_as_of
+from .jobs import submit_statement_job
+from .inbound import get_processor, check_signature
+from .idempotency import idempotent
+from .outbox import events_page, check_consumer
+from .analytics import product_analytics
+from .money import to_minor, to_major, format_amount
+from .ledger import post_transaction, post_transactions_bulk, transfer, notify_transaction, LedgerError, InsufficientFunds
 
 from sqlalchemy.exc import SQLAlchemyError
 
-import boto3
-from botocore.exceptions import NoCredentialsError, ClientError
-from reportlab.lib.pagesizes import A3
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph    
-from reportlab.lib import colors
-from reportlab.lib import pdfencrypt
-from reportlab.lib.styles import getSampleStyleSheet
-
 main = Blueprint('main', __name__)
+logger = logging.getLogger(__name__)
 
 
 @main.route('/')
@@ -36,6 +39,7 @@ def index():
 
 @main.route('/add_product', methods=['POST'])
 @login_required
+@idempotent
 def add_product():
     """
     Adds a new product based on the provided data. The product can be a credit card(CC) or a Savings Account(SB).
@@ -45,15 +49,18 @@ def add_product():
     """
     user_id = current_user.id
     request_data = request.get_json()
-    print(request_data)
+    logger.debug('add_product request from user %s: %s', user_id, request_data)
     if not request_data:
         return jsonify({"error": "Invalid JSON data"}), 400
 
     product_type = request_data.get('product_type')
     date_of_opening = request_data.get('date_of_opening', "")
-    current_balance = request_data.get('current_balance', 0)
-    current_due = request_data.get('current_due', 0)
     payment_due_date = request_data.get('payment_due_date', "")
+    try:
+        current_balance = to_minor(request_data.get('current_balance', 0))
+        current_due = to_minor(request_data.get('current_due', 0))
+    except ValueError:
+        return jsonify({"error": "Invalid amount"}), 400
 
     # Create a new product
     new_product = Product(
@@ -72,6 +79,7 @@ def add_product():
     except SQLAlchemyError as e:
         db.session.rollback()
         return jsonify({"error": "Database error", "details": str(e)}), 500
+    invalidate_products(user_id)
     return jsonify({"message": "Product added successfully."}), 201
 
 
@@ -87,24 +95,13 @@ def get_products():
     user_id = current_user.id
 
     # Retrieve all products for the logged-in user
-    products = Product.query.filter_by(user_id=user_id).all()
+    products = get_user_products(user_id)
 
-    # Convert the products to a list of dictionaries
-    product_list = []
-    for product in products:
-        product_list.append({
-            'product_id': product.product_id,
-            'product_type': product.product_type,
-            'date_of_opening': product.date_of_opening.strftime('%Y-%m-%d'),
-            'current_balance': product.current_balance,
-            'current_due': product.current_due,
-            'payment_due_date': product.payment_due_date.strftime('%Y-%m-%d') if product.payment_due_date else None
-        })
-
-    return jsonify({'products': product_list}), 200
+    return jsonify({'products': product_dicts(products)}), 200
 
 
 @main.route('/add_transaction', methods=['POST'])
+@idempotent
 def add_transaction():
     """
     Adds a new transaction for the provided product-id associated with the user of interest.
@@ -118,149 +115,237 @@ def add_transaction():
         return jsonify({"error": "Invalid JSON data"}), 400
 
     product_id = request_data.get('product_id')
-    product = Product.query.filter_by(product_id=product_id).first()
-    user_id = product.user_id
-    user = User.query.filter_by(id=user_id).first()
+    try:
+        amount_credit = to_minor(request_data.get('amount_credit', 0))
+        amount_debit = to_minor(request_data.get('amount_debit', 0))
+    except ValueError:
+        return jsonify({"error": "Invalid transaction."}), 400
+
+    try:
+        transaction = post_transaction(product_id, amount_credit, amount_debit)
+        db.session.commit()
+    except LedgerError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), e.status_code
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return jsonify({"error": "Database error", "details": str(e)}), 500
+
+    # Queue the notification; delivery happens on the background dispatcher
+    if not notify_transaction(transaction):
+        flash("Couldn't deliver SMS for the transaction")
+
+    return jsonify({"message": "Transaction added successfully.", "new_balance": to_major(transaction.balance)}), 201
+
+
+def _ndjson_rows(stream):
+    """
+    Parses an NDJSON request body line by line; lines that aren't valid JSON are yielded as None.
+    """
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+@main.route('/add_transactions/bulk', methods=['POST'])
+def add_transactions_bulk():
+    """
+    Adds many transactions in one request, with batched inserts and one commit per chunk of rows.
+
+    The body is either a JSON array of /add_transaction payloads, answered with a JSON document, or
+    NDJSON (Content-Type: application/x-ndjson), read as a stream and answered with one NDJSON result
+    line per input row. Pass ?notify=1 to send the usual SMS for every posted transaction.
+
+    Returns:
+        str: Per-row results, each with a status of 'posted' or 'error'.
+    """
+    chunk_size = current_app.config['BULK_CHUNK_SIZE']
+    notify = request.args.get('notify') == '1'
+
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        results = post_transactions_bulk(_ndjson_rows(request.stream), chunk_size=chunk_size, notify=notify)
+        return Response(stream_with_context(json.dumps(result) + '\n' for result in results),
+                        mimetype='application/x-ndjson')
+
+    request_data = request.get_json(silent=True)
+    if not isinstance(request_data, list):
+        return jsonify({"error": "Invalid JSON data"}), 400
+
+    results = list(post_transactions_bulk(request_data, chunk_size=chunk_size, notify=notify))
+    posted = sum(1 for result in results if result['status'] == 'posted')
+    return jsonify({"posted": posted, "failed": len(results) - posted, "results": results}), 200
+
+
+@main.route('/balance/<product_id>', methods=['GET'])
+@login_required
+def get_balance(product_id):
+    """
+    Returns the balance of one of the logged-in user's products at a point in time.
+
+    The 'as_of' request parameter is a date (YYYY-MM-DD, meaning the end of that day) or an ISO
+    date-time; without it the current balance is returned.
+
+    Args:
+        product_id (str): Product ID.
+
+    Returns:
+        str: JSON response with the balance or an error message.
+    """
+    product = get_user_product(current_user.id, product_id)
     if not product:
         return jsonify({"error": "Product not found"}), 404
 
-    amount_credit = request_data.get('amount_credit', 0.0)
-    amount_debit = request_data.get('amount_debit', 0.0)
+    as_of = request.args.get('as_of')
+    try:
+        as_of = datetime.fromisoformat(as_of) if as_of and 'T' in as_of else \
+            datetime.strptime(as_of, '%Y-%m-%d').date() if as_of else datetime.now()
+    except ValueError:
+        return jsonify({"error": "Invalid as_of date"}), 400
 
-    # Validate that either credit or debit is greater than 0, not both
-    if (amount_credit > 0 and amount_debit > 0) or (amount_credit == 0 and amount_debit == 0) or amount_credit<0 or amount_debit<0:
-        return jsonify({"error": "Invalid transaction."}), 400
+    return jsonify({'product_id': product_id, 'as_of': as_of.isoformat(),
+                    'balance': to_major(balance_as_of(product_id, as_of))}), 200
 
-    # Update the balance based on the product type
-    if product.product_type == 'CC':
-        print(amount_debit, amount_credit)
-        # For Credit Card, credit amount subtracts from current_due, debit amount adds to current_due
-        if amount_credit > 0:
-            product.current_due -= amount_credit
-        elif amount_debit > 0:
-            product.current_due += amount_debit
-    elif product.product_type == 'SB':
-        # For Savings Account, credit amount adds to current_balance, debit amount subtracts from current_balance
-        if amount_credit > 0:
-            product.current_balance += amount_credit
-        elif amount_debit > 0:
-            product.current_balance -= amount_debit
-
-    # Update the transaction date to the current date
-    transaction_date = datetime.now()
-
-    # Update the product's new balance
-    product.balance = product.current_balance if product.product_type == 'SB' else product.current_due
-    product.balance = round(product.balance, 2)
-    # Create a new transaction
-    new_transaction = Transactions(
-        transaction_id=str(uuid.uuid4()),
-        product_id=product_id,
-        amount_credit=amount_credit,
-        amount_debit=amount_debit,
-        transaction_date=transaction_date,
-        balance=product.balance
-    )
 
-    db.session.add(new_transaction)
+@main.route('/analytics/<product_id>', methods=['GET'])
+@login_required
+def get_analytics(product_id):
+    """
+    Returns spending analytics for one of the logged-in user's products: monthly credit/debit
+    totals, average daily balance and the largest transactions.
+
+    Request parameters are start and end (YYYY-MM-DD, default the last 365 days) and top (number of
+    largest transactions, default 10, at most 100).
+
+    Args:
+        product_id (str): Product ID.
+
+    Returns:
+        str: JSON response with the analytics or an error message.
+    """
+    product = get_user_product(current_user.id, product_id)
+    if not product:
+        return jsonify({"error": "Product not found"}), 404
+
     try:
-        db.session.commit()
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if 'end' in request.args \
+            else datetime.now().date()
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if 'start' in request.args \
+            else end - timedelta(days=364)
+        top = min(int(request.args.get('top', 10)), 100)
+    except ValueError:
+        return jsonify({"error": "Invalid start, end or top"}), 400
+    if start > end or top < 1:
+        return jsonify({"error": "Invalid start, end or top"}), 400
+
+    return jsonify(product_analytics(product_id, start, end, top)), 200
+
+
+@main.route('/transfer', methods=['POST'])
+@login_required
+@idempotent
+def transfer_funds():
+    """
+    Transfers an amount from one of the logged-in user's products to another product. Both legs are
+    posted in a single database transaction.
+
+    Returns:
+        str: JSON response with both new balances or an error message.
+    """
+    request_data = request.get_json()
+
+    if not request_data:
+        return jsonify({"error": "Invalid JSON data"}), 400
+
+    try:
+        amount = to_minor(request_data.get('amount'))
+    except ValueError:
+        return jsonify({"error": "Invalid transaction."}), 400
+
+    try:
+        debit, credit = transfer(request_data.get('from_product_id'), request_data.get('to_product_id'),
+                                 amount, user_id=current_user.id)
+    except LedgerError as e:
+        return jsonify({"error": str(e)}), e.status_code
     except SQLAlchemyError as e:
-        db.session.rollback()
         return jsonify({"error": "Database error", "details": str(e)}), 500
-    
-    try:
-        type_transaction="debited" if amount_debit >0 else "credited"
-        amount_transaction=amount_debit if amount_debit>0 else amount_credit
-        type_balance="outstanding" if product.product_type =="CC" else "balance"
-        message=f"Dear customer, your {product.product_type} {product_id} has been {type_transaction} by {amount_transaction} and your current {type_balance} is {product.balance}"
-        cl=get_client()
-        # print(user.id, user)
-        send_sms(cl,dst_ph=user.contact_number,msg=message)
-    except Exception as e:
-        print(e)
-        flash("Couldn't deliver SMS for the transaction")
 
-    return jsonify({"message": "Transaction added successfully.", "new_balance": product.balance}), 201
+    notify_transaction(debit)
+    notify_transaction(credit)
+
+    return jsonify({"message": "Transfer completed successfully.",
+                    "from_balance": to_major(debit.balance), "to_balance": to_major(credit.balance)}), 201
+
+
+def _page_size(default):
+    """
+    Reads the 'limit' request parameter, capped at HISTORY_MAX_PAGE_SIZE.
+
+    Raises:
+        ValueError: If limit is not a positive integer.
+    """
+    limit = int(request.values.get('limit', default))
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, current_app.config['HISTORY_MAX_PAGE_SIZE'])
 
 
 @main.route('/transactions_get', methods=['GET'])
 def get_transactions():
+    """
+    Retrieves transactions for a specified product, newest first, one page at a time.
+
+    Request parameters are product_id, limit (page size) and before (the next_before cursor of the
+    previous page).
+
+    Returns:
+        str: JSON response with the page of transactions and the cursor of the next page (None on the last page).
+    """
     # Retrieve the product ID from the request
-    product_id = request.form.get('product_id')
+    product_id = request.values.get('product_id')
 
     if not product_id:
         return jsonify({"error": "Product ID is required"}), 400
 
-    # Retrieve all transactions for the specified product ID
-    transactions = Transactions.query.filter_by(product_id=product_id).all()
-
-    # Convert the transactions to a list of dictionaries
-    transaction_list = []
-    for transaction in transactions:
-        transaction_list.append({
-            'transaction_id': transaction.transaction_id,
-            'amount_credit': transaction.amount_credit,
-            'amount_debit': transaction.amount_debit,
-            'transaction_date': transaction.transaction_date.strftime('%Y-%m-%d'),
-            'balance': transaction.balance
-        })
+    try:
+        limit = _page_size(current_app.config['HISTORY_PAGE_SIZE'])
+        transactions, next_before = transactions_page(product_id, limit, request.values.get('before'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    return jsonify({'transactions': transaction_list}), 200
+    # Stream the page instead of building the whole JSON document in memory
+    body = stream_json_object('transactions', transaction_dicts(transactions), next_before=next_before)
+    return Response(body, status=200, mimetype='application/json')
 
 
-def create_pdf(transactions, filepath, dob, user_name, product_id, product_type):
+@main.route('/events', methods=['GET'])
+def get_events():
     """
-    Creates a PDF document containing transaction data.
+    Returns the transaction events recorded after a cursor, oldest first.
 
-    Args:
-        transactions (list): List of transaction data.
-        filepath (str): Path to save the PDF file.
+    Request parameters are after (next_after of the previous page, 0 or omitted for the start of
+    the stream) and limit (page size). The events carry every customer's postings, so the feed is
+    only served to internal consumers sending 'Authorization: Bearer <EVENTS_TOKEN>'.
 
     Returns:
-        None
-    """
-    doc = SimpleDocTemplate(filepath, pagesize=A3, encrypt=pdfencrypt.StandardEncryption(
-        dob, canPrint=1))  # Keep DOB as password for PDF
-    elements = []
-    heading_style = getSampleStyleSheet()["Heading1"]
-    heading_text = "Statement for: "+user_name+f" for the {product_type} "+product_id
-    heading_paragraph = Paragraph(heading_text, heading_style)
-    elements.append(heading_paragraph)
-
-    # Header row for the table
-    col_headers = ["Transaction ID", "Amount Credit",
-                   "Amount Debit", "Transaction Date", "Balance"]
-    data = [col_headers]  # Start with headers
-
-    # Add transaction data to the table
-    for transaction in transactions:
-        transaction_data = [
-            transaction['transaction_id'],
-            str(transaction['amount_credit']),
-            str(transaction['amount_debit']),
-            transaction['transaction_date'],
-            str(round(transaction['balance'],2))
-        ]
-        data.append(transaction_data)
-
-    # Create the table
-    table = Table(data)
-    style = TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-    ])
-    table.setStyle(style)
-
-    # Add table to elements
-    elements.append(table)
-
-    # Build PDF
-    doc.build(elements)
+        str: JSON response with the events and the cursor to pass as after for the next page.
+    """
+    refused = check_consumer(request.headers.get('Authorization'))
+    if refused:
+        status, error = refused
+        return jsonify({"error": error}), status
+
+    try:
+        after = int(request.values.get('after', 0))
+        limit = _page_size(current_app.config['HISTORY_PAGE_SIZE'])
+    except ValueError:
+        return jsonify({"error": "after and limit must be integers"}), 400
+
+    events, next_after = events_page(after, limit)
+    return jsonify({'events': events, 'next_after': next_after}), 200
 
 
 @main.route('/transactions', methods=['GET', 'POST'])
@@ -273,22 +358,23 @@ def transactions():
         str: Rendered HTML content displaying transactions.
     """
     # Get the user's products/accounts
-    user_products = Product.query.filter_by(user_id=current_user.id).all()
+    user_products = get_user_products(current_user.id)
 
     transactions = []  # Initialize an empty list for transactions
-    print(request.method)
     if request.method == 'POST':
         # Get the selected product_id from the form
         selected_product_id = request.form.get('product_id')
 
-        # Get the latest 10 transactions for the selected product
-        transactions = Transactions.query.filter_by(product_id=selected_product_id)\
-            .order_by(Transactions.transaction_date.desc()).limit(10).all()
-        transactions_list = [{'transaction_id': t.transaction_id,
-                              'amount_credit': t.amount_credit, 'amount_debit': t.amount_debit,
-                              'transaction_date': t.transaction_date.strftime('%Y-%m-%d %H:%M:%S'), 'balance': t.balance}
-                             for t in transactions]
-        return render_template('transactions.html', products=user_products, selected_product_id=selected_product_id, transactions=transactions_list)
+        # Get a page of transactions (latest 10 by default) for the selected product
+        try:
+            limit = _page_size(10)
+            transactions, next_before = transactions_page(selected_product_id, limit, request.form.get('before'))
+        except ValueError:
+            flash('Invalid page requested.')
+            return redirect(url_for('main.transactions'))
+        transactions_list = transaction_dicts(transactions, with_time=True)
+        return render_template('transactions.html', products=user_products, selected_product_id=selected_product_id,
+                               transactions=transactions_list, limit=limit, next_before=next_before)
 
     # Handle GET request
     return render_template('transactions.html', products=user_products, transactions=transactions)
@@ -297,67 +383,50 @@ def transactions():
 @login_required
 def pay_credit_card():
     if request.method == 'POST':
-        amount_to_pay = float(request.form.get('amount_to_pay'))
+        try:
+            amount_to_pay = to_minor(request.form.get('amount_to_pay'))
+        except ValueError:
+            flash('Invalid amount.')
+            return redirect(url_for('main.pay_credit_card'))
         bank_account_id = request.form.get('bank_account_number')
         credit_card_number = request.form.get('credit_card_number')
 
-        # Fetch the user's bank account and available balance
-        bank_account = Product.query.filter_by(user_id=current_user.id, product_type='SB').first()
-        bank_balance = bank_account.current_balance if bank_account else 0
-        print("zero check")
-        print(amount_to_pay, float(bank_balance))
-        print(bank_account_id, credit_card_number)
-        if amount_to_pay > float(bank_balance):
+        # Debit the bank account and credit the card in one database transaction
+        try:
+            debit, credit = transfer(bank_account_id, credit_card_number, amount_to_pay, user_id=current_user.id)
+        except InsufficientFunds:
             flash('Balance not sufficient to process payment.')
             return redirect(url_for('main.pay_credit_card'))
-        # Prepare data for the JSON request to add bank transaction
-        print("first check")
-        bank_transaction_data = {
-            'product_id': bank_account_id,
-            'amount_debit': amount_to_pay,
-            'description': 'Debit for Credit Card Payment'
-        }
-        # Make an internal route call to add the bank transaction
-        response_bank = requests.post('http://127.0.0.1:5000/add_transaction', json=bank_transaction_data)
-
-        # Prepare data for the JSON request to add credit card transaction
-        credit_card_transaction_data = {
-            'product_id': credit_card_number,  # Assuming credit card number is used as the product_id
-            'amount_credit': amount_to_pay,
-            'description': 'Credit for Credit Card Payment'
-        }
-
-        # Make an internal route call to add the credit card transaction
-        response_credit_card = requests.post('http://127.0.0.1:5000/add_transaction', json=credit_card_transaction_data)
-
-        if response_bank.status_code == 201 and response_credit_card.status_code == 201:
-            flash('Credit card bill successfully paid!')
-            return redirect(url_for('main.transactions'))
-        else:
+        except (LedgerError, SQLAlchemyError):
             flash('Error occurred while processing the payment.')
             return redirect(url_for('main.pay_credit_card'))
 
+        notify_transaction(debit)
+        notify_transaction(credit)
+        flash('Credit card bill successfully paid!')
+        return redirect(url_for('main.transactions'))
+
     # Fetch the user's bank account and available balance
-    bank_account = Product.query.filter_by(user_id=current_user.id, product_type='SB').first()
+    bank_account = next(iter(get_user_products(current_user.id, 'SB')), None)
     bank_balance = bank_account.current_balance if bank_account else 0
 
     # Fetch the credit card details and outstanding amount
-    credit_card = Product.query.filter_by(user_id=current_user.id, product_type='CC').first()
+    credit_card = next(iter(get_user_products(current_user.id, 'CC')), None)
     credit_card_number = credit_card.product_id if credit_card else None
     outstanding_amount = credit_card.current_due if credit_card else 0
 
-    return render_template('pay_credit_card.html', bank_account=bank_account, bank_balance=bank_balance,
-                           credit_card_number=credit_card_number, outstanding_amount=-1*outstanding_amount)
+    return render_template('pay_credit_card.html', bank_account=bank_account, bank_balance=format_amount(bank_balance),
+                           credit_card_number=credit_card_number, outstanding_amount=format_amount(-1*outstanding_amount))
 
 
 @main.route('/createAndSendPDF', methods=['POST'])
 @login_required
 def create_and_send_pdf():
     """
-    Creates a PDF from transaction data and sends it via SMS.
+    Queues a job that creates a PDF from transaction data and sends it via SMS.
 
     Returns:
-        str: JSON response with a success message or an error message.
+        str: JSON response with the job ID and its status URL, or an error message.
     """
     try:
         # Get the transaction count and selected product ID from the request data
@@ -366,125 +435,78 @@ def create_and_send_pdf():
         selected_product_id = request.json.get(
             'selected_product', "")  # Default to empty if not provided
 
-        print(transaction_count, selected_product_id)
-
-        # Retrieve transactions based on the selected product ID and transaction count
-        transactions = Transactions.query.filter_by(product_id=selected_product_id) \
-            .order_by(Transactions.transaction_date.desc()).limit(transaction_count).all()
-
-        # Prepare transaction data for PDF creation
-        transactions_list = [{'transaction_id': t.transaction_id,
-                              'amount_credit': t.amount_credit, 'amount_debit': t.amount_debit,
-                              'transaction_date': t.transaction_date.strftime('%Y-%m-%d %H:%M:%S'), 'balance': t.balance}
-                             for t in transactions]
-
-        # Generate a unique PDF file path
-        outfilepath = str(uuid.uuid4()) + ".pdf"
-        user_id = current_user.id
-        dob = current_user.dob
-        product = Product.query.filter_by(product_id=selected_product_id).first()
-        product_type = product.product_type
-        # Create the PDF and upload it to S3
-        try:
-            create_pdf(transactions_list, outfilepath, dob, current_user.name, selected_product_id, product_type)
-        except Exception as e:
-            return jsonify({"message": "PDF creation failed."}), 500
-        url, success = upload_to_s3(outfilepath, outfilepath)
-        print(url, success)
-        if success:
-            try:
-                # Send SMS with the PDF URL
-                print(user_id)
-                cl = get_client()
-                message=f"Dear Customer, please find your statement for {product_type} {selected_product_id}: {url}"
-                resp = send_sms(client=cl, src_ph=os.environ.get(
-                    "PLIVO_NUM"), dst_ph=current_user.contact_number, msg=message)
-                print(resp)
-                # Sending a 200 confirmation response with a flash message
-                flash(
-                    f'PDF creation and SMS send request received for {transaction_count} transactions.', 'success')
-            except Exception as e:
-                flash(f'SMS sending failed.')
-                return jsonify({"message": "SMS sending failed."}), 501
-
-            return jsonify({"message": "PDF creation and SMS send request received."}), 200
-        else:
-            return jsonify({"message": "PDF upload failed."}), 500
+        logger.info('Statement of %d transactions requested for %s', transaction_count, selected_product_id)
+        max_count = current_app.config['STATEMENT_MAX_TRANSACTIONS']
+        if transaction_count < 1 or transaction_count > max_count:
+            return jsonify({"message": f"transaction_count must be between 1 and {max_count}."}), 400
+
+        product = get_user_product(current_user.id, selected_product_id)
+        if not product:
+            return jsonify({"message": "Product not found."}), 404
+
+        # Rendering, upload and SMS happen in the statement worker pool
+        job = submit_statement_job(current_user.id, selected_product_id, transaction_count)
+        flash(
+            f'PDF creation and SMS send request received for {transaction_count} transactions.', 'success')
+        return jsonify({"message": "PDF creation and SMS send request received.", "job_id": job.job_id,
+                        "status_url": url_for('main.statement_status', job_id=job.job_id)}), 202
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-@main.route('/receive_sms/', methods=['GET', 'POST'])
-def inbound_sms():
+@main.route('/statements/<job_id>', methods=['GET'])
+@login_required
+def statement_status(job_id):
     """
-    Handles inbound SMS messages.
+    Returns the status of one of the logged-in user's statement jobs.
+
+    Args:
+        job_id (str): Job ID returned by /createAndSendPDF.
 
     Returns:
-        str: Response to the inbound SMS.
+        str: JSON response with the job status, and its URL or error once finished.
     """
-    from_number = request.values.get('From')
-    to_number = request.values.get('To')
-    text = request.values.get('Text')
-    print('Message received - From: %s, To: %s, Text: %s' %
-          (from_number, to_number, text))
-    return 'Message Received'
+    job = StatementJob.query.filter_by(job_id=job_id, user_id=current_user.id).first()
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify({
+        'job_id': job.job_id,
+        'product_id': job.product_id,
+        'transaction_count': job.transaction_count,
+        'status': job.status,
+        'url': job.url,
+        'error': job.error,
+        'created_at': job.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'updated_at': job.updated_at.strftime('%Y-%m-%d %H:%M:%S')
+    }), 200
 
 
-def upload_to_s3(awsfilepath, localfilepath):
+@main.route('/receive_sms/', methods=['GET', 'POST'])
+def inbound_sms():
     """
-    Uploads a file to an Amazon S3 bucket.
+    Handles inbound SMS messages.
 
-    Args:
-        awsfilepath (str): Path for the file in the S3 bucket.
-        localfilepath (str): Local path of the file to be uploaded.
+    Requests without a valid Plivo signature are refused. The message is queued for the inbound
+    command workers (BAL, LAST, STMT) and acknowledged right away; replies are sent by SMS once
+    processed. When the queue is full a 503 asks Plivo to retry later.
 
     Returns:
-        str: URL of the uploaded file or an error message.
+        str: Response to the inbound SMS.
     """
-    AWS_REGION = os.environ.get('AWS_REGION')
-    AWS_ACCESS_ID = os.environ.get('AWS_ACCESS_ID')
-    AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
-    S3_BUCKET = os.environ.get('S3_BUCKET')
+    refused = check_signature(request.method, request.url, request.form.to_dict(),
+                              request.headers.get('X-Plivo-Signature-V3-Nonce'),
+                              request.headers.get('X-Plivo-Signature-V3'))
+    if refused:
+        status, error = refused
+        return error, status
 
-    try:
-        # Creating a resource for 's3'
-        s3_resource = boto3.resource(
-            's3',
-            region_name=AWS_REGION,
-            aws_access_key_id=AWS_ACCESS_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-        )
-
-        # Upload a file to S3 bucket
-        s3_resource.Bucket(S3_BUCKET).put_object(
-            Key=awsfilepath,
-            Body=open(localfilepath, 'rb')
-        )
-
-        # Creating a client for 's3'
-        s3_client = boto3.client(
-            's3',
-            region_name=AWS_REGION,
-            aws_access_key_id=AWS_ACCESS_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-        )
-        try:
-            # Check if the file was uploaded successfully
-            s3_client.head_object(Bucket=S3_BUCKET, Key=awsfilepath)
-            print("File was uploaded successfully")
-            # Generate the URL to get 'key-name' from 'bucket-name'
-            url = s3_client.generate_presigned_url(
-                ClientMethod='get_object',
-                Params={
-                    'Bucket': S3_BUCKET,
-                    'Key': awsfilepath
-                }
-            )
-            return url, True
-
-        except ClientError:
-            # The file wasn't found.
-            return "File was not found in the bucket. Upload failed.", False
-    except NoCredentialsError:
-        return "No AWS credentials were found", False
+    from_number = request.values.get('From')
+    to_number = request.values.get('To')
+    text = request.values.get('Text')
+    if not from_number:
+        return 'Missing sender', 400
+    if not get_processor().submit(from_number, to_number, text, request.values.get('MessageUUID')):
+        return 'Busy', 503
+    return 'Message Received'
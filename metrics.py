@@ -0,0 +1,278 @@
+import cProfile
+import hmac
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in seconds (+Inf is implicit)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Header that asks for a profile of the request; its value must equal PROFILING_TOKEN
+PROFILE_HEADER = 'X-Profile'
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Thread-safe counter with labels, rendered in the Prometheus text format.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}'
+
+
+class Histogram:
+    """
+    Thread-safe histogram with labels, rendered in the Prometheus text format.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            counts, total = self._values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def snapshot(self, **labels):
+        """
+        Returns:
+            dict: count and sum of the observations with these labels.
+        """
+        with self._lock:
+            counts, total = self._values.get(_label_key(self.labelnames, labels), ([0], 0.0))
+            return {'count': sum(counts), 'sum': total}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="%s"' % _format_number(bound)
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, key, [le])} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(total)}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}'
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Time spent handling HTTP requests.',
+                            ('endpoint', 'method'))
+REQUESTS = Counter('http_requests_total', 'HTTP requests handled.', ('endpoint', 'method', 'status'))
+REQUEST_QUERIES = Histogram('http_request_db_queries', 'SQL statements executed per HTTP request.',
+                            ('endpoint',), buckets=COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram('http_request_db_seconds', 'Time spent in SQL statements per HTTP request.',
+                            ('endpoint',))
+QUERY_LATENCY = Histogram('db_query_duration_seconds', 'Time spent executing SQL statements.')
+EXTERNAL_LATENCY = Histogram('external_call_duration_seconds', 'Time spent in calls to external services.',
+                             ('service', 'operation'))
+EXTERNAL_ERRORS = Counter('external_call_errors_total', 'Failed calls to external services.',
+                          ('service', 'operation'))
+
+REGISTRY = [REQUEST_LATENCY, REQUESTS, REQUEST_QUERIES, REQUEST_DB_TIME, QUERY_LATENCY,
+            EXTERNAL_LATENCY, EXTERNAL_ERRORS]
+
+
+def render():
+    """
+    Renders every registered metric in the Prometheus text exposition format.
+
+    Returns:
+        str: Exposition text.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """
+    Clears every registered metric (for tests and benchmarks).
+    """
+    for metric in REGISTRY:
+        metric.reset()
+
+
+@contextmanager
+def timed(service, operation):
+    """
+    Times a call to an external service into external_call_duration_seconds, counting it in
+    external_call_errors_total if it raises.
+
+    Args:
+        service (str): Service name, e.g. 'plivo' or 's3'.
+        operation (str): Operation name, e.g. 'send_sms'.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        EXTERNAL_ERRORS.inc(service=service, operation=operation)
+        raise
+    finally:
+        EXTERNAL_LATENCY.observe(time.perf_counter() - start, service=service, operation=operation)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # kept on the statement's execution context, so a failed statement leaves nothing behind
+    context._metrics_query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_query_start
+    QUERY_LATENCY.observe(elapsed)
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
+
+
+def _endpoint():
+    # Unmatched URLs share one label so 404 scans don't create a series per path
+    return request.endpoint or 'unmatched'
+
+
+def _start_profiler(app):
+    token = app.config['PROFILING_TOKEN']
+    supplied = request.headers.get(PROFILE_HEADER)
+    requested = bool(token and supplied) and hmac.compare_digest(supplied.encode(), token.encode())
+    sampled = app.config['PROFILING_SAMPLE_RATE'] > 0 and random.random() < app.config['PROFILING_SAMPLE_RATE']
+    if not (requested or sampled):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another profiler is active (e.g. on another thread with the monitoring-based cProfile)
+        return None
+    return profiler
+
+
+def _stop_profiler(app, profiler, response):
+    profiler.disable()
+    directory = app.config['PROFILING_DIR']
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{_endpoint()}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.prof")
+    profiler.dump_stats(path)
+    logger.info('Profile of %s %s written to %s', request.method, request.path, path)
+    response.headers['X-Profile-Path'] = path
+
+
+def init_app(app):
+    """
+    Instruments the application's requests and registers the /metrics endpoint.
+
+    Every request records its latency, status and the number and duration of its SQL statements
+    (also sent back in a Server-Timing header). Requests carrying an X-Profile header equal to
+    PROFILING_TOKEN, and a PROFILING_SAMPLE_RATE fraction of all requests, are run under cProfile
+    and the stats are written to PROFILING_DIR.
+    """
+    @app.before_request
+    def _start_request():
+        g.request_start = time.perf_counter()
+        g.db_queries = 0
+        g.db_seconds = 0.0
+        g.profiler = _start_profiler(app)
+
+    @app.after_request
+    def _finish_request(response):
+        if 'request_start' not in g:
+            return response
+        if g.profiler is not None:
+            _stop_profiler(app, g.profiler, response)
+            g.profiler = None
+        elapsed = time.perf_counter() - g.request_start
+        endpoint = _endpoint()
+        REQUEST_LATENCY.observe(elapsed, endpoint=endpoint, method=request.method)
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        REQUEST_QUERIES.observe(g.db_queries, endpoint=endpoint)
+        REQUEST_DB_TIME.observe(g.db_seconds, endpoint=endpoint)
+        response.headers['Server-Timing'] = (f'db;dur={g.db_seconds * 1000:.1f};desc="{g.db_queries} queries", '
+                                             f'app;dur={elapsed * 1000:.1f}')
+        return response
+
+    @app.teardown_request
+    def _teardown_request(exc):
+        # after_request did not run (e.g. another hook failed): don't leave the profiler on
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+    if app.config['METRICS_ENABLED']:
+        @app.route('/metrics')
+        def metrics_endpoint():
+            return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -1,4 +1,5 @@
 from . import db
+from .money import Money
 from flask_login import UserMixin
 
 class User(UserMixin, db.Model):
@@ -16,9 +17,9 @@ class User(UserMixin, db.Model):
     """
     id = db.Column(db.Integer, primary_key=True) # primary keys are required by SQLAlchemy
     email = db.Column(db.String(100), unique=True)
-    password = db.Column(db.String(100))
+    password = db.Column(db.String(200))
     name = db.Column(db.String(1000))
-    contact_number = db.Column(db.String(20))
+    contact_number = db.Column(db.String(20), index=True)  # inbound SMS sender lookup
     dob=db.Column(db.String(10), nullable=False)
     products = db.relationship('Product', backref='user', lazy=True)
     
@@ -32,20 +33,29 @@ class Product(db.Model):
         user_id (int): User ID (foreign key referencing the User table).
         product_type (str): Type of the product (e.g., credit card, savings account).
         date_of_opening (datetime): Date of opening the product.
-        current_balance (int): Current balance for the product.
-        current_due (int): Current due for the product.
+        current_balance (int): Current balance for the product, in paise.
+        current_due (int): Current due for the product, in paise.
         payment_due_date (datetime): Payment due date for the product.
+        version (int): Incremented on every posting; used for compare-and-swap updates.
         transactions (relationship): Relationship with Transactions table representing the transactions associated with the product.
     """
     product_id = db.Column(db.String(6), primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     product_type = db.Column(db.String(50), nullable=False)
     date_of_opening = db.Column(db.Date, nullable=False)
-    current_balance = db.Column(db.Integer, default=0)
-    current_due = db.Column(db.Integer, default=0)
+    current_balance = db.Column(Money, default=0)
+    current_due = db.Column(Money, default=0)
     payment_due_date = db.Column(db.Date)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     transactions = db.relationship('Transactions', backref='product', lazy=True)
 
+    __table_args__ = (
+        # products of a user, optionally of one type (dashboard, credit card payment)
+        db.Index('ix_product_user_type', 'user_id', 'product_type'),
+        # products of a type due in a date range (payment reminders)
+        db.Index('ix_product_type_due_date', 'product_type', 'payment_due_date', 'product_id'),
+    )
+
 
 class Transactions(db.Model):
     """
@@ -54,14 +64,232 @@ class Transactions(db.Model):
     Attributes:
         transaction_id (str): Transaction ID (primary key for the Transactions table).
         product_id (str): Product ID (foreign key referencing the Product table).
-        amount_credit (float): Amount credited in the transaction.
-        amount_debit (float): Amount debited in the transaction.
+        amount_credit (int): Amount credited in the transaction, in paise.
+        amount_debit (int): Amount debited in the transaction, in paise.
         transaction_date (datetime): Date and time of the transaction.
-        balance (int): Balance after the transaction.
+        balance (int): Balance after the transaction, in paise.
     """
     transaction_id = db.Column(db.String, primary_key=True)
     product_id = db.Column(db.String(6), db.ForeignKey('product.product_id'), nullable=False)
-    amount_credit = db.Column(db.Float, nullable=False)
-    amount_debit = db.Column(db.Float, nullable=False)
+    amount_credit = db.Column(Money, nullable=False)
+    amount_debit = db.Column(Money, nullable=False)
     transaction_date = db.Column(db.DateTime, nullable=False)
-    balance = db.Column(db.Integer, nullable=False)
\ No newline at end of file
+    balance = db.Column(Money, nullable=False)
+
+    __table_args__ = (
+        # transaction history of a product, newest first; transaction_id breaks ties for keyset pagination
+        db.Index('ix_transactions_product_date', 'product_id', 'transaction_date', 'transaction_id'),
+    )
+
+
+class StatementJob(db.Model):
+    """
+    StatementJob model representing a PDF statement request processed in the background.
+
+    Attributes:
+        job_id (str): Job ID (primary key for the StatementJob table).
+        user_id (int): User ID (foreign key referencing the User table) of the requester.
+        product_id (str): Product ID (foreign key referencing the Product table) of the statement.
+        transaction_count (int): Number of latest transactions in the statement.
+        status (str): One of 'queued', 'running', 'done' or 'failed'.
+        url (str): Download URL of the statement once the job is done.
+        error (str): Error message if the job failed.
+        created_at (datetime): Date and time the job was requested.
+        updated_at (datetime): Date and time of the last status change.
+    """
+    job_id = db.Column(db.String(36), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    product_id = db.Column(db.String(6), db.ForeignKey('product.product_id'), nullable=False)
+    transaction_count = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    url = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        # pending jobs in request order, for the recovery command
+        db.Index('ix_statement_job_status_created', 'status', 'created_at'),
+    )
+
+
+class SentReminder(db.Model):
+    """
+    SentReminder model logging the payment-due reminders already sent, so each due date is reminded once.
+
+    Attributes:
+        id (int): Primary key for the SentReminder table.
+        product_id (str): Product ID (foreign key referencing the Product table).
+        payment_due_date (date): Due date the reminder was sent for.
+        sent_at (datetime): Date and time the reminder was queued.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.String(6), db.ForeignKey('product.product_id'), nullable=False)
+    payment_due_date = db.Column(db.Date, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'payment_due_date', name='uq_sent_reminder_product_due'),
+    )
+
+
+class BalanceSnapshot(db.Model):
+    """
+    BalanceSnapshot model holding a product's closing balance and totals for each day it had transactions.
+    Maintained on every posting, so balances as of a date don't need the full history.
+
+    Attributes:
+        product_id (str): Product ID (foreign key referencing the Product table).
+        snapshot_date (date): Day of the snapshot.
+        closing_balance (int): Balance after the last transaction of the day, in paise.
+        total_credit (int): Sum of the amounts credited that day, in paise.
+        total_debit (int): Sum of the amounts debited that day, in paise.
+        transaction_count (int): Number of transactions that day.
+    """
+    product_id = db.Column(db.String(6), db.ForeignKey('product.product_id'), primary_key=True)
+    snapshot_date = db.Column(db.Date, primary_key=True)
+    closing_balance = db.Column(Money, nullable=False)
+    total_credit = db.Column(Money, nullable=False, default=0)
+    total_debit = db.Column(Money, nullable=False, default=0)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class InboundMessage(db.Model):
+    """
+    InboundMessage model logging the SMS commands received from Plivo, so a retried webhook is processed once.
+
+    Attributes:
+        message_uuid (str): Plivo MessageUUID (primary key for the InboundMessage table).
+        from_number (str): Sender's phone number.
+        to_number (str): Number the message was sent to.
+        text (str): Message text.
+        user_id (int): User ID (foreign key referencing the User table) of the sender, if known.
+        reply (str): Reply queued for the sender.
+        received_at (datetime): Date and time the message was processed.
+    """
+    message_uuid = db.Column(db.String(64), primary_key=True)
+    from_number = db.Column(db.String(20), nullable=False)
+    to_number = db.Column(db.String(20))
+    text = db.Column(db.Text)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    reply = db.Column(db.Text)
+    received_at = db.Column(db.DateTime, nullable=False)
+
+
+class IdempotencyRecord(db.Model):
+    """
+    IdempotencyRecord model storing the response of a request made with an Idempotency-Key header, so a
+    retried request is answered with the original response instead of being processed again.
+
+    Attributes:
+        scope (str): Endpoint (and user, for logged-in requests) the key belongs to.
+        key (str): Client-supplied Idempotency-Key.
+        request_hash (str): SHA-256 of the request body, to reject a key reused for another request.
+        status_code (int): Status of the stored response, or None while the first request is in progress.
+        response_body (str): Body of the stored response.
+        mimetype (str): Mimetype of the stored response.
+        created_at (datetime): Date and time the key was first used; records expire IDEMPOTENCY_TTL seconds later.
+    """
+    scope = db.Column(db.String(120), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    mimetype = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, nullable=False, index=True)  # TTL eviction
+
+
+class OutboxEvent(db.Model):
+    """
+    OutboxEvent model holding the append-only change stream for downstream consumers. Events are
+    written in the same database transaction as the change they describe and are read by
+    event_id, either through /events or by the relay command.
+
+    Attributes:
+        event_id (int): Primary key, increasing in insertion order; consumers use it as their cursor.
+        event_type (str): Kind of event, e.g. 'transaction.posted'.
+        aggregate_id (str): ID of the object the event is about (the product for transactions).
+        payload (str): JSON document describing the change.
+        created_at (datetime): Date and time the event was recorded.
+    """
+    event_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    aggregate_id = db.Column(db.String(36), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+
+class RelayCursor(db.Model):
+    """
+    RelayCursor model storing how far each relay sink has read the outbox.
+
+    Attributes:
+        name (str): Name of the sink (primary key for the RelayCursor table).
+        last_event_id (int): event_id of the last event the sink acknowledged.
+        updated_at (datetime): Date and time of the last acknowledgement.
+    """
+    name = db.Column(db.String(255), primary_key=True)
+    last_event_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+
+class TransactionsArchive(db.Model):
+    """
+    TransactionsArchive model holding transactions moved out of the Transactions table once they are
+    older than the archive horizon, so the hot table and its indexes stay small. It has the same
+    columns as Transactions; every archived transaction is older than all the transactions left in
+    the hot table.
+
+    Attributes:
+        transaction_id (str): Transaction ID (primary key for the TransactionsArchive table).
+        product_id (str): Product ID (foreign key referencing the Product table).
+        amount_credit (int): Amount credited in the transaction, in paise.
+        amount_debit (int): Amount debited in the transaction, in paise.
+        transaction_date (datetime): Date and time of the transaction.
+        balance (int): Balance after the transaction, in paise.
+    """
+    __tablename__ = 'transactions_archive'
+
+    transaction_id = db.Column(db.String, primary_key=True)
+    product_id = db.Column(db.String(6), db.ForeignKey('product.product_id'), nullable=False)
+    amount_credit = db.Column(Money, nullable=False)
+    amount_debit = db.Column(Money, nullable=False)
+    transaction_date = db.Column(db.DateTime, nullable=False)
+    balance = db.Column(Money, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_transactions_archive_product_date', 'product_id', 'transaction_date', 'transaction_id'),
+    )
+
+
+class StatementCacheEntry(db.Model):
+    """
+    StatementCacheEntry model recording a rendered and stored statement PDF, so an identical request
+    (same product, latest transaction, transaction count, owner details and template) reuses it.
+
+    Attributes:
+        cache_key (str): SHA-256 of what the statement's content depends on (primary key).
+        product_id (str): Product ID (foreign key referencing the Product table) of the statement.
+        object_key (str): Key of the stored PDF (S3 object or local file name).
+        created_at (datetime): Date and time the PDF was stored; entries expire STATEMENT_CACHE_TTL seconds later.
+        last_used_at (datetime): Date and time the entry was last used, for least-recently-used eviction.
+        hits (int): Number of requests served from the entry.
+    """
+    cache_key = db.Column(db.String(64), primary_key=True)
+    product_id = db.Column(db.String(6), db.ForeignKey('product.product_id'), nullable=False)
+    object_key = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    last_used_at = db.Column(db.DateTime, nullable=False, index=True)  # LRU eviction
+    hits = db.Column(db.Integer, nullable=False, default=0)
+
+
+class SchemaMigration(db.Model):
+    """
+    SchemaMigration model recording the data migrations 'flask migrate' has applied, so each runs once.
+
+    Attributes:
+        name (str): Name of the migration (primary key for the SchemaMigration table).
+        applied_at (datetime): Date and time the migration was applied.
+    """
+    name = db.Column(db.String(100), primary_key=True)
+    applied_at = db.Column(db.DateTime, nullable=False)
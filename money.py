@@ -0,0 +1,80 @@
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import BigInteger
+from sqlalchemy.types import TypeDecorator
+
+# Minor units (paise) per rupee
+MINOR_UNITS = 100
+
+# Largest amount accepted for a single posting, in paise (ten thousand crore rupees); it keeps balances
+# built from such amounts far below the BIGINT limit of Money columns (2**63 - 1)
+MAX_AMOUNT = 10 ** 11 * MINOR_UNITS
+
+
+class Money(TypeDecorator):
+    """
+    Column type for amounts in integer minor units (paise), stored as BIGINT.
+
+    Binding anything but an int raises, so a float can't slip into the ledger unnoticed. Results,
+    including SUMs that some databases return as NUMERIC, come back as int.
+    """
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or type(value) is int:
+            return value
+        raise TypeError(f"Money columns take integer minor units, got {value!r}")
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else int(value)
+
+
+def to_minor(value):
+    """
+    Parses an amount in rupees, as sent by API clients, into paise.
+
+    Numbers are read through their decimal representation (a JSON 10.1 is exactly 1010 paise), and
+    amounts with more than two decimal places are rejected rather than rounded, as are amounts beyond
+    MAX_AMOUNT paise either way.
+
+    Args:
+        value (int, float, str or Decimal): Amount in rupees.
+
+    Returns:
+        int: Amount in paise.
+
+    Raises:
+        ValueError: If value isn't a finite amount with at most two decimal places, or is too large.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float, str, Decimal)):
+        raise ValueError(f"Invalid amount {value!r}")
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount {value!r}") from None
+    # bound the amount before scaling it, so huge exponents can't overflow the decimal context
+    if not amount.is_finite() or abs(amount) > MAX_AMOUNT // MINOR_UNITS:
+        raise ValueError(f"Invalid amount {value!r}")
+    amount *= MINOR_UNITS
+    if amount != amount.to_integral_value():
+        raise ValueError(f"Invalid amount {value!r}")
+    return int(amount)
+
+
+def to_major(minor):
+    """
+    Converts paise into a rupee number for JSON responses.
+
+    Returns:
+        float: The amount in rupees, whose repr is the exact two-decimal amount, or None for None.
+    """
+    return None if minor is None else minor / MINOR_UNITS
+
+
+def format_amount(minor):
+    """
+    Formats paise as a rupee amount with two decimals (e.g. 123456 -> '1234.56'), exactly.
+    """
+    rupees, paise = divmod(abs(minor), MINOR_UNITS)
+    return f"{'-' if minor < 0 else ''}{rupees}.{paise:02d}"
@@ -0,0 +1,212 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import current_app
+
+from .plivo_utils import send_sms, get_client, FakeClient
+
+logger = logging.getLogger(__name__)
+
+# Sentinel put on the queue to ask a worker thread to exit
+_STOP = object()
+
+
+class NotificationDispatcher:
+    """
+    Background SMS dispatcher backed by a bounded in-process queue and a pool of worker threads.
+
+    Request handlers enqueue messages and return immediately; the workers deliver them through the
+    client returned by client_factory (by default the process-wide pooled Plivo client), retrying
+    failed sends with exponential backoff. Messages that still fail, or that cannot be queued because the queue is full, are kept
+    in a bounded dead-letter store for inspection.
+
+    Attributes:
+        dead_letters (collections.deque): Most recent undeliverable messages with their failure reason.
+    """
+
+    def __init__(self, client_factory=get_client, workers=2, maxsize=1000, max_retries=3,
+                 backoff=0.5, dead_letter_size=1000):
+        """
+        Args:
+            client_factory (callable): Returns a Plivo-compatible client (anything with messages.create).
+            workers (int): Number of worker threads.
+            maxsize (int): Maximum number of pending messages.
+            max_retries (int): Retries after the first failed attempt before dead-lettering.
+            backoff (float): Initial retry delay in seconds, doubled on every retry.
+            dead_letter_size (int): Number of dead letters to keep.
+        """
+        self.client_factory = client_factory
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.dead_letters = deque(maxlen=dead_letter_size)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the worker threads. Calling it more than once has no effect.
+        """
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'sms-dispatcher-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        """
+        Stops the worker threads after the messages already queued have been processed.
+
+        Args:
+            timeout (float): Seconds to wait for each worker to exit.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+    def enqueue(self, dst_ph, msg, src_ph=None, block=False, timeout=None, on_done=None):
+        """
+        Queues an SMS for background delivery, by default without blocking.
+
+        Args:
+            dst_ph (str): Destination phone number.
+            msg (str): Message content.
+            src_ph (str): Source phone number, defaults to the one used by send_sms.
+            block (bool): Wait for room in the queue instead of dead-lettering when it is full.
+            timeout (float): With block, seconds to wait for room (None waits as long as it takes).
+            on_done (callable): Called from the worker thread with None once the message is delivered,
+                or with the failure reason once it is dead-lettered. Not called if enqueue returns False.
+
+        Returns:
+            bool: True if the message was queued, False if it went straight to the dead-letter store.
+        """
+        message = {'dst_ph': dst_ph, 'msg': msg, 'src_ph': src_ph, 'on_done': on_done}
+        if not dst_ph:
+            self._dead_letter(message, 'missing destination number')
+            return False
+        try:
+            self._queue.put(message, block=block, timeout=timeout)
+        except queue.Full:
+            self._dead_letter(message, 'queue full')
+            return False
+        return True
+
+    def join(self):
+        """
+        Blocks until every queued message has been delivered or dead-lettered.
+        """
+        self._queue.join()
+
+    def _dead_letter(self, message, reason):
+        logger.warning('SMS to %s dead-lettered: %s', message['dst_ph'], reason)
+        self.dead_letters.append({'dst_ph': message['dst_ph'], 'msg': message['msg'], 'src_ph': message['src_ph'],
+                                  'reason': reason, 'failed_at': datetime.now()})
+
+    def _deliver(self, client, message):
+        kwargs = {'dst_ph': message['dst_ph'], 'msg': message['msg']}
+        if message['src_ph']:
+            kwargs['src_ph'] = message['src_ph']
+        return send_sms(client, **kwargs)
+
+    def _run(self):
+        client = None
+        while True:
+            message = self._queue.get()
+            try:
+                if message is _STOP:
+                    return
+                delay = self.backoff
+                failure = None
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        if client is None:
+                            client = self.client_factory()
+                        self._deliver(client, message)
+                        break
+                    except Exception as e:
+                        # Ask the factory for the client again on the next attempt
+                        client = None
+                        if attempt == self.max_retries:
+                            failure = repr(e)
+                            self._dead_letter(message, failure)
+                        else:
+                            time.sleep(delay)
+                            delay *= 2
+                if message['on_done'] is not None:
+                    try:
+                        message['on_done'](failure)
+                    except Exception:
+                        logger.exception('SMS delivery callback failed')
+            finally:
+                self._queue.task_done()
+
+
+def init_app(app):
+    """
+    Creates the application's dispatcher from its configuration and starts it.
+
+    The Plivo client is chosen by SMS_CLIENT_FACTORY if set, otherwise by SMS_BACKEND
+    ('plivo' for the real API, 'fake' for an in-memory FakeClient shared by all workers).
+
+    Args:
+        app (flask.Flask): Application to attach the dispatcher to.
+
+    Returns:
+        NotificationDispatcher: The started dispatcher.
+    """
+    client_factory = app.config.get('SMS_CLIENT_FACTORY')
+    if client_factory is None:
+        if app.config['SMS_BACKEND'] == 'fake':
+            fake_client = FakeClient()
+            client_factory = lambda: fake_client
+        else:
+            client_factory = get_client
+
+    dispatcher = NotificationDispatcher(
+        client_factory=client_factory,
+        workers=app.config['SMS_WORKERS'],
+        maxsize=app.config['SMS_QUEUE_SIZE'],
+        max_retries=app.config['SMS_MAX_RETRIES'],
+        backoff=app.config['SMS_RETRY_BACKOFF'],
+    )
+    dispatcher.start()
+    atexit.register(dispatcher.stop)
+    app.extensions['notifications'] = dispatcher
+    return dispatcher
+
+
+def get_dispatcher():
+    """
+    Returns the dispatcher of the current application.
+
+    Returns:
+        NotificationDispatcher: Dispatcher created by init_app.
+    """
+    return current_app.extensions['notifications']
+
+
+def enqueue_sms(dst_ph, msg, src_ph=None, **kwargs):
+    """
+    Queues an SMS on the current application's dispatcher.
+
+    Args:
+        dst_ph (str): Destination phone number.
+        msg (str): Message content.
+        src_ph (str): Source phone number, defaults to the one used by send_sms.
+        **kwargs: block, timeout and on_done, as accepted by NotificationDispatcher.enqueue.
+
+    Returns:
+        bool: True if the message was queued.
+    """
+    return get_dispatcher().enqueue(dst_ph, msg, src_ph=src_ph, **kwargs)
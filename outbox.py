@@ -0,0 +1,249 @@
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+
+from . import db
+from .models import OutboxEvent, RelayCursor
+from .serializers import dumps
+from .money import to_major
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_POSTED = 'transaction.posted'
+
+
+def record_transaction_events(postings):
+    """
+    Adds a 'transaction.posted' outbox event per posting to the current database transaction, so the
+    events are committed (or rolled back) together with the transactions.
+
+    Args:
+        postings (iterable): Dictionaries with transaction_id, product_id, amount_credit, amount_debit,
+            transaction_date and balance (amounts in paise; the payload carries them in rupees).
+    """
+    now = datetime.now()
+    events = [{
+        'event_type': TRANSACTION_POSTED,
+        'aggregate_id': posting['product_id'],
+        'payload': json.dumps({
+            'transaction_id': posting['transaction_id'],
+            'product_id': posting['product_id'],
+            'amount_credit': to_major(posting['amount_credit']),
+            'amount_debit': to_major(posting['amount_debit']),
+            'transaction_date': posting['transaction_date'].isoformat(),
+            'balance': to_major(posting['balance']),
+        }),
+        'created_at': now,
+    } for posting in postings]
+    if events:
+        db.session.bulk_insert_mappings(OutboxEvent, events)
+
+
+def read_events(after=0, limit=100, settle_seconds=0):
+    """
+    Returns the outbox events following a cursor, oldest first.
+
+    Args:
+        after (int): event_id of the last event already read (0 for the start of the stream).
+        limit (int): Maximum number of events.
+        settle_seconds (float): Leave out events younger than this. With concurrent writers, IDs are
+            allocated before commit, so a young event may still be followed by a lower ID committing later.
+
+    Returns:
+        list: Dictionaries with event_id, event_type, aggregate_id, created_at and the decoded payload.
+    """
+    query = db.session.query(OutboxEvent.event_id, OutboxEvent.event_type, OutboxEvent.aggregate_id,
+                             OutboxEvent.payload, OutboxEvent.created_at) \
+        .filter(OutboxEvent.event_id > after)
+    if settle_seconds:
+        query = query.filter(OutboxEvent.created_at <= datetime.now() - timedelta(seconds=settle_seconds))
+    return [{'event_id': row.event_id, 'event_type': row.event_type, 'aggregate_id': row.aggregate_id,
+             'created_at': row.created_at.isoformat(), 'payload': json.loads(row.payload)}
+            for row in query.order_by(OutboxEvent.event_id).limit(limit)]
+
+
+class FileSink:
+    """
+    Appends events to a file as newline-delimited JSON.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def publish(self, events):
+        with open(self.path, 'ab') as f:
+            f.write(b''.join(dumps(event) + b'\n' for event in events))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class SQLiteQueueSink:
+    """
+    Inserts events into an 'events' table of a separate SQLite database, ignoring events already
+    there, so consumers on the same machine can read them as a queue.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS events (event_id INTEGER PRIMARY KEY, event_type TEXT NOT NULL, '
+                           'aggregate_id TEXT NOT NULL, created_at TEXT NOT NULL, payload TEXT NOT NULL)')
+        self._conn.commit()
+
+    def publish(self, events):
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO events (event_id, event_type, aggregate_id, created_at, payload) VALUES (?, ?, ?, ?, ?)',
+                [(event['event_id'], event['event_type'], event['aggregate_id'], event['created_at'],
+                  json.dumps(event['payload'])) for event in events])
+
+
+class WebhookSink:
+    """
+    POSTs each batch of events as a JSON array to a URL; any non-2xx response fails the batch.
+    """
+
+    def __init__(self, url, timeout=10):
+        import requests
+
+        self.url = url
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def publish(self, events):
+        response = self._session.post(self.url, data=dumps(events), timeout=self.timeout,
+                                      headers={'Content-Type': 'application/json'})
+        response.raise_for_status()
+
+
+def make_sink(spec):
+    """
+    Builds a sink from its specification: 'file:<path>', 'sqlite:<path>' or an http(s) URL.
+
+    Raises:
+        ValueError: If the specification is not recognised.
+    """
+    if spec.startswith(('http://', 'https://')):
+        return WebhookSink(spec)
+    kind, sep, target = spec.partition(':')
+    if sep and target:
+        if kind == 'file':
+            return FileSink(target)
+        if kind == 'sqlite':
+            return SQLiteQueueSink(target)
+    raise ValueError(f"Unknown sink {spec!r}; use file:<path>, sqlite:<path> or an http(s) URL")
+
+
+def relay(name, sink, batch_size=500, settle_seconds=0, max_batches=None):
+    """
+    Publishes the outbox events a sink hasn't acknowledged yet, batch by batch.
+
+    The sink's cursor is advanced after each successful publish, so delivery is at least once: a
+    batch interrupted by a failure is published again on the next run.
+
+    Args:
+        name (str): Cursor name of the sink.
+        sink: Object with a publish(events) method.
+        batch_size (int): Events per publish.
+        settle_seconds (float): See read_events.
+        max_batches (int): Stop after this many batches (None to drain the outbox).
+
+    Returns:
+        int: Number of events published.
+    """
+    cursor = db.session.get(RelayCursor, name)
+    if cursor is None:
+        cursor = RelayCursor(name=name, last_event_id=0, updated_at=datetime.now())
+        db.session.add(cursor)
+        db.session.commit()
+
+    published = batches = 0
+    while max_batches is None or batches < max_batches:
+        events = read_events(cursor.last_event_id, batch_size, settle_seconds)
+        if not events:
+            break
+        sink.publish(events)
+        cursor.last_event_id = events[-1]['event_id']
+        cursor.updated_at = datetime.now()
+        db.session.commit()
+        published += len(events)
+        batches += 1
+    return published
+
+
+def _relay_loop(app, name, sink, interval):
+    while True:
+        try:
+            with app.app_context():
+                relay(name, sink, app.config['OUTBOX_BATCH_SIZE'], app.config['OUTBOX_SETTLE_SECONDS'])
+        except Exception:
+            logger.exception('Relaying events to %s failed', name)
+        time.sleep(interval)
+
+
+def init_app(app):
+    """
+    Registers the 'relay-events' command and, if OUTBOX_SINK is set, starts a background thread
+    relaying to it every OUTBOX_RELAY_INTERVAL seconds.
+    """
+    @app.cli.command('relay-events')
+    @click.option('--sink', 'spec', required=True, help='file:<path>, sqlite:<path> or an http(s) URL.')
+    @click.option('--name', default=None, help='Cursor name (defaults to the sink specification).')
+    @click.option('--batch-size', default=None, type=int, help='Events per publish.')
+    @click.option('--follow', is_flag=True, help='Keep polling for new events.')
+    @click.option('--interval', default=1.0, type=float, help='Seconds between polls with --follow.')
+    def relay_events_command(spec, name, batch_size, follow, interval):
+        """Publish new outbox events to a sink."""
+        sink = make_sink(spec)
+        while True:
+            count = relay(name or spec, sink, batch_size or app.config['OUTBOX_BATCH_SIZE'],
+                          app.config['OUTBOX_SETTLE_SECONDS'])
+            if count or not follow:
+                click.echo(f"{count} events published to {name or spec}")
+            if not follow:
+                return
+            time.sleep(interval)
+
+    spec = app.config['OUTBOX_SINK']
+    if spec:
+        threading.Thread(target=_relay_loop, args=(app, spec, make_sink(spec), app.config['OUTBOX_RELAY_INTERVAL']),
+                         name='outbox-relay', daemon=True).start()
+
+
+def check_consumer(authorization):
+    """
+    Checks the Authorization header of an /events request against EVENTS_TOKEN.
+
+    Args:
+        authorization (str): Value of the Authorization header, or None.
+
+    Returns:
+        tuple: (status code, error message) to refuse the request with, or None if it is allowed.
+    """
+    token = current_app.config['EVENTS_TOKEN']
+    if not token:
+        return 403, "Event feed is disabled"
+    scheme, _, credentials = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(credentials.strip().encode(), token.encode()):
+        return 401, "Invalid or missing event consumer token"
+    return None
+
+
+def events_page(after, limit):
+    """
+    Returns one page of the /events feed.
+
+    Returns:
+        tuple: (events, cursor to pass as after for the next page).
+    """
+    events = read_events(after, limit, current_app.config['OUTBOX_SETTLE_SECONDS'])
+    return events, events[-1]['event_id'] if events else after
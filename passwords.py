@@ -0,0 +1,119 @@
+import hashlib
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HasherBusy(Exception):
+    """
+    Raised when no hashing slot frees up within the configured wait.
+    """
+
+
+def _check_legacy_hash(pwhash, password):
+    """
+    Verifies hashes made by Werkzeug < 2.3 with a plain digest method, e.g. method='sha256', which
+    newer Werkzeug versions no longer accept. Their format is '<digest>$<salt>$<hex hmac>'.
+    """
+    method, salt, digest = pwhash.split('$', 2)
+    expected = hmac.new(salt.encode(), password.encode(), method).hexdigest()
+    return hmac.compare_digest(expected, digest)
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords on a bounded thread pool.
+
+    scrypt and PBKDF2 release the GIL while they run, so the pool spreads hashing over the cores,
+    while its size caps how many hashes run at once; at most max_pending calls wait for a slot, for
+    up to wait seconds, before HasherBusy is raised. This keeps a login storm from pinning every
+    web worker on hashing.
+    """
+
+    def __init__(self, method='scrypt', workers=4, max_pending=64, wait=5.0):
+        """
+        Args:
+            method (str): Werkzeug hash method for new hashes, e.g. 'scrypt' or 'pbkdf2:sha256:600000'.
+            workers (int): Hashes computed concurrently.
+            max_pending (int): Calls allowed to wait for or hold a slot.
+            wait (float): Seconds a call waits for a slot.
+        """
+        self.method = method
+        self.wait = wait
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hasher')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        # method prefix of hashes made with the configured method, e.g. 'scrypt:32768:8:1'; found on
+        # first use rather than here, since it takes a full (deliberately slow) hash to get it
+        self._prefix = None
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.wait):
+            raise HasherBusy("Password hashing is overloaded")
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        """
+        Returns:
+            str: Hash of the password with the configured method.
+        """
+        pwhash = self._run(generate_password_hash, password, self.method)
+        if self._prefix is None:
+            self._prefix = pwhash.split('$', 1)[0]
+        return pwhash
+
+    def verify(self, pwhash, password):
+        """
+        Checks a password against a stored hash, including legacy plain-digest hashes.
+
+        Returns:
+            bool: True if the password matches.
+        """
+        if not pwhash or pwhash.count('$') != 2:
+            return False
+        if pwhash.split('$', 1)[0] in hashlib.algorithms_guaranteed:
+            return self._run(_check_legacy_hash, pwhash, password)
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """
+        Returns:
+            bool: True if the hash was not made with the configured method and parameters.
+        """
+        if self._prefix is None:
+            self._prefix = self._run(generate_password_hash, '', self.method).split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._prefix
+
+
+def init_app(app):
+    """
+    Creates the app's PasswordHasher from PASSWORD_HASH_METHOD, PASSWORD_HASH_WORKERS,
+    PASSWORD_HASH_MAX_PENDING and PASSWORD_HASH_WAIT.
+    """
+    app.extensions['password_hasher'] = PasswordHasher(
+        method=app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+        wait=app.config['PASSWORD_HASH_WAIT'],
+    )
+
+
+def get_hasher():
+    return current_app.extensions['password_hasher']
+
+
+def hash_password(password):
+    return get_hasher().hash(password)
+
+
+def verify_password(pwhash, password):
+    return get_hasher().verify(pwhash, password)
+
+
+def needs_rehash(pwhash):
+    return get_hasher().needs_rehash(pwhash)
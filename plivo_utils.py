@@ -1,33 +1,130 @@
-import plivo
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import timed
+
+# plivo (and requests under it) is imported by get_client on first use, so processes that never send
+# an SMS, or use FakeClient, don't pay for it at startup.
+
+# Largest number of destinations Plivo accepts in one '<'-separated dst
+MAX_DESTINATIONS_PER_REQUEST = 1000
+
+_client = None
+_client_lock = threading.Lock()
+
 
 def send_sms(client,src_ph=os.environ.get('PLIVO_NUM'),dst_ph='+918340647358', msg='Hello, demo messages from Plivo API'):
     """
-    Sends an SMS using Plivo API.
+    Sends an SMS using Plivo API. The call is timed in the external_call_duration_seconds metric.
 
     Args:
         client (plivo.RestClient): Plivo REST client.
         src_ph (str): Source phone number.
-        dst_ph (str): Destination phone number.
+        dst_ph (str): Destination phone number, or several joined with '<'.
         msg (str): Message content.
 
     Returns:
         plivo.response.Response: Response object from Plivo.
     """
-    response = client.messages.create(
-    src=src_ph,
-    dst=dst_ph,
-    text=msg,)
+    with timed('plivo', 'send_sms'):
+        response = client.messages.create(
+        src=src_ph,
+        dst=dst_ph,
+        text=msg,)
     # print(response)
     return response
 
+
+def send_sms_batch(client, dst_list, msg, src_ph=os.environ.get('PLIVO_NUM'), max_workers=8, multi_dst=False):
+    """
+    Sends the same SMS to many destinations.
+
+    Either fans the sends out over a bounded thread pool (one API call per destination), or, with
+    multi_dst, groups up to MAX_DESTINATIONS_PER_REQUEST destinations per call using Plivo's
+    '<'-separated dst syntax.
+
+    Args:
+        client (plivo.RestClient): Plivo REST client, shared by the threads.
+        dst_list (list): Destination phone numbers.
+        msg (str): Message content.
+        src_ph (str): Source phone number.
+        max_workers (int): Maximum number of concurrent API calls.
+        multi_dst (bool): Use multi-destination requests.
+
+    Returns:
+        list: One dictionary per API call with 'dst' and either 'response' or 'error'.
+    """
+    if multi_dst:
+        groups = ['<'.join(dst_list[i:i + MAX_DESTINATIONS_PER_REQUEST])
+                  for i in range(0, len(dst_list), MAX_DESTINATIONS_PER_REQUEST)]
+    else:
+        groups = list(dst_list)
+
+    def send(dst):
+        try:
+            return {'dst': dst, 'response': send_sms(client, src_ph=src_ph, dst_ph=dst, msg=msg)}
+        except Exception as e:
+            return {'dst': dst, 'error': e}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(groups)))) as executor:
+        return list(executor.map(send, groups))
+
+
 def get_client():
     """
-    Creates and returns a Plivo REST client.
+    Returns the process-wide Plivo REST client, creating it on first use.
+
+    The client's HTTP session keeps connections alive and is given a connection pool large enough
+    for PLIVO_POOL_SIZE concurrent sends (default 20).
 
     Returns:
         plivo.RestClient: Plivo REST client.
     """
-    cl = plivo.RestClient(os.environ['PLIVO_AUTH_ID'],os.environ['PLIVO_AUTH_TOKEN'])
-    return cl
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import plivo
+                from requests.adapters import HTTPAdapter
+
+                cl = plivo.RestClient(os.environ['PLIVO_AUTH_ID'],os.environ['PLIVO_AUTH_TOKEN'])
+                pool_size = int(os.environ.get('PLIVO_POOL_SIZE', 20))
+                cl.session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+                _client = cl
+    return _client
+
+
+def reset_client():
+    """
+    Drops the cached client so the next get_client() call builds a new one.
+    """
+    global _client
+    with _client_lock:
+        _client = None
+
+
+class FakeClient:
+    """
+    In-memory stand-in for plivo.RestClient, used for tests and local runs.
+
+    Messages passed to messages.create are recorded in the sent list instead of being delivered.
+
+    Attributes:
+        sent (list): Dictionaries with the src, dst and text of every message "sent".
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.messages = self
+
+    def create(self, src, dst, text, **kwargs):
+        """
+        Records a message in the same shape as plivo's messages.create.
 
+        Returns:
+            dict: Fake response containing a message UUID.
+        """
+        message = {'src': src, 'dst': dst, 'text': text}
+        self.sent.append(message)
+        return {'message': 'message(s) queued', 'message_uuid': [f'fake-{len(self.sent)}']}
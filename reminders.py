@@ -0,0 +1,199 @@
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import click
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import User, Product, SentReminder
+from .notifications import enqueue_sms
+from .money import format_amount
+
+logger = logging.getLogger(__name__)
+
+
+def iter_due_batches(days, batch_size, today=None):
+    """
+    Streams the credit cards with an outstanding due within the next days that haven't been reminded
+    for that due date yet, in batches.
+
+    Batches are read with keyset pagination over the (product_type, payment_due_date, product_id)
+    index rather than one long-lived cursor, so the caller can commit between batches and memory use
+    stays at one batch however many products match.
+
+    Args:
+        days (int): Look-ahead window in days, today included.
+        batch_size (int): Maximum number of rows per batch.
+        today (date): Start of the window, defaults to the current date.
+
+    Yields:
+        list: Rows with product_id, current_due, payment_due_date and contact_number.
+    """
+    today = today or date.today()
+    last = None
+    while True:
+        query = db.session.query(Product.product_id, Product.current_due, Product.payment_due_date,
+                                 User.contact_number) \
+            .join(User, User.id == Product.user_id) \
+            .outerjoin(SentReminder, and_(SentReminder.product_id == Product.product_id,
+                                          SentReminder.payment_due_date == Product.payment_due_date)) \
+            .filter(Product.product_type == 'CC',
+                    Product.payment_due_date >= today,
+                    Product.payment_due_date < today + timedelta(days=days),
+                    Product.current_due > 0,
+                    SentReminder.id.is_(None))
+        if last is not None:
+            query = query.filter(or_(Product.payment_due_date > last[0],
+                                     and_(Product.payment_due_date == last[0], Product.product_id > last[1])))
+        batch = query.order_by(Product.payment_due_date, Product.product_id).limit(batch_size).all()
+        if not batch:
+            return
+        yield batch
+        last = (batch[-1].payment_due_date, batch[-1].product_id)
+
+
+def _log_reminders(rows):
+    """
+    Claims reminders for rows by logging them and returns the ones claimed; rows already logged by a
+    concurrent run are left out, so two runs never remind the same due date.
+    """
+    now = datetime.now()
+    try:
+        db.session.bulk_insert_mappings(SentReminder, [
+            {'product_id': row.product_id, 'payment_due_date': row.payment_due_date, 'sent_at': now} for row in rows])
+        db.session.commit()
+        return rows
+    except IntegrityError:
+        db.session.rollback()
+
+    # Someone else logged part of this batch; fall back to one row at a time
+    logged = []
+    for row in rows:
+        db.session.add(SentReminder(product_id=row.product_id, payment_due_date=row.payment_due_date, sent_at=now))
+        try:
+            db.session.commit()
+            logged.append(row)
+        except IntegrityError:
+            db.session.rollback()
+    return logged
+
+
+def _unlog_reminders(keys):
+    """
+    Deletes the log rows of reminders that were not delivered, so the next run sends them again.
+
+    Args:
+        keys (list): (product_id, payment_due_date) pairs.
+    """
+    for product_id, payment_due_date in keys:
+        SentReminder.query.filter_by(product_id=product_id, payment_due_date=payment_due_date) \
+            .delete(synchronize_session=False)
+    db.session.commit()
+
+
+class _Deliveries:
+    """
+    Tracks the outcome of the reminders queued by one run, reported by the dispatcher's worker threads.
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = []
+        self._pending = 0
+        self._cond = threading.Condition()
+
+    def queued(self, key):
+        with self._cond:
+            self._pending += 1
+
+        def on_done(failure):
+            with self._cond:
+                self._pending -= 1
+                if failure is None:
+                    self.sent += 1
+                else:
+                    self.failed.append(key)
+                self._cond.notify_all()
+        return on_done
+
+    def wait(self):
+        """
+        Blocks until every queued reminder has been delivered or dead-lettered.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending == 0)
+
+
+def run_reminders(days=3, batch_size=1000, today=None):
+    """
+    Sends a payment-due SMS for every credit card due within the next days, once per due date.
+    Must run inside an application context.
+
+    Reminders are logged (claimed) before they are queued, so concurrent runs don't send them twice,
+    and queued with a blocking put, so a full queue slows the run down instead of dropping messages.
+    The run then waits for the dispatcher to deliver them and deletes the log rows of the ones that
+    could not be delivered, so the next run retries them.
+
+    Args:
+        days (int): Look-ahead window in days, today included.
+        batch_size (int): Products read and logged per batch.
+        today (date): Start of the window, defaults to the current date.
+
+    Returns:
+        dict: scanned, sent and failed counts, elapsed seconds and products scanned per second.
+    """
+    start = time.perf_counter()
+    scanned = 0
+    deliveries = _Deliveries()
+    for batch in iter_due_batches(days, batch_size, today):
+        scanned += len(batch)
+        for row in _log_reminders(batch):
+            key = (row.product_id, row.payment_due_date)
+            message = f"Dear customer, the outstanding of {format_amount(row.current_due)} on your CC {row.product_id} is due on {row.payment_due_date.strftime('%Y-%m-%d')}"
+            on_done = deliveries.queued(key)
+            if not enqueue_sms(row.contact_number, message, block=True, on_done=on_done):
+                # never queued (e.g. no contact number): release the claim right away
+                on_done('not queued')
+
+    deliveries.wait()
+    failed = deliveries.failed
+    if failed:
+        _unlog_reminders(failed)
+
+    seconds = time.perf_counter() - start
+    stats = {'scanned': scanned, 'sent': deliveries.sent, 'failed': len(failed), 'seconds': round(seconds, 3),
+             'per_second': round(scanned / seconds, 1) if seconds else 0.0}
+    logger.info('Payment reminders: %s', stats)
+    return stats
+
+
+def _reminder_loop(app, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            with app.app_context():
+                run_reminders(app.config['REMINDER_DAYS'], app.config['REMINDER_BATCH_SIZE'])
+        except Exception:
+            logger.exception('Payment reminder run failed')
+
+
+def init_app(app):
+    """
+    Registers the 'send-reminders' command and, if REMINDER_INTERVAL is positive, starts a background
+    thread running the reminders every REMINDER_INTERVAL seconds.
+    """
+    @app.cli.command('send-reminders')
+    @click.option('--days', default=None, type=int, help='Look-ahead window in days.')
+    @click.option('--batch-size', default=None, type=int, help='Products per batch.')
+    def send_reminders_command(days, batch_size):
+        """Send payment-due reminders for credit cards."""
+        stats = run_reminders(days or app.config['REMINDER_DAYS'], batch_size or app.config['REMINDER_BATCH_SIZE'])
+        click.echo(f"scanned {stats['scanned']}, sent {stats['sent']}, failed {stats['failed']} "
+                   f"in {stats['seconds']}s ({stats['per_second']} products/s)")
+
+    if app.config['REMINDER_INTERVAL'] > 0:
+        threading.Thread(target=_reminder_loop, args=(app, app.config['REMINDER_INTERVAL']),
+                         name='payment-reminders', daemon=True).start()
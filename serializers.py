@@ -0,0 +1,122 @@
+import json
+
+from . import db
+from .models import Transactions
+from .money import to_major
+
+try:
+    import orjson
+except ImportError:  # optional; the standard json module is used without it
+    orjson = None
+
+# Columns read for transaction listings, in the order of the rows returned by transaction_query
+TRANSACTION_COLUMNS = (Transactions.transaction_id, Transactions.amount_credit, Transactions.amount_debit,
+                       Transactions.transaction_date, Transactions.balance)
+TRANSACTION_FIELDS = tuple(column.key for column in TRANSACTION_COLUMNS)
+
+
+def dumps(obj):
+    """
+    Serializes obj to JSON bytes, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def transaction_query(model=Transactions):
+    """
+    Returns a query selecting only the listing columns of Transactions (or of TransactionsArchive,
+    which has the same columns), as plain rows instead of ORM objects.
+    """
+    return db.session.query(*(getattr(model, field) for field in TRANSACTION_FIELDS))
+
+
+def format_dates(values):
+    """
+    Formats dates or date-times as 'YYYY-MM-DD', formatting each distinct day only once.
+
+    Args:
+        values (iterable): date or datetime objects, or None.
+
+    Returns:
+        list: Formatted strings (None stays None).
+    """
+    formatted = {}
+    result = []
+    for value in values:
+        if value is None:
+            result.append(None)
+            continue
+        day = value.date() if hasattr(value, 'date') else value
+        text = formatted.get(day)
+        if text is None:
+            text = formatted[day] = day.isoformat()
+        result.append(text)
+    return result
+
+
+def format_datetimes(values):
+    """
+    Formats date-times as 'YYYY-MM-DD HH:MM:SS' using isoformat, much cheaper than strftime.
+    """
+    return [value.isoformat(' ', 'seconds') if value is not None else None for value in values]
+
+
+def transaction_dicts(rows, with_time=False):
+    """
+    Converts rows from transaction_query into dictionaries.
+
+    Args:
+        rows (list): Rows with the TRANSACTION_COLUMNS.
+        with_time (bool): Format transaction_date with the time of day, not just the date.
+
+    Returns:
+        list: One dictionary per row, amounts in rupees.
+    """
+    dates = (format_datetimes if with_time else format_dates)([row.transaction_date for row in rows])
+    return [{'transaction_id': row.transaction_id, 'amount_credit': to_major(row.amount_credit),
+             'amount_debit': to_major(row.amount_debit), 'transaction_date': date, 'balance': to_major(row.balance)}
+            for row, date in zip(rows, dates)]
+
+
+def product_dicts(products):
+    """
+    Converts products (ORM objects or cache.ProductSummary tuples) into dictionaries, amounts in rupees.
+    """
+    openings = format_dates([product.date_of_opening for product in products])
+    due_dates = format_dates([product.payment_due_date for product in products])
+    return [{'product_id': product.product_id, 'product_type': product.product_type, 'date_of_opening': opening,
+             'current_balance': to_major(product.current_balance), 'current_due': to_major(product.current_due),
+             'payment_due_date': due_date}
+            for product, opening, due_date in zip(products, openings, due_dates)]
+
+
+def stream_json_object(array_key, items, chunk_size=500, **fields):
+    """
+    Generates a JSON object holding a large array piece by piece, for use as a streamed response body.
+
+    Args:
+        array_key (str): Key of the array.
+        items (iterable): Array items (JSON-serializable).
+        chunk_size (int): Items serialized per yielded piece.
+        **fields: Other keys of the object, written after the array.
+
+    Yields:
+        bytes: Consecutive pieces of the JSON document.
+    """
+    yield b'{' + dumps(array_key) + b':['
+    first = True
+    chunk = []
+    for item in items:
+        chunk.append(dumps(item))
+        if len(chunk) == chunk_size:
+            yield (b'' if first else b',') + b','.join(chunk)
+            first = False
+            chunk = []
+    if chunk:
+        yield (b'' if first else b',') + b','.join(chunk)
+    yield b']'
+    for key, value in fields.items():
+        yield b',' + dumps(key) + b':' + dumps(value)
+    yield b'}'
@@ -0,0 +1,156 @@
+"""
+Startup benchmark for the banking app.
+
+Starts fresh Python processes that import the package and call create_app(), and reports the
+import time and the create_app() wall time over several runs. One more run with -X importtime
+lists the modules that take longest to import, and every run checks that the heavy integrations
+(boto3, reportlab, plivo, requests, numpy) were not loaded at startup.
+
+The app is created with SMS_BACKEND=fake, STATEMENT_STORAGE=local and a temporary SQLite
+database, like the load test, so nothing leaves the machine.
+
+Run from the directory containing the package:
+
+    python -m plivo_hackathon.startup_bench --runs 10
+    python -m plivo_hackathon.startup_bench --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PACKAGE = __package__ or 'plivo_hackathon'
+
+# Modules that should only be imported when they are used
+HEAVY_MODULES = ('boto3', 'botocore', 'reportlab', 'plivo', 'requests', 'numpy')
+
+# Run in each child process; prints one JSON line with its measurements
+_CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import {package}
+imported = time.perf_counter()
+app = {package}.create_app({config!r})
+created = time.perf_counter()
+print(json.dumps({{'import_ms': (imported - start) * 1000, 'create_app_ms': (created - imported) * 1000,
+                  'heavy_loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def _child_env():
+    env = dict(os.environ)
+    parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [parent, env.get('PYTHONPATH')]))
+    return env
+
+
+def measure_once(config, importtime=False):
+    """
+    Imports the package and creates the app in a new interpreter.
+
+    Args:
+        config (dict): test_config passed to create_app.
+        importtime (bool): Run the child with -X importtime and return its per-module timings too.
+
+    Returns:
+        tuple: (measurements dict, list of (cumulative_us, self_us, module) tuples or None).
+    """
+    code = _CHILD.format(package=PACKAGE, config=config, heavy=HEAVY_MODULES)
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    completed = subprocess.run(command, capture_output=True, text=True, env=_child_env(), check=True)
+    measurements = json.loads(completed.stdout.strip().splitlines()[-1])
+    return measurements, parse_importtime(completed.stderr) if importtime else None
+
+
+def parse_importtime(output):
+    """
+    Parses the stderr of python -X importtime.
+
+    Returns:
+        list: (cumulative_us, self_us, module) tuples, slowest first; module names of nested
+            imports keep their indentation.
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        # nested imports keep their extra indentation after the separator's space
+        modules.append((int(cumulative_us), int(self_us), name[1:].rstrip()))
+    modules.sort(reverse=True)
+    return modules
+
+
+def _summary(values):
+    return {'mean': round(statistics.mean(values), 1), 'median': round(statistics.median(values), 1),
+            'min': round(min(values), 1), 'max': round(max(values), 1)}
+
+
+def run(runs, top=15):
+    """
+    Measures the startup of runs fresh processes, plus one with -X importtime.
+
+    Returns:
+        dict: import_ms and create_app_ms summaries, the slowest imports, the heavy
+            modules seen loaded and the raw measurements.
+    """
+    workdir = tempfile.mkdtemp(prefix='startup-')
+    config = {'SMS_BACKEND': 'fake', 'STATEMENT_STORAGE': 'local', 'STATEMENT_LOCAL_DIR': os.path.join(workdir, 'statements'),
+              'SECRET_KEY': 'startup', 'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'startup.db')}
+
+    samples = [measure_once(config)[0] for _ in range(runs)]
+    profiled, modules = measure_once(config, importtime=True)
+    heavy = sorted({name for sample in samples + [profiled] for name in sample['heavy_loaded']})
+    # modules imported at the top level and directly by those (e.g. flask_sqlalchemy under the package)
+    top_level = [(cumulative, name.strip()) for cumulative, _, name in modules if not name.startswith('   ')]
+    return {
+        'runs': runs,
+        'import_ms': _summary([sample['import_ms'] for sample in samples]),
+        'create_app_ms': _summary([sample['create_app_ms'] for sample in samples]),
+        'slowest_imports': [{'module': name, 'cumulative_ms': round(cumulative / 1000, 1)}
+                            for cumulative, name in top_level[:top]],
+        'heavy_loaded': heavy,
+        'samples': samples,
+    }
+
+
+def format_report(result):
+    """
+    Formats a benchmark result as text.
+    """
+    lines = [f"{result['runs']} runs",
+             f"{'':<12} {'mean':>8} {'median':>8} {'min':>8} {'max':>8}  (ms)"]
+    for key in ('import_ms', 'create_app_ms'):
+        stats = result[key]
+        lines.append(f"{key[:-3]:<12} {stats['mean']:>8} {stats['median']:>8} {stats['min']:>8} {stats['max']:>8}")
+    lines.append("\nslowest imports (cumulative, -X importtime)")
+    for entry in result['slowest_imports']:
+        lines.append(f"  {entry['cumulative_ms']:>8} ms  {entry['module']}")
+    if result['heavy_loaded']:
+        lines.append(f"\nWARNING: loaded at startup: {', '.join(result['heavy_loaded'])}")
+    else:
+        lines.append(f"\nnot loaded at startup: {', '.join(HEAVY_MODULES)}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--runs', type=int, default=5, help='Fresh processes to measure.')
+    parser.add_argument('--top', type=int, default=15, help='Slowest imports to list.')
+    parser.add_argument('--json', dest='json_path', help='Also write the results to this JSON file.')
+    args = parser.parse_args(argv)
+
+    result = run(args.runs, args.top)
+    print(format_report(result))
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(result, f, indent=2)
+    # a non-zero status lets CI fail when a heavy dependency creeps back into startup
+    return 1 if result['heavy_loaded'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
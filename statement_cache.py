@@ -0,0 +1,139 @@
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import and_, or_
+
+from . import db
+from .models import StatementCacheEntry
+from .history import iter_newest
+from .statements import TEMPLATE_VERSION
+from .storage import statement_url, delete_statement
+
+logger = logging.getLogger(__name__)
+
+# Entries used this recently are never evicted: the links sent for them (presigned URLs are valid
+# for an hour by default) must keep working
+LINK_LIFETIME = 3600
+
+
+def cache_key(product_id, transaction_count, user):
+    """
+    Builds the content address of a statement: a hash of everything its PDF depends on.
+
+    The product's latest transaction stands for its whole history (transactions are only ever
+    appended), and the owner's name and date of birth are included because they are printed in and
+    encrypt the PDF.
+
+    Args:
+        product_id (str): Product of the statement.
+        transaction_count (int): Number of latest transactions in the statement.
+        user (User): Owner of the product.
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    latest = next(iter_newest(product_id, 1), None)
+    parts = [product_id, str(transaction_count), str(TEMPLATE_VERSION), user.name or '', user.dob or '']
+    if latest is not None:
+        parts += [latest.transaction_id, latest.transaction_date.isoformat()]
+    return hashlib.sha256('\x1f'.join(parts).encode()).hexdigest()
+
+
+def object_key(key):
+    return f"statement-{key}.pdf"
+
+
+def lookup(key):
+    """
+    Returns a fresh download URL for a cached statement and records the hit.
+
+    Args:
+        key (str): Key built by cache_key.
+
+    Returns:
+        str: URL, or None on a miss (no entry, expired entry or stored PDF no longer there).
+    """
+    entry = db.session.get(StatementCacheEntry, key)
+    if entry is None or entry.created_at < _expiry_cutoff():
+        return None
+    url = statement_url(entry.object_key)
+    if url is None:
+        db.session.delete(entry)
+        db.session.commit()
+        return None
+    entry.last_used_at = datetime.now()
+    entry.hits += 1
+    db.session.commit()
+    return url
+
+
+def store(key, product_id):
+    """
+    Records a statement stored under object_key(key), replacing any older entry, and evicts old
+    entries beyond the configured limits.
+    """
+    now = datetime.now()
+    db.session.merge(StatementCacheEntry(cache_key=key, product_id=product_id, object_key=object_key(key),
+                                         created_at=now, last_used_at=now, hits=0))
+    db.session.commit()
+    evict()
+
+
+def _expiry_cutoff():
+    return datetime.now() - timedelta(seconds=current_app.config['STATEMENT_CACHE_TTL'])
+
+
+def evict(max_entries=None, ttl_cutoff=None):
+    """
+    Deletes expired entries and the least recently used ones beyond STATEMENT_CACHE_SIZE, together
+    with their stored PDFs. Entries used within the last LINK_LIFETIME seconds are kept.
+
+    Args:
+        max_entries (int): Entries to keep, defaults to STATEMENT_CACHE_SIZE.
+        ttl_cutoff (datetime): Entries created before this are expired, defaults to STATEMENT_CACHE_TTL ago.
+
+    Returns:
+        int: Number of entries evicted.
+    """
+    max_entries = current_app.config['STATEMENT_CACHE_SIZE'] if max_entries is None else max_entries
+    ttl_cutoff = _expiry_cutoff() if ttl_cutoff is None else ttl_cutoff
+
+    # Most recently used entry beyond the limit; it and everything used before it (or expired) goes
+    first_evicted = db.session.query(StatementCacheEntry.last_used_at, StatementCacheEntry.cache_key) \
+        .order_by(StatementCacheEntry.last_used_at.desc(), StatementCacheEntry.cache_key.desc()) \
+        .offset(max_entries).limit(1).first()
+    condition = StatementCacheEntry.created_at < ttl_cutoff
+    if first_evicted is not None:
+        used_at, key = first_evicted
+        condition = or_(condition, StatementCacheEntry.last_used_at < used_at,
+                        and_(StatementCacheEntry.last_used_at == used_at, StatementCacheEntry.cache_key <= key))
+    condition = and_(condition, StatementCacheEntry.last_used_at < datetime.now() - timedelta(seconds=LINK_LIFETIME))
+
+    entries = db.session.query(StatementCacheEntry.cache_key, StatementCacheEntry.object_key).filter(condition).all()
+    evicted = 0
+    for key, stored_key in entries:
+        try:
+            delete_statement(stored_key)
+        except Exception:
+            # keep the entry so the deletion is retried by a later eviction
+            logger.exception('Deleting cached statement %s failed', stored_key)
+            continue
+        StatementCacheEntry.query.filter_by(cache_key=key).delete(synchronize_session=False)
+        evicted += 1
+    db.session.commit()
+    return evicted
+
+
+def init_app(app):
+    """
+    Registers the 'evict-statements' command.
+    """
+    @app.cli.command('evict-statements')
+    @click.option('--all', 'evict_all', is_flag=True, help='Evict every cached statement not used in the last hour.')
+    def evict_statements_command(evict_all):
+        """Delete expired and least recently used cached statements."""
+        count = evict(max_entries=0) if evict_all else evict()
+        click.echo(f"{count} cached statements evicted")
@@ -0,0 +1,176 @@
+import functools
+import tempfile
+
+from .history import iter_newest
+from .money import format_amount
+
+# reportlab is imported by the functions that render, on first use: most processes never build a
+# PDF, and importing it would add to every worker's startup time.
+
+# Version of the statement layout; bump it when the PDF changes so cached statements are rendered again
+TEMPLATE_VERSION = 3
+
+# Header row for the table
+COL_HEADERS = ["Transaction ID", "Amount Credit", "Amount Debit", "Transaction Date", "Balance"]
+# Fixed column widths (points) for an A3 page with the default margins, so tables skip auto-sizing
+COL_WIDTHS = [250, 100, 100, 150, 98]
+# Padding reportlab's default Frame leaves inside its edges (points)
+FRAME_PADDING = 6
+
+
+@functools.lru_cache(maxsize=None)
+def table_style(header=True):
+    """
+    Returns the style of statement tables, built once: with header=True row 0 is styled as the
+    column header, otherwise every row is a transaction row.
+    """
+    from reportlab.lib import colors
+    from reportlab.platypus import TableStyle
+
+    if not header:
+        return TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('BACKGROUND', (0, 0), (-1, -1), colors.beige),
+        ])
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ])
+
+
+@functools.lru_cache(maxsize=None)
+def _doc_template_class():
+    """
+    Returns the statement's document template class, defined on first use since it subclasses a
+    reportlab class.
+    """
+    from reportlab.platypus import SimpleDocTemplate
+
+    class StatementDocTemplate(SimpleDocTemplate):
+        """
+        SimpleDocTemplate that pulls its flowables from an iterator while it builds, so only a couple
+        of table chunks exist at any time instead of the whole statement.
+
+        The pending list is topped up from filterFlowables, the hook reportlab documents for
+        inspecting and modifying the flowables about to be processed, which it calls before handling
+        each one (and for its own internal lists, which are left alone).
+        """
+
+        def build_from(self, flowables, **kwargs):
+            """
+            Builds the document from an iterable of flowables; kwargs are passed to build().
+            """
+            self._source = iter(flowables)
+            self._pending = []
+            self.filterFlowables(self._pending)
+            self.build(self._pending, **kwargs)
+
+        def filterFlowables(self, flowables):
+            if flowables is not self._pending:
+                return
+            # keep a look-ahead of two flowables for reportlab's keepWithNext handling
+            while self._source is not None and len(flowables) < 2:
+                try:
+                    flowables.append(next(self._source))
+                except StopIteration:
+                    self._source = None
+
+    return StatementDocTemplate
+
+
+def iter_transaction_rows(product_id, transaction_count, chunk_size):
+    """
+    Streams a product's latest transactions, newest first, from server-side cursors over the hot and
+    archive tables.
+
+    Args:
+        product_id (str): Product whose transactions are read.
+        transaction_count (int): Maximum number of transactions.
+        chunk_size (int): Number of rows fetched from the database at a time.
+
+    Yields:
+        list: Table row (list of strings) for each transaction.
+    """
+    rows = iter_newest(product_id, transaction_count, chunk_size=chunk_size)
+    for transaction_id, amount_credit, amount_debit, transaction_date, balance in rows:
+        yield [transaction_id, format_amount(amount_credit), format_amount(amount_debit),
+               transaction_date.isoformat(' ', 'seconds'), format_amount(balance)]
+
+
+def _statement_flowables(heading_text, rows, chunk_size):
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import Paragraph
+
+    yield Paragraph(heading_text, getSampleStyleSheet()["Heading1"])
+    chunk = []
+    header = True
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield _table(chunk, header)
+            chunk = []
+            header = False
+    if chunk or header:
+        yield _table(chunk, header)
+
+
+def _table(rows, header):
+    from reportlab.platypus import Table
+
+    # Only the first chunk carries the header row; pages after the first get theirs from
+    # _draw_page_header, so chunk boundaries don't put a header in the middle of a page
+    table = Table([COL_HEADERS] + rows if header else rows, colWidths=COL_WIDTHS, splitByRow=1)
+    table.setStyle(table_style(header))
+    return table
+
+
+def _draw_page_header(canvas, doc):
+    """
+    onLaterPages callback drawing the column header just above the frame, aligned with the tables
+    (which the frame centers inside its padding).
+    """
+    header = _table([], True)
+    width, _ = header.wrapOn(canvas, doc.width, doc.topMargin)
+    canvas.saveState()
+    header.drawOn(canvas, doc.leftMargin + (doc.width - width) / 2, doc.bottomMargin + doc.height - FRAME_PADDING)
+    canvas.restoreState()
+
+
+def render_statement(product_id, transaction_count, dob, user_name, product_type, chunk_size=500, spool_size=8 * 1024 * 1024):
+    """
+    Renders an encrypted PDF statement of a product's latest transactions into a spooled buffer.
+
+    Transactions are pulled from the database and laid out chunk_size rows at a time, so memory use
+    doesn't grow with the number of transactions.
+
+    Args:
+        product_id (str): Product of the statement.
+        transaction_count (int): Number of latest transactions to include.
+        dob (str): User date of birth, used as the PDF password.
+        user_name (str): Name printed in the heading.
+        product_type (str): Product type printed in the heading.
+        chunk_size (int): Rows fetched and laid out per table.
+        spool_size (int): Size in bytes above which the buffer moves from memory to a temporary file.
+
+    Returns:
+        tempfile.SpooledTemporaryFile: The PDF, positioned at the start. The caller closes it.
+    """
+    from reportlab.lib import pdfencrypt
+    from reportlab.lib.pagesizes import A3
+
+    buffer = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    doc = _doc_template_class()(buffer, pagesize=A3, encrypt=pdfencrypt.StandardEncryption(
+        dob, canPrint=1))  # Keep DOB as password for PDF
+    heading_text = "Statement for: "+user_name+f" for the {product_type} "+product_id
+    rows = iter_transaction_rows(product_id, transaction_count, chunk_size)
+    try:
+        doc.build_from(_statement_flowables(heading_text, rows, chunk_size), onLaterPages=_draw_page_header)
+    except Exception:
+        buffer.close()
+        raise
+    buffer.seek(0)
+    return buffer
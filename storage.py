@@ -0,0 +1,214 @@
+import base64
+import hashlib
+import os
+import shutil
+import threading
+
+from flask import current_app
+
+from .metrics import timed
+
+# boto3/botocore are imported where S3 is used: loading them takes longer than the rest of the
+# application, and local storage never needs them.
+
+# Uploads at least this large use multipart upload, in parts of S3_PART_SIZE bytes (S3 minimum is 5 MB)
+S3_PART_SIZE = int(os.environ.get('S3_PART_SIZE', 8 * 1024 * 1024))
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Returns the process-wide S3 client, creating it on first use.
+
+    boto3 clients are thread-safe, so one client (and its connection pool) is shared by all threads;
+    only its creation needs the lock.
+
+    Returns:
+        botocore.client.S3: S3 client.
+    """
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                import boto3
+                from botocore.config import Config
+
+                _s3_client = boto3.session.Session().client(
+                    's3',
+                    region_name=os.environ.get('AWS_REGION'),
+                    aws_access_key_id=os.environ.get('AWS_ACCESS_ID'),
+                    aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
+                    config=Config(max_pool_connections=int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 20)))
+                )
+    return _s3_client
+
+
+def _etag_matches(response, digest):
+    # Single-part ETags are the hex MD5 of the content, wrapped in quotes
+    return response['ETag'].strip('"') == digest.hexdigest()
+
+
+def _put_single(client, bucket, key, data):
+    digest = hashlib.md5(data)
+    response = client.put_object(Bucket=bucket, Key=key, Body=data,
+                                 ContentMD5=base64.b64encode(digest.digest()).decode())
+    return _etag_matches(response, digest)
+
+
+def _put_multipart(client, bucket, key, first_part, fileobj):
+    from botocore.exceptions import ClientError
+
+    upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+    try:
+        parts = []
+        data = first_part
+        while data:
+            digest = hashlib.md5(data)
+            response = client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1,
+                                          Body=data, ContentMD5=base64.b64encode(digest.digest()).decode())
+            if not _etag_matches(response, digest):
+                raise ClientError({'Error': {'Code': 'BadDigest', 'Message': 'Part ETag mismatch'}}, 'UploadPart')
+            parts.append({'PartNumber': len(parts) + 1, 'ETag': response['ETag']})
+            data = fileobj.read(S3_PART_SIZE)
+        client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                         MultipartUpload={'Parts': parts})
+    except Exception:
+        client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    return True
+
+
+def presign_s3(awsfilepath):
+    """
+    Returns a presigned download URL for an object of the S3 bucket. Signing is done locally,
+    without a request to S3.
+    """
+    # Generate the URL to get 'key-name' from 'bucket-name'
+    return get_s3_client().generate_presigned_url(
+        ClientMethod='get_object',
+        Params={
+            'Bucket': os.environ.get('S3_BUCKET'),
+            'Key': awsfilepath
+        }
+    )
+
+
+def upload_to_s3(awsfilepath, fileobj):
+    """
+    Uploads a file to an Amazon S3 bucket and returns a presigned download URL.
+
+    The content is sent straight from the file object: files smaller than S3_PART_SIZE in a single
+    PUT, larger ones as a multipart upload. S3 verifies every request against its Content-MD5, and the
+    returned ETags are compared with the local MD5s, so no extra HEAD request is needed.
+
+    Args:
+        awsfilepath (str): Path for the file in the S3 bucket.
+        fileobj (file): Binary file object with the content to upload.
+
+    Returns:
+        tuple: URL of the uploaded file or an error message, and a success flag.
+    """
+    from botocore.exceptions import NoCredentialsError, ClientError
+
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+
+    try:
+        s3_client = get_s3_client()
+        data = fileobj.read(S3_PART_SIZE)
+        if len(data) < S3_PART_SIZE:
+            with timed('s3', 'put_object'):
+                uploaded = _put_single(s3_client, S3_BUCKET, awsfilepath, data)
+        else:
+            with timed('s3', 'multipart_upload'):
+                uploaded = _put_multipart(s3_client, S3_BUCKET, awsfilepath, data, fileobj)
+        if not uploaded:
+            return "Uploaded file does not match. Upload failed.", False
+
+        return presign_s3(awsfilepath), True
+    except NoCredentialsError:
+        return "No AWS credentials were found", False
+    except ClientError as e:
+        return f"Upload failed: {e}", False
+
+
+def upload_to_local(key, fileobj, directory):
+    """
+    Stores a file in a local directory; stand-in for S3 in tests and local runs.
+
+    Args:
+        key (str): File name inside the directory.
+        fileobj (file): Binary file object with the content to store.
+        directory (str): Directory to store the file in, created if missing.
+
+    Returns:
+        str: file:// URL of the stored file and a success flag.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.abspath(os.path.join(directory, key))
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(fileobj, f)
+    return 'file://' + path, True
+
+
+def upload_statement(key, fileobj):
+    """
+    Uploads a statement PDF to the backend selected by STATEMENT_STORAGE ('s3' or 'local').
+
+    Args:
+        key (str): Object key / file name.
+        fileobj (file): Binary file object with the PDF.
+
+    Returns:
+        tuple: URL to download the statement (or an error message) and a success flag.
+    """
+    if current_app.config['STATEMENT_STORAGE'] == 'local':
+        return upload_to_local(key, fileobj, current_app.config['STATEMENT_LOCAL_DIR'])
+    return upload_to_s3(key, fileobj)
+
+
+def statement_url(key):
+    """
+    Returns a fresh download URL for a statement stored earlier by upload_statement.
+
+    S3 objects are checked with a HEAD request first, since presigning alone would happily sign a
+    link to an object that a bucket lifecycle rule has already removed.
+
+    Args:
+        key (str): Object key / file name.
+
+    Returns:
+        str: URL, or None if the statement no longer exists.
+    """
+    if current_app.config['STATEMENT_STORAGE'] == 'local':
+        path = os.path.abspath(os.path.join(current_app.config['STATEMENT_LOCAL_DIR'], key))
+        return 'file://' + path if os.path.exists(path) else None
+
+    from botocore.exceptions import ClientError
+
+    try:
+        with timed('s3', 'head_object'):
+            get_s3_client().head_object(Bucket=os.environ.get('S3_BUCKET'), Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    return presign_s3(key)
+
+
+def delete_statement(key):
+    """
+    Deletes a statement stored by upload_statement; missing statements are ignored.
+
+    Args:
+        key (str): Object key / file name.
+    """
+    if current_app.config['STATEMENT_STORAGE'] == 'local':
+        try:
+            os.remove(os.path.join(current_app.config['STATEMENT_LOCAL_DIR'], key))
+        except FileNotFoundError:
+            pass
+        return
+    with timed('s3', 'delete_object'):
+        get_s3_client().delete_object(Bucket=os.environ.get('S3_BUCKET'), Key=key)
@@ -0,0 +1,84 @@
+from datetime import date
+
+import pytest
+
+from .. import create_app, db, database
+from ..models import User, Product
+from ..plivo_utils import FakeClient
+
+
+@pytest.fixture
+def sms():
+    """
+    FakeClient the app's SMS dispatcher sends through.
+    """
+    return FakeClient()
+
+
+@pytest.fixture
+def make_app(tmp_path, sms):
+    """
+    Returns a function creating an app on a SQLite database file in tmp_path (default test.db),
+    running statement jobs in-process and without the background reminder, outbox and inbound threads.
+    """
+    def make_app(database_path=None):
+        return create_app({
+            'TESTING': True,
+            'SECRET_KEY': 'test',
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(database_path or tmp_path / 'test.db'),
+            'SMS_CLIENT_FACTORY': lambda: sms,
+            'STATEMENT_WORKERS': 0,
+            'STATEMENT_STORAGE': 'local',
+            'STATEMENT_LOCAL_DIR': str(tmp_path / 'statements'),
+            'INBOUND_WORKERS': 0,
+            'REMINDER_INTERVAL': 0,
+            'OUTBOX_SINK': None,
+            'METRICS_ENABLED': False,
+        })
+    return make_app
+
+
+@pytest.fixture
+def app(make_app):
+    """
+    App on a fresh database with the schema applied, inside an application context.
+    """
+    app = make_app()
+    with app.app_context():
+        database.migrate()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def accounts(app):
+    """
+    A user with a savings account SB1 holding Rs. 1000.00 and a credit card CC1 with Rs. 500.00 due.
+
+    Returns:
+        int: Id of the user.
+    """
+    user = User(email='user@example.com', name='Test User', password='x', contact_number='+911234567890',
+                dob='2000-01-01')
+    db.session.add(user)
+    db.session.commit()
+    db.session.add_all([
+        Product(product_id='SB1', user_id=user.id, product_type='SB', date_of_opening=date.today(),
+                current_balance=100000, current_due=0),
+        Product(product_id='CC1', user_id=user.id, product_type='CC', date_of_opening=date.today(),
+                current_balance=0, current_due=50000, payment_due_date=date.today()),
+    ])
+    db.session.commit()
+    return user.id
+
+
+@pytest.fixture
+def client(app, accounts):
+    """
+    Test client logged in as the accounts user.
+    """
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(accounts)
+        session['_fresh'] = True
+    return client
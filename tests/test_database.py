@@ -0,0 +1,117 @@
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import inspect
+from sqlalchemy.dialects import mysql, postgresql
+
+from .. import db, database
+from ..balances import balance_as_of
+from ..models import Product, Transactions, BalanceSnapshot, SchemaMigration
+
+# Tables as created before snapshots, versions and amounts in paise existed: rupee amounts in
+# INTEGER/FLOAT columns and a 100-character password column
+LEGACY_SCHEMA = """
+CREATE TABLE user (id INTEGER PRIMARY KEY, email VARCHAR(100) UNIQUE, password VARCHAR(100),
+                   name VARCHAR(1000), contact_number VARCHAR(20), dob VARCHAR(10) NOT NULL);
+CREATE TABLE product (product_id VARCHAR(6) PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES user(id),
+                      product_type VARCHAR(50) NOT NULL, date_of_opening DATE NOT NULL, current_balance INTEGER,
+                      current_due INTEGER, payment_due_date DATE);
+CREATE TABLE transactions (transaction_id VARCHAR PRIMARY KEY, product_id VARCHAR(6) NOT NULL REFERENCES product(product_id),
+                           amount_credit FLOAT NOT NULL, amount_debit FLOAT NOT NULL, transaction_date DATETIME NOT NULL,
+                           balance INTEGER NOT NULL);
+INSERT INTO user VALUES (1, 'old@example.com', 'x', 'Old User', '+911234567890', '1990-01-01');
+INSERT INTO product VALUES ('SB1', 1, 'SB', '2023-01-01', 1010, 0, NULL);
+INSERT INTO transactions VALUES ('t1', 'SB1', 1000.5, 0, '2023-01-02 10:00:00.000000', 1000);
+INSERT INTO transactions VALUES ('t2', 'SB1', 9.5, 0, '2023-01-05 10:00:00.000000', 1010);
+"""
+
+
+def _applied():
+    return {name for name, in db.session.query(SchemaMigration.name)}
+
+
+def test_fresh_database_records_every_data_migration(app):
+    assert _applied() == {name for name, _ in database.DATA_MIGRATIONS}
+    assert BalanceSnapshot.query.count() == 0
+    # running it again changes nothing
+    database.migrate()
+    assert SchemaMigration.query.count() == len(database.DATA_MIGRATIONS)
+
+
+def test_legacy_database_is_upgraded(tmp_path, make_app):
+    path = tmp_path / 'legacy.db'
+    with sqlite3.connect(path) as connection:
+        connection.executescript(LEGACY_SCHEMA)
+
+    app = make_app(path)
+    with app.app_context():
+        database.migrate()
+
+        assert _applied() == {name for name, _ in database.DATA_MIGRATIONS}
+        columns = {column['name'] for column in inspect(db.engine).get_columns('product')}
+        assert 'version' in columns
+
+        # rupee amounts converted to whole paise
+        product = db.session.get(Product, 'SB1')
+        assert product.current_balance == 101000
+        assert [(t.amount_credit, t.balance) for t in Transactions.query.order_by(Transactions.transaction_date)] \
+            == [(100050, 100000), (950, 101000)]
+
+        # snapshots backfilled for the existing history
+        snapshots = BalanceSnapshot.query.order_by(BalanceSnapshot.snapshot_date).all()
+        assert [(s.snapshot_date.isoformat(), s.closing_balance) for s in snapshots] \
+            == [('2023-01-02', 100000), ('2023-01-05', 101000)]
+        assert balance_as_of('SB1', datetime(2023, 1, 3).date()) == 100000
+
+        # a second run doesn't convert or backfill again
+        database.migrate()
+        assert db.session.get(Product, 'SB1').current_balance == 101000
+        assert BalanceSnapshot.query.count() == 2
+        db.session.remove()
+
+
+def test_add_missing_columns_keeps_existing_data(tmp_path, make_app):
+    path = tmp_path / 'legacy.db'
+    with sqlite3.connect(path) as connection:
+        connection.executescript(LEGACY_SCHEMA)
+
+    app = make_app(path)
+    with app.app_context():
+        database.migrate()
+        assert db.session.get(Product, 'SB1').version == 0
+        assert {index['name'] for index in inspect(db.engine).get_indexes('transactions')} \
+            >= {'ix_transactions_product_date'}
+        db.session.remove()
+
+
+class _RecordingEngine:
+    """
+    Stands in for db.engine on another database, recording the statements run through begin().
+    """
+
+    def __init__(self, dialect):
+        self.dialect = dialect
+        self.statements = []
+
+    @contextmanager
+    def begin(self):
+        yield self
+
+    def execute(self, statement):
+        self.statements.append(str(statement))
+
+
+def test_password_column_is_widened_on_server_databases(app, monkeypatch):
+    engine = _RecordingEngine(postgresql.dialect())
+    monkeypatch.setattr(type(db), 'engine', property(lambda self: engine))
+    database._widen_password_column({'user'})
+    assert engine.statements == ['ALTER TABLE "user" ALTER COLUMN password TYPE VARCHAR(200)']
+
+    engine = _RecordingEngine(mysql.dialect())
+    database._widen_password_column({'user'})
+    assert engine.statements == ['ALTER TABLE user MODIFY password VARCHAR(200)']
+
+    # new databases already have the wide column
+    database._widen_password_column(set())
+    assert engine.statements == ['ALTER TABLE user MODIFY password VARCHAR(200)']
@@ -0,0 +1,104 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from .. import db, ledger
+from ..idempotency import HEADER, MAX_KEY_LENGTH
+from ..models import IdempotencyRecord, Transactions
+
+BODY = {'product_id': 'SB1', 'amount_credit': 10}
+
+
+def _post(client, key, body=BODY):
+    return client.post('/add_transaction', data=json.dumps(body), content_type='application/json',
+                       headers={HEADER: key})
+
+
+def _claim(accounts, key, age):
+    # an in-progress record as left by a request that is still running, or that died
+    request_hash = hashlib.sha256(json.dumps(BODY).encode()).hexdigest()
+    db.session.add(IdempotencyRecord(scope=f'main.add_transaction|{accounts}', key=key, request_hash=request_hash,
+                                     created_at=datetime.now() - timedelta(seconds=age)))
+    db.session.commit()
+
+
+def test_retry_replays_the_stored_response(client):
+    first = _post(client, 'k1')
+    retry = _post(client, 'k1')
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.get_json() == first.get_json()
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert Transactions.query.count() == 1
+
+
+def test_key_reused_with_another_body(client):
+    _post(client, 'k1')
+    response = _post(client, 'k1', {'product_id': 'SB1', 'amount_credit': 20})
+    assert response.status_code == 422
+    assert Transactions.query.count() == 1
+
+
+def test_requests_without_key_or_with_long_key(client):
+    assert client.post('/add_transaction', json=BODY).status_code == 201
+    assert client.post('/add_transaction', json=BODY).status_code == 201
+    assert _post(client, 'x' * (MAX_KEY_LENGTH + 1)).status_code == 400
+    assert Transactions.query.count() == 2
+
+
+def test_request_in_progress_gets_conflict(client, accounts):
+    _claim(accounts, 'k1', age=1)
+    assert _post(client, 'k1').status_code == 409
+    assert Transactions.query.count() == 0
+
+
+def test_abandoned_claim_is_taken_over(app, client, accounts):
+    _claim(accounts, 'k1', age=app.config['IDEMPOTENCY_LEASE'] + 1)
+
+    response = _post(client, 'k1')
+    assert response.status_code == 201
+    assert 'Idempotent-Replayed' not in response.headers
+    assert _post(client, 'k1').headers['Idempotent-Replayed'] == 'true'
+    assert Transactions.query.count() == 1
+
+
+def test_expired_record_is_claimed_again(app, client, accounts):
+    _post(client, 'k1')
+    IdempotencyRecord.query.update({'created_at': datetime.now() - timedelta(seconds=app.config['IDEMPOTENCY_TTL'] + 1)})
+    db.session.commit()
+
+    response = _post(client, 'k1')
+    assert response.status_code == 201
+    assert 'Idempotent-Replayed' not in response.headers
+    assert Transactions.query.count() == 2
+
+
+def test_lost_concurrent_update_is_not_stored(client, monkeypatch):
+    apply_posting = ledger.apply_posting
+    calls = []
+
+    def lose_once(*args, **kwargs):
+        if not calls:
+            calls.append(1)
+            raise ledger.ConcurrentUpdate("Product was updated concurrently, please retry.")
+        return apply_posting(*args, **kwargs)
+
+    monkeypatch.setattr(ledger, 'apply_posting', lose_once)
+    assert _post(client, 'k1').status_code == 409
+    retry = _post(client, 'k1')
+    assert retry.status_code == 201
+    assert 'Idempotent-Replayed' not in retry.headers
+    assert Transactions.query.count() == 1
+
+
+def test_server_error_is_not_stored(app, client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("database went away")
+
+    # answer with a 500 instead of raising into the test
+    monkeypatch.setitem(app.config, 'PROPAGATE_EXCEPTIONS', False)
+    with monkeypatch.context() as patch:
+        patch.setattr(ledger, 'apply_posting', fail)
+        assert _post(client, 'k1').status_code == 500
+    assert IdempotencyRecord.query.count() == 0
+    assert _post(client, 'k1').status_code == 201
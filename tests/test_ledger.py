@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+
+from .. import db
+from ..ledger import (post_transaction, transfer, post_transactions_bulk, InvalidTransaction, ProductNotFound,
+                      InsufficientFunds)
+from ..models import Product, Transactions, BalanceSnapshot, OutboxEvent
+
+
+def _balances():
+    db.session.expire_all()
+    return db.session.get(Product, 'SB1').current_balance, db.session.get(Product, 'CC1').current_due
+
+
+def test_post_transaction_updates_balance_snapshot_and_outbox(accounts):
+    credit = post_transaction('SB1', amount_credit=2550)
+    debit = post_transaction('CC1', amount_debit=1000)
+    db.session.commit()
+
+    assert (credit.balance, debit.balance) == (102550, 51000)
+    assert _balances() == (102550, 51000)
+    assert Transactions.query.count() == 2
+    assert OutboxEvent.query.count() == 2
+    snapshot = BalanceSnapshot.query.filter_by(product_id='SB1').one()
+    assert (snapshot.closing_balance, snapshot.total_credit, snapshot.transaction_count) == (102550, 2550, 1)
+
+
+@pytest.mark.parametrize('amount_credit, amount_debit', [(0, 0), (100, 100), (-100, 0), (0, 1.5)])
+def test_post_transaction_rejects_invalid_amounts(accounts, amount_credit, amount_debit):
+    with pytest.raises(InvalidTransaction):
+        post_transaction('SB1', amount_credit, amount_debit)
+
+
+def test_post_transaction_unknown_product(accounts):
+    with pytest.raises(ProductNotFound):
+        post_transaction('NOPE', amount_credit=100)
+
+
+@pytest.mark.parametrize('update_returning', [True, False])
+def test_post_transaction_require_funds(accounts, monkeypatch, update_returning):
+    # both the UPDATE ... RETURNING path and the compare-and-swap fallback
+    monkeypatch.setattr(db.engine.dialect, 'update_returning', update_returning)
+    with pytest.raises(InsufficientFunds):
+        post_transaction('SB1', amount_debit=100001, require_funds=True)
+    db.session.rollback()
+    post_transaction('SB1', amount_debit=100000, require_funds=True)
+    db.session.commit()
+    assert _balances()[0] == 0
+
+
+def test_concurrent_postings_lose_no_updates(app, accounts):
+    threads, per_thread = 4, 25
+
+    def post():
+        with app.app_context():
+            for _ in range(per_thread):
+                post_transaction('SB1', amount_credit=100)
+                db.session.commit()
+
+    workers = [threading.Thread(target=post) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert _balances()[0] == 100000 + threads * per_thread * 100
+    assert Transactions.query.count() == threads * per_thread
+
+
+def test_transfer_posts_both_legs(accounts):
+    debit, credit = transfer('SB1', 'CC1', 20000, user_id=accounts)
+
+    assert (debit.product_id, debit.amount_debit, debit.balance) == ('SB1', 20000, 80000)
+    assert (credit.product_id, credit.amount_credit, credit.balance) == ('CC1', 20000, 30000)
+    assert _balances() == (80000, 30000)
+
+
+def test_transfer_insufficient_funds_leaves_both_untouched(accounts):
+    with pytest.raises(InsufficientFunds):
+        transfer('SB1', 'CC1', 100001)
+    assert _balances() == (100000, 50000)
+    assert Transactions.query.count() == 0
+
+
+@pytest.mark.parametrize('source, destination, amount, user_id, error', [
+    ('SB1', 'SB1', 100, None, InvalidTransaction),
+    ('SB1', 'CC1', 0, None, InvalidTransaction),
+    ('SB1', 'CC1', 1.5, None, InvalidTransaction),
+    ('SB1', 'CC1', 100, 999, InvalidTransaction),
+    ('NOPE', 'CC1', 100, None, ProductNotFound),
+    ('SB1', 'NOPE', 100, None, ProductNotFound),
+])
+def test_transfer_rejects(accounts, source, destination, amount, user_id, error):
+    with pytest.raises(error):
+        transfer(source, destination, amount, user_id=user_id)
+    assert _balances() == (100000, 50000)
+
+
+def test_bulk_reports_per_row_errors(accounts):
+    rows = [
+        {'product_id': 'SB1', 'amount_credit': 10},
+        {'product_id': ['SB1'], 'amount_credit': 10},
+        {'product_id': 'NOPE', 'amount_credit': 10},
+        {'product_id': 'SB1', 'amount_credit': 10 ** 20},
+        {'product_id': 'SB1', 'amount_credit': 1, 'amount_debit': 1},
+        'not a row',
+        {'product_id': 'SB1', 'amount_debit': 5},
+    ]
+    results = list(post_transactions_bulk(rows, chunk_size=3))
+
+    assert [result['status'] for result in results] == ['posted', 'error', 'error', 'error', 'error', 'error', 'posted']
+    assert results[1]['error'] == 'Invalid product_id'
+    assert results[2]['error'] == 'Product not found'
+    assert results[3]['error'] == 'Invalid transaction.'
+    assert [results[0]['new_balance'], results[6]['new_balance']] == [1010.0, 1005.0]
+    assert _balances()[0] == 100500
+
+
+def test_add_transaction_endpoint(client):
+    response = client.post('/add_transaction', json={'product_id': 'SB1', 'amount_credit': '10.10'})
+    assert response.status_code == 201
+    assert response.get_json()['new_balance'] == 1010.1
+
+    for amount in (1e300, 10 ** 20, '0.001', 'abc'):
+        response = client.post('/add_transaction', json={'product_id': 'SB1', 'amount_credit': amount})
+        assert response.status_code == 400
+    assert _balances()[0] == 101010
+
+
+def test_bulk_endpoint(client):
+    response = client.post('/add_transactions/bulk', json=[{'product_id': 'SB1', 'amount_credit': 10 ** 20},
+                                                           {'product_id': 'SB1', 'amount_credit': 1}])
+    assert response.status_code == 200
+    assert (response.get_json()['posted'], response.get_json()['failed']) == (1, 1)
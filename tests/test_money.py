@@ -0,0 +1,55 @@
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func
+
+from .. import db
+from ..models import Product
+from ..money import MAX_AMOUNT, MINOR_UNITS, to_minor, to_major, format_amount
+
+
+@pytest.mark.parametrize('value, expected', [
+    (0, 0),
+    (10, 1000),
+    (10.1, 1010),
+    (0.29, 29),
+    ('12.34', 1234),
+    (' 5.5 ', 550),
+    (Decimal('1.10'), 110),
+    ('-3.25', -325),
+    (MAX_AMOUNT // MINOR_UNITS, MAX_AMOUNT),
+])
+def test_to_minor_parses_exact_paise(value, expected):
+    assert to_minor(value) == expected
+
+
+@pytest.mark.parametrize('value', [
+    '0.001', 1.005, 'abc', '', None, True, [1], {'a': 1}, 'nan', 'inf', float('inf'),
+    '1e-999999', '1e999999', 1e300, 10 ** 20, MAX_AMOUNT // MINOR_UNITS + 1, '-1e12',
+])
+def test_to_minor_rejects_invalid_amounts(value):
+    with pytest.raises(ValueError):
+        to_minor(value)
+
+
+def test_to_major_and_format_amount():
+    assert to_major(123456) == 1234.56
+    assert to_major(None) is None
+    assert format_amount(123450) == '1234.50'
+    assert format_amount(-5) == '-0.05'
+    assert format_amount(0) == '0.00'
+
+
+def test_money_column_refuses_floats(accounts):
+    product = db.session.get(Product, 'SB1')
+    product.current_balance = 10.5
+    with pytest.raises(Exception) as excinfo:
+        db.session.commit()
+    db.session.rollback()
+    assert 'integer minor units' in str(excinfo.value)
+
+
+def test_money_column_returns_int(accounts):
+    total = db.session.query(func.sum(Product.current_balance)).scalar()
+    assert total == 100000 and type(total) is int
+    assert type(db.session.get(Product, 'SB1').current_balance) is int